@@ -0,0 +1,112 @@
+#Bot fleet throughput benchmark for the client library
+#
+#Starts irc_server.py on a free local port and runs --bots ChatClient (thread) or
+#AsyncChatClient (asyncio) bots in this one process. Every bot joins one room and sends
+#--messages messages as fast as the library takes them; a listener in the room counts
+#deliveries. Reports how fast the bots could queue messages and how fast the listener
+#received them, which is the end-to-end rate through the server.
+#
+#    python benchmarks/bots.py --bots 50 --messages 2000 --client thread
+#    python benchmarks/bots.py --bots 50 --messages 2000 --client asyncio
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from irc_client import AsyncChatClient, ChatClient  # noqa: E402
+from load import free_port  # noqa: E402
+
+SERVER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'irc_server.py')
+
+
+def run_thread_bots(port, bots, messages):
+    clients = [ChatClient('127.0.0.1', port, f"bot{i}").connect() for i in range(bots)]
+    for client in clients:
+        client.join('bench')
+        client.flush()
+
+    start = time.perf_counter()
+    for i in range(messages):
+        for client in clients:
+            client.msg('bench', f"message {i}")
+    for client in clients:
+        client.flush()
+    elapsed = time.perf_counter() - start
+    for client in clients:
+        client.close()
+    return elapsed
+
+
+def run_async_bots(port, bots, messages):
+    async def run():
+        clients = [await AsyncChatClient('127.0.0.1', port, f"bot{i}").connect() for i in range(bots)]
+        for client in clients:
+            client.join('bench')
+
+        start = time.perf_counter()
+        for i in range(messages):
+            for client in clients:
+                client.msg('bench', f"message {i}")
+            if i % 100 == 99:
+                await asyncio.gather(*(client.drain() for client in clients))
+        await asyncio.gather(*(client.drain() for client in clients))
+        elapsed = time.perf_counter() - start
+        for client in clients:
+            await client.close()
+        return elapsed
+
+    return asyncio.run(run())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bot fleet throughput benchmark")
+    parser.add_argument('--bots', type=int, default=50)
+    parser.add_argument('--messages', type=int, default=2000, help="Messages sent by each bot")
+    parser.add_argument('--client', choices=('thread', 'asyncio'), default='thread')
+    parser.add_argument('--server-args', default='--engine asyncio --queue-size 1000000')
+    args = parser.parse_args()
+
+    port = free_port()
+    server = subprocess.Popen([sys.executable, SERVER, '--host', '127.0.0.1', '--port', str(port),
+                               '--log-level', 'WARNING', *args.server_args.split()])
+    try:
+        time.sleep(1.0)
+        total = args.bots * args.messages
+        delivered = threading.Event()
+        count = [0]
+
+        def on_message(message):
+            count[0] += 1
+            if count[0] == total:
+                delivered.set()
+
+        listener = ChatClient('127.0.0.1', port, 'listener', on_message=on_message).connect()
+        listener.create('bench')
+        listener.join('bench')
+        listener.flush()
+        time.sleep(0.2)
+
+        start = time.perf_counter()
+        if args.client == 'thread':
+            elapsed = run_thread_bots(port, args.bots, args.messages)
+        else:
+            elapsed = run_async_bots(port, args.bots, args.messages)
+        delivered.wait(60)
+        total_elapsed = time.perf_counter() - start
+        listener.close()
+    finally:
+        server.terminate()
+        server.wait()
+
+    print(f"queued    : {total / elapsed:>10.0f} messages/sec ({args.bots} {args.client} bots)")
+    print(f"delivered : {count[0] / total_elapsed:>10.0f} messages/sec ({count[0]} of {total})")
+
+
+if __name__ == '__main__':
+    main()
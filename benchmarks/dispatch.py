@@ -0,0 +1,145 @@
+#Command dispatch micro-benchmark
+#
+#Feeds a fixed mix of commands straight into IRCServer.process_message (no sockets,
+#one client alone in one room) and compares commands/sec against the old
+#split()/upper()/if-elif parser, copied below as it was. First both call handlers that
+#do nothing, which times parsing and dispatch alone, then both call the server's handlers.
+#
+#    python benchmarks/dispatch.py --commands 200000
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from irc_server import IRCServer  # noqa: E402
+
+COMMAND_MIX = [
+    "MSG bench hello everyone, this is a benchmark message",
+    "MSG bench another message with a few more words in it",
+    "msg bench lower case command name",
+    "WHO bench",
+    "HELP",
+    "NOPE what is this",
+    "JOIN",
+]
+
+
+class NullConnection:
+    #Stand-in client that discards what it is sent
+    def send(self, data):
+        return len(data)
+
+    def close(self):
+        pass
+
+
+def no_op(*args):
+    pass
+
+
+class NoOpHandlers:
+    #The handlers legacy_process_message calls, doing nothing, so only parsing and dispatch are timed
+    create_room = join_room = leave_room = list_rooms = list_room_members = send_room_message = send_help = staticmethod(no_op)
+
+    def __init__(self):
+        self.clients = {}
+
+
+def legacy_process_message(self, client, message):
+    #process_message before the dispatch table, as it was (user-005), with self the server
+    try:
+
+        if not message:
+            return True  # If message is empty, just return
+
+        parts = message.split(' ', 2)  # Split the message into command and arguments
+        command = parts[0].upper()  # Get the command in uppercase
+
+        if command == 'CREATE' and len(parts) >= 2:
+            self.create_room(client, parts[1])
+        elif command == 'JOIN' and len(parts) >= 2:
+            self.join_room(client, parts[1])
+        elif command == 'LEAVE' and len(parts) >= 2:
+            self.leave_room(client, parts[1])
+        elif command == 'LIST':
+            self.list_rooms(client)
+        elif command == 'WHO' and len(parts) >= 2:
+            self.list_room_members(client, parts[1])
+        elif command == 'MSG' and len(parts) >= 3:
+            room_name = parts[1]
+            message_text = parts[2]
+            self.send_room_message(client, room_name, message_text)
+        elif command == 'QUIT':
+            return False  # Indicate to disconnect the client
+        elif command == 'HELP':
+            self.send_help(client)
+        else:
+            client.send(b"ERROR: Unknown command. Type HELP for commands.\n")
+
+        return True  # Indicate that the message was processed successfully
+
+    except Exception as e:
+        nickname = "Unknown"
+        if client in self.clients:
+            nickname = self.clients[client]['nickname']
+        print(f"Error processing message from {nickname}: {e}")
+        client.send(b"ERROR: Failed to process command.\n")
+        return True  # Continue processing other messages
+
+
+def build_server():
+    server = IRCServer()
+    client = NullConnection()
+    server.register_client(client, ('bench', 0), 'bench')
+    server.create_room(client, 'bench')
+    server.join_room(client, 'bench')
+    return server, client
+
+
+def measure(process, commands):
+    mix = COMMAND_MIX
+    size = len(mix)
+    start = time.perf_counter()
+    for i in range(commands):
+        process(mix[i % size])
+    return commands / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Command dispatch micro-benchmark")
+    parser.add_argument('--commands', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    def best(process):
+        return max(measure(process, args.commands) for _ in range(args.repeat))
+
+    #Parsing and dispatch alone: both parsers call handlers that do nothing. The table's
+    #figure includes what process_message does around every command (metrics, rate limits).
+    server, client = build_server()
+    handlers = NoOpHandlers()
+    legacy = best(lambda m: legacy_process_message(handlers, client, m))
+    real_dispatch = server.dispatch
+    server.dispatch = {name: (no_op, latency.timed(no_op), required, maximum, latency, limit)
+                       for name, (_, _, required, maximum, latency, limit) in real_dispatch.items()}
+    current = best(lambda m: server.process_message(client, m))
+    server.dispatch = real_dispatch
+    print("parsing and dispatch, handlers doing nothing:")
+    print(f"  legacy if/elif parser : {legacy:>10.0f} commands/sec ({1e9 / legacy:.0f}ns each)")
+    print(f"  dispatch table        : {current:>10.0f} commands/sec ({1e9 / current:.0f}ns each)")
+    print(f"  speedup               : {current / legacy:>10.2f}x")
+
+    #The whole command, handlers included; the handlers are the same on both sides
+    legacy = best(lambda m: legacy_process_message(server, client, m))
+    current = best(lambda m: server.process_message(client, m))
+    print("with the server's handlers:")
+    print(f"  legacy if/elif parser : {legacy:>10.0f} commands/sec")
+    print(f"  dispatch table        : {current:>10.0f} commands/sec")
+    print(f"  speedup               : {current / legacy:>10.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+#Binary frames and compression benchmark
+#
+#In process, over --messages chat-like room messages:
+#
+#  - bytes on the wire per message as plain lines, frames, and compressed frames (what a
+#    client that sent CAP REQ zlib receives), for chat lines, for long messages and for
+#    HISTORY replies of --history messages; and per command for a bot sending batches of
+#    --batch commands on its compressed stream
+#  - encoding cost of one long message broadcast to --recipients compressed clients, with the
+#    shared encoder (compressed once) and compressing for every recipient (what a compressor
+#    per connection would need)
+#
+#Then end to end against irc_server.py: a sender and --listeners listeners in one room, all
+#with the same capabilities, chat lines per second delivered to every listener.
+#
+#    python benchmarks/frames.py --messages 20000 --recipients 1000 --listeners 20
+#    python benchmarks/frames.py --server-args "--engine asyncio"
+
+import argparse
+import os
+import random
+import shlex
+import socket
+import subprocess
+import sys
+import threading
+import time
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from irc_client import ChatClient  # noqa: E402
+from irc_framing import (COMPRESS_LEVEL, MEM_LEVEL, WINDOW_BITS, ZDICT, FrameEncoder,  # noqa: E402
+                         StreamEncoder, frame)
+from load import free_port  # noqa: E402
+from tls import server_cpu  # noqa: E402
+
+SERVER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'irc_server.py')
+WORDS = ("the a to and of is in it you that for on this was with deploy build failed passed "
+         "merged review ticket ready alert resolved error warning timeout retry queue latency").split()
+
+
+def chat_messages(count, words=(5, 30), seed=1):
+    #Room messages as the server broadcasts them: a few rooms and bots, text of words[0] to words[1] words
+    rng = random.Random(seed)
+    return [f"[room{rng.randrange(5)}] bot{rng.randrange(50)}: "
+            f"{' '.join(rng.choice(WORDS) for _ in range(rng.randrange(*words)))}\n".encode()
+            for _ in range(count)]
+
+
+def wire_sizes(payloads):
+    #Average bytes per payload as lines, frames and compressed frames
+    encoder = FrameEncoder(compress=True)
+    sizes = (sum(map(len, payloads)), sum(len(FrameEncoder().encode(payload)) for payload in payloads),
+             sum(len(encoder.encode(payload)) for payload in payloads))
+    return [size / len(payloads) for size in sizes]
+
+
+def stream_sizes(messages, batch):
+    #Average bytes per MSG command as lines and on a compressed stream, written batch at a time
+    commands = [b"MSG " + message[message.index(b':') + 2:] for message in messages]
+    stream = StreamEncoder(compress=True)
+    sent = sum(len(stream.encode(b''.join(commands[i:i + batch]))) for i in range(0, len(commands), batch))
+    return sum(map(len, commands)) / len(commands), sent / len(commands)
+
+
+def broadcast_cost(messages, recipients):
+    #Seconds per broadcast to recipients compressed clients: shared encoder vs one compress each
+    encoder = FrameEncoder(compress=True)
+    start = time.perf_counter()
+    for message in messages:
+        for _ in range(recipients):
+            encoder.encode(message)
+    shared = (time.perf_counter() - start) / len(messages)
+
+    sample = messages[:max(1, len(messages) // recipients)]  # Enough to time without waiting minutes
+    start = time.perf_counter()
+    for message in sample:
+        for _ in range(recipients):
+            compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, -WINDOW_BITS, MEM_LEVEL, zdict=ZDICT)
+            frame(compressor.compress(message) + compressor.flush(), True)
+    each = (time.perf_counter() - start) / len(sample)
+    return shared, each
+
+
+def message_rate(host, port, messages, listeners, capabilities):
+    #Room messages/sec delivered to every listener
+    done = threading.Event()
+    counts = [0] * listeners
+    finished = [0]
+    lock = threading.Lock()
+
+    def counter(index):
+        def on_message(message):
+            counts[index] += 1
+            if counts[index] == len(messages):
+                with lock:
+                    finished[0] += 1
+                    if finished[0] == listeners:
+                        done.set()
+        return on_message
+
+    clients = [ChatClient(host, port, f"listener{i}", on_message=counter(i), capabilities=capabilities).connect()
+               for i in range(listeners)]
+    sender = ChatClient(host, port, 'sender', capabilities=capabilities).connect()
+    sender.create('bench')
+    sender.join('bench')
+    sender.flush()
+    time.sleep(0.2)
+    for client in clients:
+        client.join('bench')
+        client.flush()
+    time.sleep(0.5)
+
+    texts = [message[message.index(b':') + 2:-1].decode() for message in messages]
+    start = time.perf_counter()
+    for text in texts:
+        sender.msg('bench', text)
+    finished_in_time = done.wait(120)
+    elapsed = time.perf_counter() - start
+    for client in clients + [sender]:
+        client.close()
+    if not finished_in_time:
+        print(f"  only {min(counts)} of {len(messages)} messages reached every listener")
+    return min(counts) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Binary frames and compression benchmark")
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--batch', type=int, default=100, help="Commands per write of the sending bot")
+    parser.add_argument('--history', type=int, default=50, help="Messages per HISTORY reply")
+    parser.add_argument('--recipients', type=int, default=1000, help="Compressed clients per broadcast")
+    parser.add_argument('--listeners', type=int, default=20, help="Listening clients in the end to end test")
+    parser.add_argument('--server-args', default='--queue-size 1000000',
+                        help="Arguments for the irc_server.py this starts, e.g. \"--engine asyncio\"")
+    args = parser.parse_args()
+
+    messages = chat_messages(args.messages)
+    long_messages = chat_messages(args.messages, (60, 100))
+    replies = [b''.join(messages[i:i + args.history]) for i in range(0, len(messages), args.history)]
+    print("Bytes received per payload:")
+    for name, payloads in (("chat line", messages), ("long message", long_messages),
+                           (f"HISTORY {args.history}", replies)):
+        plain, framed, compressed = wire_sizes(payloads)
+        print(f"  {name:<13}: lines {plain:>7.1f}, frames {framed:>7.1f}, zlib {compressed:>7.1f} ({compressed / plain:.0%})")
+    commands, sent = stream_sizes(messages, args.batch)
+    print(f"Bytes per MSG sent in batches of {args.batch}: lines {commands:.1f}, "
+          f"zlib stream {sent:.1f} ({sent / commands:.0%})")
+    shared, each = broadcast_cost(long_messages, args.recipients)
+    print(f"Encoding one long message for {args.recipients} zlib clients: shared frame {shared * 1e6:.1f}us, "
+          f"compressed per recipient {each * 1e6:.1f}us")
+
+    host, port = '127.0.0.1', free_port()
+    server = subprocess.Popen([sys.executable, SERVER, '--host', host, '--port', str(port),
+                               '--log-level', 'WARNING', *shlex.split(args.server_args)])
+    try:
+        for _ in range(100):
+            try:
+                socket.create_connection((host, port)).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+
+        print(f"{args.messages} messages to {args.listeners} listeners")
+        for name, capabilities in (("lines", ()), ("frames", ('frames',)), ("zlib", ('zlib',))):
+            cpu = server_cpu(server.pid)
+            rate = message_rate(host, port, messages, args.listeners, capabilities)
+            line = f"{name:<7}: {rate:>8.0f} messages/sec"
+            if cpu is not None:
+                line += f", server CPU {(server_cpu(server.pid) - cpu) / args.messages * 1e6:.1f}us per message"
+            print(line)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == '__main__':
+    main()
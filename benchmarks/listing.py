@@ -0,0 +1,130 @@
+#LIST/WHO benchmark for large deployments
+#
+#Builds an in-process IRCServer (no sockets) with --rooms rooms and one room of --members
+#members, then times LIST and WHO pages: the first page, a prefix and a glob filter, the
+#busiest rooms (sort=-size), and walking every page with the cursor. The old LIST and WHO,
+#which built one string of every room or member with +=, are reproduced below for
+#comparison.
+#
+#    python benchmarks/listing.py --rooms 50000 --members 100000
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from irc_listing import SortedNames  # noqa: E402
+from irc_server import IRCServer  # noqa: E402
+
+
+class CountingConnection:
+    #Stand-in client that keeps the last reply it was sent
+    def __init__(self):
+        self.address = ('bench', 0)
+        self.last = b''
+        self.sends = 0
+
+    def send(self, data):
+        self.last = data
+        self.sends += 1
+        return len(data)
+
+    def close(self):
+        pass
+
+
+def build_server(rooms, members):
+    server = IRCServer(ping_interval=0)
+    client = CountingConnection()
+    server.register_client(client, client.address, 'bench')
+    names = [f"room-{i:06d}" for i in range(rooms)]
+    server.rooms = {name: server.new_room(name) for name in names}  # Directly, as recovery from the log does
+    server.room_names = SortedNames(server.rooms)
+
+    big = server.rooms[names[0]]
+    member_map = {}
+    nicknames = [f"user{i:06d}" for i in range(members)]
+    random.Random(1).shuffle(nicknames)  # Members of a room are in the order they joined, not by name
+    for nickname in nicknames:
+        connection = CountingConnection()
+        server.register_client(connection, connection.address, nickname)
+        member_map[server.clients[connection].id] = connection
+    big.members = member_map
+    for i, name in enumerate(names[1:1000]):
+        server.rooms[name].members = dict(list(member_map.items())[:i % 50])
+    return server, client, names[0]
+
+
+def legacy_list(server, client):
+    #LIST before pagination
+    rooms = server.rooms
+    room_list = "ROOMS:\n"
+    for room_name, room in rooms.items():
+        room_list += f" - {room_name} ({len(room.members) + len(room.remote_members)} members)\n"
+    client.send(room_list.encode())
+
+
+def legacy_who(server, client, room_name):
+    #WHO before pagination
+    room = server.rooms[room_name]
+    member_list = f"Members in room '{room_name}':\n"
+    for session_id in room.members:
+        session = server.sessions.get(session_id)
+        if session is not None:
+            member_list += f" - {session.nickname}\n"
+    client.send(member_list.encode())
+
+
+def walk(command, client):
+    #Follow the MORE cursors until the last page; returns the number of pages
+    pages = 0
+    after = None
+    while True:
+        command(after)
+        pages += 1
+        last = client.last.decode().rstrip('\n').rpartition('\n')[2]
+        if not last.startswith('MORE: after='):
+            return pages
+        after = last[len('MORE: after='):]
+
+
+def timed(function, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LIST/WHO benchmark")
+    parser.add_argument('--rooms', type=int, default=50000)
+    parser.add_argument('--members', type=int, default=100000)
+    args = parser.parse_args()
+
+    server, client, big = build_server(args.rooms, args.members)
+    cases = [
+        ("old LIST (everything)", lambda: legacy_list(server, client)),
+        ("LIST", lambda: server.list_rooms(client)),
+        ("LIST room-0123", lambda: server.list_rooms(client, 'room-0123')),
+        ("LIST room-01*5", lambda: server.list_rooms(client, 'room-01*5')),
+        ("LIST sort=-size", lambda: server.list_rooms(client, 'sort=-size')),
+        ("LIST, every page", lambda: walk(lambda after: server.list_rooms(
+            client, *(['limit=1000', f'after={after}'] if after else ['limit=1000'])), client)),
+        ("old WHO (everything)", lambda: legacy_who(server, client, big)),
+        ("WHO", lambda: server.list_room_members(client, big)),
+        ("WHO user01*", lambda: server.list_room_members(client, big, 'user01*')),
+    ]
+    print(f"{args.rooms} rooms, {args.members} members in {big}")
+    for name, function in cases:
+        elapsed, pages = timed(function, 1 if 'every' in name else 5)
+        suffix = f" ({pages} pages)" if pages else f" ({len(client.last)} bytes in the last send)"
+        print(f"{name:<22}: {elapsed * 1000:>9.2f}ms{suffix}")
+
+
+if __name__ == '__main__':
+    main()
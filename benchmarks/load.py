@@ -0,0 +1,255 @@
+#Load generator for a running IRC server
+#
+#Starts irc_server.py on a free local port (or uses --connect HOST:PORT), connects
+#--clients synthetic clients that join rooms and send MSG at a configurable rate, and
+#reports messages/sec, deliveries/sec, p50/p99 delivery latency and server RSS. Every
+#message carries its send time, so latency is measured from the sender's write to each
+#member's read. Room sizes and send times come from a seeded random generator, so a run
+#is reproducible; --save writes the results as JSON and --baseline compares against a
+#saved run.
+#
+#    python benchmarks/load.py --clients 2000 --rooms 50 --rate 1 --duration 10
+#    python benchmarks/load.py --server-args "--engine asyncio" --save asyncio.json
+#    python benchmarks/load.py --server-args "--engine asyncio --workers 4" --baseline asyncio.json
+#
+#One harness process tops out well below what the server can deliver, so large runs
+#should spread the clients over several with --processes.
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import shlex
+import socket
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from irc_server import raise_fd_limit  # noqa: E402
+
+SERVER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'irc_server.py')
+STAMP = 't='  # Messages are "t=<send time in ns> <padding>"
+
+
+def room_sizes(clients, rooms, distribution, skew, rng):
+    #Which room each client joins: uniform spreads them evenly, zipf gives a few big rooms
+    if distribution == 'uniform':
+        return [i % rooms for i in range(clients)]
+    weights = [1.0 / (rank + 1) ** skew for rank in range(rooms)]
+    return rng.choices(range(rooms), weights=weights, k=clients)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def server_rss(pid):
+    #Resident set size of the server and its worker processes, in bytes
+    total = 0
+    pids = [pid]
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as children:
+            pids += [int(child) for child in children.read().split()]
+    except OSError:
+        pass
+    for process_id in pids:
+        try:
+            with open(f'/proc/{process_id}/status') as status:
+                for line in status:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+        except OSError:
+            pass
+    return total or None
+
+
+async def open_client(host, port, nickname):
+    reader, writer = await asyncio.open_connection(host, port, limit=1 << 20)
+    writer.write(f"NICK {nickname}\n".encode())
+    while True:
+        line = await reader.readline()  # The nickname prompt has no line ending, so it arrives with the welcome
+        if not line:
+            raise ConnectionError(f"{nickname}: server closed the connection")
+        if b'Welcome' in line:
+            return reader, writer
+        if b'ERROR' in line:
+            raise ConnectionError(f"{nickname}: {line.decode().strip()}")
+
+
+async def receive(reader, stats):
+    #Count deliveries and record their latency until the connection closes
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        now = time.monotonic_ns()
+        if line.startswith(b'['):
+            stamp = line.find(STAMP.encode())
+            if stamp >= 0:
+                end = line.find(b' ', stamp)
+                stats['received'] += 1
+                stats['latencies'].append(now - int(line[stamp + 2:end]))
+
+
+async def send(writer, room_name, rate, poisson, padding, start, stop, rng, stats):
+    #Send MSG at the given rate from start until stop (monotonic seconds)
+    await asyncio.sleep(max(0.0, start - time.monotonic()) + rng.random() / rate)  # Spread the first messages
+    while time.monotonic() < stop:
+        writer.write(f"MSG {room_name} {STAMP}{time.monotonic_ns()} {padding}\n".encode())
+        stats['sent'] += 1
+        await asyncio.sleep(rng.expovariate(rate) if poisson else 1.0 / rate)
+
+
+async def run_clients(options, members, first_id, start, stop, seed):
+    #One harness process: connect its share of clients, send until stop, then drain for a moment
+    rng = random.Random(seed)
+    stats = {'sent': 0, 'received': 0, 'latencies': [], 'errors': 0}
+    padding = 'x' * max(0, options['message_size'] - 30)
+    connections = []
+    for offset, room in enumerate(members):
+        try:
+            reader, writer = await open_client(options['host'], options['port'], f"load{first_id + offset}")
+        except (OSError, ConnectionError):
+            stats['errors'] += 1
+            continue
+        writer.write(f"JOIN room{room}\n".encode())
+        connections.append((reader, writer, room))
+
+    receivers = [asyncio.ensure_future(receive(reader, stats)) for reader, _, _ in connections]
+    await asyncio.gather(*(send(writer, f"room{room}", options['rate'], options['poisson'], padding,
+                                start, stop, random.Random(rng.random()), stats)
+                           for _, writer, room in connections))
+    await asyncio.sleep(options['drain'])
+
+    for _, writer, _ in connections:
+        writer.close()
+    for receiver in receivers:
+        receiver.cancel()
+    await asyncio.gather(*receivers, return_exceptions=True)
+    return stats
+
+
+def run_process(options, members, first_id, start, stop, seed):
+    raise_fd_limit()
+    return asyncio.run(run_clients(options, members, first_id, start, stop, seed))
+
+
+def create_rooms(host, port, rooms):
+    with socket.create_connection((host, port)) as sock:
+        sock.recv(1024)
+        sock.sendall(b"NICK loadsetup\n" + b"".join(f"CREATE room{i}\n".encode() for i in range(rooms)))
+        time.sleep(0.5)
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load generator for the IRC server")
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--rooms', type=int, default=20)
+    parser.add_argument('--room-sizes', choices=('uniform', 'zipf'), default='uniform',
+                        help="How clients are spread over rooms (default: uniform)")
+    parser.add_argument('--zipf-skew', type=float, default=1.1)
+    parser.add_argument('--rate', type=float, default=1.0, help="Messages/sec sent by each client (default: 1)")
+    parser.add_argument('--arrivals', choices=('constant', 'poisson'), default='poisson',
+                        help="Gaps between one client's messages (default: poisson)")
+    parser.add_argument('--message-size', type=int, default=64, help="Bytes of message text (default: 64)")
+    parser.add_argument('--duration', type=float, default=10.0, help="Seconds of sending (default: 10)")
+    parser.add_argument('--drain', type=float, default=2.0, help="Seconds to keep reading after sending stops")
+    parser.add_argument('--processes', type=int, default=1, help="Harness processes to spread clients over")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--server-args', default='--engine asyncio',
+                        help="Arguments for the irc_server.py this starts (default: --engine asyncio)")
+    parser.add_argument('--connect', default=None, metavar='HOST:PORT',
+                        help="Use a server that is already running instead of starting one")
+    parser.add_argument('--save', default=None, metavar='FILE', help="Write the results as JSON")
+    parser.add_argument('--baseline', default=None, metavar='FILE', help="Compare with results saved by --save")
+    args = parser.parse_args()
+
+    raise_fd_limit()
+    server = None
+    if args.connect:
+        host, _, port = args.connect.rpartition(':')
+        host, port = host or 'localhost', int(port)
+    else:
+        host, port = '127.0.0.1', free_port()
+        server = subprocess.Popen([sys.executable, SERVER, '--host', host, '--port', str(port),
+                                   '--log-level', 'WARNING', *shlex.split(args.server_args)])
+    try:
+        for _ in range(100):
+            try:
+                socket.create_connection((host, port)).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+        create_rooms(host, port, args.rooms)
+        rss_idle = server_rss(server.pid) if server else None
+
+        rng = random.Random(args.seed)
+        members = room_sizes(args.clients, args.rooms, args.room_sizes, args.zipf_skew, rng)
+        options = dict(host=host, port=port, rate=args.rate, poisson=args.arrivals == 'poisson',
+                       message_size=args.message_size, drain=args.drain)
+        share = -(-args.clients // args.processes)
+        connect_time = 1.0 + args.clients / 2000  # Time allowed for every client to connect before sending starts
+        start = time.monotonic() + connect_time
+        stop = start + args.duration
+        jobs = [(options, members[i:i + share], i, start, stop, rng.random())
+                for i in range(0, args.clients, share)]
+
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(len(jobs)) as pool:
+            pending = pool.starmap_async(run_process, jobs)
+            rss_peak = rss_idle or 0
+            while not pending.ready():
+                pending.wait(0.5)
+                if server:
+                    rss_peak = max(rss_peak, server_rss(server.pid) or 0)
+            results = pending.get()
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    sent = sum(result['sent'] for result in results)
+    received = sum(result['received'] for result in results)
+    latencies = sorted(latency for result in results for latency in result['latencies'])
+    summary = {
+        'clients': args.clients,
+        'rooms': args.rooms,
+        'server_args': None if args.connect else args.server_args,
+        'connect_errors': sum(result['errors'] for result in results),
+        'sent_per_sec': sent / args.duration,
+        'delivered_per_sec': received / args.duration,
+        'p50_ms': percentile(latencies, 0.50) / 1e6,
+        'p99_ms': percentile(latencies, 0.99) / 1e6,
+        'rss_idle_mb': rss_idle / (1 << 20) if rss_idle else None,
+        'rss_peak_mb': rss_peak / (1 << 20) if server else None,
+    }
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    for key, value in summary.items():
+        line = f"{key:<18}: {value:.2f}" if isinstance(value, float) else f"{key:<18}: {value}"
+        if baseline and isinstance(value, float) and baseline.get(key):
+            line += f"  (baseline {baseline[key]:.2f}, {value / baseline[key]:.2f}x)"
+        print(line)
+
+    if args.save:
+        with open(args.save, 'w') as save_file:
+            json.dump(summary, save_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+#Reconnect storm benchmark for connection admission
+#
+#Starts irc_server.py on a free local port and opens --clients connections all at once, as
+#happens when every client reconnects after a network blip. Each client registers with NICK,
+#waits for the welcome and disconnects. Reports how many clients were admitted per second
+#and how many failed: refused by admission control, reset or refused by the kernel when the
+#accept backlog overflowed, or timed out. Compare a small and a large listen backlog with
+#
+#    python benchmarks/reconnect_storm.py --clients 5000 --server-args "--backlog 5"
+#    python benchmarks/reconnect_storm.py --clients 5000 --server-args "--backlog 1024"
+#    python benchmarks/reconnect_storm.py --clients 5000 --server-args "--engine asyncio --backlog 1024"
+
+import argparse
+import asyncio
+import os
+import shlex
+import socket
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from irc_server import raise_fd_limit  # noqa: E402
+from load import free_port  # noqa: E402
+
+SERVER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'irc_server.py')
+
+
+async def reconnect(host, port, nickname, timeout, results):
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    except asyncio.TimeoutError:
+        results['timeout'] += 1
+        return
+    except OSError:
+        results['reset'] += 1
+        return
+    try:
+        writer.write(f"NICK {nickname}\n".encode())
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout)
+            if not line:
+                results['reset'] += 1
+                break
+            if b'Welcome' in line:
+                results['admitted'] += 1
+                break
+            if b'ERROR' in line:
+                results['refused'] += 1
+                break
+    except asyncio.TimeoutError:
+        results['timeout'] += 1
+    except OSError:
+        results['reset'] += 1
+    finally:
+        writer.close()
+
+
+async def storm(host, port, clients, timeout):
+    results = {'admitted': 0, 'refused': 0, 'reset': 0, 'timeout': 0}
+    start = time.perf_counter()
+    await asyncio.gather(*(reconnect(host, port, f"storm{i}", timeout, results) for i in range(clients)))
+    return results, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconnect storm benchmark")
+    parser.add_argument('--clients', type=int, default=2000, help="Connections opened at once (default: 2000)")
+    parser.add_argument('--timeout', type=float, default=10.0, help="Seconds a client waits before giving up")
+    parser.add_argument('--server-args', default='',
+                        help="Arguments for the irc_server.py this starts, e.g. \"--backlog 5\"")
+    args = parser.parse_args()
+
+    raise_fd_limit()
+    host, port = '127.0.0.1', free_port()
+    server = subprocess.Popen([sys.executable, SERVER, '--host', host, '--port', str(port),
+                               '--log-level', 'WARNING', *shlex.split(args.server_args)])
+    try:
+        for _ in range(100):
+            try:
+                socket.create_connection((host, port)).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+        results, elapsed = asyncio.run(storm(host, port, args.clients, args.timeout))
+    finally:
+        server.terminate()
+        server.wait()
+
+    print(f"admitted : {results['admitted']:>6} ({results['admitted'] / elapsed:.0f} clients/sec, {elapsed:.2f}s)")
+    print(f"refused  : {results['refused']:>6} (admission control)")
+    print(f"reset    : {results['reset']:>6} (refused or reset by the kernel)")
+    print(f"timeout  : {results['timeout']:>6}")
+
+
+if __name__ == '__main__':
+    main()
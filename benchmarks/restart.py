@@ -0,0 +1,157 @@
+#Restart benchmark: what a deploy costs the clients
+#
+#Starts irc_server.py on a free local port with a write-ahead log (so a plain restart keeps
+#its rooms too), connects --clients ChatClients to one room and has a sender post --rate
+#numbered messages per second for --seconds. Half way through the server is replaced:
+#
+#  - plain: SIGTERM (the old server drains and says goodbye), then a new server; every
+#    client reconnects on its own backoff, a reconnect storm
+#  - handoff: a new server started with the same --handoff path takes over the port, the
+#    connections and the rooms, and the old one exits; nobody reconnects
+#
+#For each, the clients that had to reconnect, how long until the last of them was back, the
+#messages lost per client, and the longest pause in delivery any client saw.
+#
+#    python benchmarks/restart.py --clients 200 --rate 200
+#    python benchmarks/restart.py --server-args "--engine asyncio"
+
+import argparse
+import os
+import shlex
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from irc_client import ChatClient  # noqa: E402
+from load import free_port  # noqa: E402
+
+SERVER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'irc_server.py')
+
+
+class Listener(ChatClient):
+    #Counts its connections, the numbered messages it got and the longest wait between two
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.connections = 0
+        self.reconnected_at = None
+        self.numbers = set()
+        self.last = None
+        self.longest_gap = 0.0
+
+    def open_connection(self):
+        super().open_connection()
+        self.connections += 1
+        if self.connections > 1:
+            self.reconnected_at = time.perf_counter()
+
+    def count(self, message):
+        now = time.perf_counter()
+        self.numbers.add(int(message.text))
+        if self.last is not None:
+            self.longest_gap = max(self.longest_gap, now - self.last)
+        self.last = now
+
+
+def start_server(host, port, directory, handoff, server_args):
+    command = [sys.executable, SERVER, '--host', host, '--port', str(port), '--log-level', 'WARNING',
+               '--log', os.path.join(directory, 'rooms.log'), *shlex.split(server_args)]
+    if handoff:
+        command += ['--handoff', os.path.join(directory, 'handoff.sock')]
+    return subprocess.Popen(command)
+
+
+def wait_for_port(host, port):
+    for _ in range(100):
+        try:
+            socket.create_connection((host, port)).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+
+
+def run(mode, host, args):
+    #One restart under traffic; returns the figures printed for it
+    handoff = mode == 'handoff'
+    port = free_port()
+    with tempfile.TemporaryDirectory() as directory:
+        server = start_server(host, port, directory, handoff, args.server_args)
+        wait_for_port(host, port)
+        sender = ChatClient(host, port, 'sender').connect()
+        sender.create('bench')
+        sender.join('bench')
+        sender.flush()
+        time.sleep(0.2)
+        listeners = []
+        for i in range(args.clients):
+            listener = Listener(host, port, f"listener{i}")
+            listener.on_message = listener.count
+            listeners.append(listener.connect())
+            listener.join('bench')
+        time.sleep(1.0)
+
+        total = int(args.rate * args.seconds)
+        restarted = threading.Event()
+        restart_at = [0.0]
+
+        def restart():
+            nonlocal server
+            restart_at[0] = time.perf_counter()
+            if handoff:
+                replacement = start_server(host, port, directory, True, args.server_args)
+                server.wait()
+            else:
+                server.terminate()
+                server.wait()
+                replacement = start_server(host, port, directory, False, args.server_args)
+            server = replacement
+            restarted.set()
+
+        try:
+            start = time.perf_counter()
+            for number in range(total):
+                if number == total // 2:
+                    threading.Thread(target=restart, daemon=True).start()
+                sender.msg('bench', str(number))
+                time.sleep(max(0.0, start + (number + 1) / args.rate - time.perf_counter()))
+            restarted.wait(30)
+            sender.flush(10)
+            deadline = time.perf_counter() + 15
+            while time.perf_counter() < deadline and any(len(listener.numbers) < total for listener in listeners):
+                time.sleep(0.1)
+        finally:
+            for listener in listeners + [sender]:
+                listener.close()
+            server.terminate()
+            server.wait()
+
+    reconnected = [listener for listener in listeners if listener.connections > 1]
+    back = max((listener.reconnected_at - restart_at[0] for listener in reconnected), default=0.0)
+    lost = sum(total - len(listener.numbers) for listener in listeners) / len(listeners)
+    gap = max(listener.longest_gap for listener in listeners)
+    return len(reconnected), back, lost, gap
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Restart benchmark")
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--rate', type=float, default=200, help="Messages per second from the sender")
+    parser.add_argument('--seconds', type=float, default=6, help="Length of each run")
+    parser.add_argument('--server-args', default='--queue-size 100000',
+                        help="Arguments for the irc_server.py this starts, e.g. \"--engine asyncio\"")
+    args = parser.parse_args()
+
+    host = '127.0.0.1'
+    print(f"{args.clients} clients, {args.rate:g} messages/sec, restarted half way through")
+    for mode in ('plain', 'handoff'):
+        reconnected, back, lost, gap = run(mode, host, args)
+        print(f"{mode:<8}: {reconnected:>5} reconnected (last after {back:.2f}s), "
+              f"{lost:>7.1f} messages lost per client, longest pause {gap * 1000:.0f}ms")
+
+
+if __name__ == '__main__':
+    main()
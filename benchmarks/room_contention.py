@@ -0,0 +1,126 @@
+#Contention benchmark for IRCServer room locking
+#
+#Runs one sender thread per room against an in-process server (no sockets) and
+#reports messages/sec and the time senders spent waiting for locks, once with the
+#per-room locks and once with every room sharing the server lock (the old design).
+#
+#    python benchmarks/room_contention.py --rooms 1 2 4 8 --members 50 --seconds 2
+#
+#--send-delay makes each delivery sleep for that many microseconds while the room
+#lock is held, standing in for a socket write that releases the GIL.
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from irc_server import IRCServer  # noqa: E402
+
+
+class NullConnection:
+    #Stand-in client that only counts what it is sent
+    def __init__(self, send_delay):
+        self.send_delay = send_delay
+        self.received = 0
+
+    def send(self, data):
+        self.received += 1
+        if self.send_delay:
+            time.sleep(self.send_delay)
+        return len(data)
+
+    def close(self):
+        pass
+
+
+class TimedLock:
+    #Lock wrapper that accumulates how long acquirers waited
+    def __init__(self, lock):
+        self.lock = lock
+        self.waited = 0.0
+        self.stats_lock = threading.Lock()
+
+    def __enter__(self):
+        start = time.perf_counter()
+        self.lock.acquire()
+        waited = time.perf_counter() - start
+        with self.stats_lock:
+            self.waited += waited
+        return self
+
+    def __exit__(self, *exc):
+        self.lock.release()
+
+
+def build_server(rooms, members, send_delay, shared_lock):
+    server = IRCServer()
+    null = open(os.devnull, 'w')
+    stdout, sys.stdout = sys.stdout, null  # The server prints every join
+    try:
+        senders = []
+        for r in range(rooms):
+            room_name = f"room{r}"
+            clients = [NullConnection(send_delay) for _ in range(members)]
+            for i, client in enumerate(clients):
+                server.register_client(client, ('bench', 0), f"{room_name}-user{i}")
+            server.create_room(clients[0], room_name)
+            for client in clients:
+                server.join_room(client, room_name)
+            senders.append((clients[0], room_name))
+    finally:
+        sys.stdout = stdout
+        null.close()
+
+    base_lock = threading.Lock() if shared_lock else None
+    for room in server.rooms.values():
+        room.lock = TimedLock(base_lock if shared_lock else threading.Lock())
+    return server, senders
+
+
+def run(rooms, members, seconds, send_delay, shared_lock):
+    server, senders = build_server(rooms, members, send_delay, shared_lock)
+    counts = [0] * rooms
+    stop = threading.Event()
+
+    def sender(index, client, room_name):
+        n = 0
+        while not stop.is_set():
+            server.send_room_message(client, room_name, "benchmark message")
+            n += 1
+        counts[index] = n
+
+    threads = [threading.Thread(target=sender, args=(i, client, room_name))
+               for i, (client, room_name) in enumerate(senders)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    messages = sum(counts)
+    waited = sum(room.lock.waited for room in server.rooms.values())
+    return messages / seconds, (waited / messages * 1e6) if messages else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Room lock contention benchmark")
+    parser.add_argument('--rooms', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--members', type=int, default=50)
+    parser.add_argument('--seconds', type=float, default=2.0)
+    parser.add_argument('--send-delay', type=float, default=0.0, help="Microseconds slept per delivery")
+    args = parser.parse_args()
+
+    send_delay = args.send_delay / 1e6
+    print(f"{'rooms':>5}  {'locking':>9}  {'msgs/sec':>10}  {'wait us/msg':>11}")
+    for rooms in args.rooms:
+        for label, shared in (('global', True), ('per-room', False)):
+            rate, wait = run(rooms, args.members, args.seconds, send_delay, shared)
+            print(f"{rooms:>5}  {label:>9}  {rate:>10.0f}  {wait:>11.1f}")
+
+
+if __name__ == '__main__':
+    main()
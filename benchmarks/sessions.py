@@ -0,0 +1,135 @@
+#Session memory benchmark
+#
+#Registers --sessions clients with an in-process IRCServer (no sockets) and joins each
+#to --rooms-per-session of --rooms rooms, then measures with tracemalloc how much memory
+#the sessions and room memberships take. The same clients are also built the old way,
+#reproduced below: a dict per client with a set of room names, and rooms holding the
+#connection objects. Also times WHO on one room and a membership check for both.
+#
+#    python benchmarks/sessions.py --sessions 100000 --rooms 1000
+
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from irc_server import IRCServer  # noqa: E402
+
+
+class NullConnection:
+    #Stand-in client that discards what it is sent
+    def __init__(self, address):
+        self.address = address
+
+    def send(self, data):
+        return len(data)
+
+    def close(self):
+        pass
+
+
+def room_choices(sessions, rooms, rooms_per_session):
+    return [[(i + k * 7919) % rooms for k in range(rooms_per_session)] for i in range(sessions)]
+
+
+def build_sessions(connections, nicknames, choices, rooms):
+    #The current representation, through the server's own register and join
+    server = IRCServer(ping_interval=0)
+    founder = NullConnection(('bench', 0))
+    server.register_client(founder, founder.address, 'founder')
+    for r in range(rooms):
+        server.create_room(founder, f"room{r}")
+    server.disconnect_client(founder)
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for connection, nickname, chosen in zip(connections, nicknames, choices):
+        server.register_client(connection, connection.address, nickname)
+        for r in chosen:
+            server.join_room(connection, f"room{r}")  # A fresh string, as parsed from a command
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return server, used
+
+
+def build_legacy(connections, nicknames, choices, rooms):
+    #Per-client dicts and rooms of connection objects, as the server kept them before sessions
+    clients = {}
+    members = {f"room{r}": frozenset() for r in range(rooms)}
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for connection, nickname, chosen in zip(connections, nicknames, choices):
+        info = clients[connection] = {
+            'nickname': nickname,
+            'address': connection.address,
+            'rooms': set(),
+            'buckets': {},
+            'strikes': None,
+        }
+        for r in chosen:
+            room_name = f"room{r}"
+            members[room_name] = members[room_name] | {connection}
+            info['rooms'].add(room_name)
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return clients, members, used
+
+
+def legacy_who(clients, members):
+    member_list = "Members:\n"
+    for member in members:
+        info = clients.get(member)
+        if info is not None:
+            member_list += f" - {info['nickname']}\n"
+    return member_list
+
+
+def best_of(function, repeat=20):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Session memory benchmark")
+    parser.add_argument('--sessions', type=int, default=100000)
+    parser.add_argument('--rooms', type=int, default=1000)
+    parser.add_argument('--rooms-per-session', type=int, default=2)
+    args = parser.parse_args()
+
+    connections = [NullConnection(('10.0.0.1', 40000 + i % 20000)) for i in range(args.sessions)]
+    nicknames = [f"user{i}" for i in range(args.sessions)]
+    choices = room_choices(args.sessions, args.rooms, args.rooms_per_session)
+
+    clients, members, legacy_used = build_legacy(connections, nicknames, choices, args.rooms)
+    server, used = build_sessions(connections, nicknames, choices, args.rooms)
+
+    print(f"{args.sessions} sessions, {args.rooms_per_session} of {args.rooms} rooms each")
+    print(f"memory   : {used / args.sessions:>8.0f} bytes/session (dicts: {legacy_used / args.sessions:.0f}, "
+          f"{legacy_used / used:.2f}x)")
+
+    client, room = connections[0], server.rooms['room0']
+    legacy_members = members['room0']
+    who = best_of(lambda: server.list_room_members(client, 'room0'))
+    old_who = best_of(lambda: legacy_who(clients, legacy_members))
+    print(f"WHO      : {who * 1e6:>8.1f}us for {len(room.members)} members (dicts: {old_who * 1e6:.1f}us)")
+
+    checks = connections[:10000]
+    sessions = [server.clients[c] for c in checks]  # Handlers look up the session once per command anyway
+    member = best_of(lambda: [s.id in room.members for s in sessions], 5)
+    old_member = best_of(lambda: [c in legacy_members for c in checks], 5)
+    print(f"member?  : {member / len(checks) * 1e9:>8.0f}ns per check (dicts: {old_member / len(checks) * 1e9:.0f}ns)")
+
+
+if __name__ == '__main__':
+    main()
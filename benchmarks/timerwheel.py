@@ -0,0 +1,69 @@
+#Keepalive timer benchmark
+#
+#Tracks --connections idle timers with irc_timerwheel.TimerWheel, the way the server does
+#with --ping-interval, and with a scan of every connection on every tick (the simple
+#alternative). Every connection stays active, so each timer that goes off is set again.
+#Reports the time per tick for both; the wheel only touches the timers that are due, so
+#its cost follows the connections expiring per tick rather than all connections.
+#
+#    python benchmarks/timerwheel.py --connections 10000 100000 --interval 60
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from irc_timerwheel import TimerWheel  # noqa: E402
+
+
+class Connection:
+    __slots__ = ('seen', 'due')
+
+    def __init__(self):
+        self.seen = True
+        self.due = 0.0
+
+
+def run_wheel(connections, interval, ticks):
+    wheel = TimerWheel()
+    clients = [Connection() for _ in range(connections)]
+    for i, client in enumerate(clients):
+        wheel.schedule(client, 1 + i % interval)  # Spread the timers over one interval
+
+    start = time.perf_counter()
+    for _ in range(ticks):
+        wheel.schedule_many([client for client in wheel.advance() if client.seen], interval)
+    return (time.perf_counter() - start) / ticks
+
+
+def run_scan(connections, interval, ticks):
+    clients = [Connection() for _ in range(connections)]
+    for i, client in enumerate(clients):
+        client.due = 1 + i % interval
+
+    start = time.perf_counter()
+    for now in range(1, ticks + 1):
+        for client in clients:
+            if client.due <= now and client.seen:
+                client.due = now + interval
+    return (time.perf_counter() - start) / ticks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keepalive timer benchmark")
+    parser.add_argument('--connections', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--interval', type=int, default=60, help="Ticks between keepalive checks (default: 60)")
+    parser.add_argument('--ticks', type=int, default=120)
+    args = parser.parse_args()
+
+    print(f"{'connections':>12} {'wheel/tick':>12} {'scan/tick':>12}")
+    for connections in args.connections:
+        wheel = run_wheel(connections, args.interval, args.ticks)
+        scan = run_scan(connections, args.interval, args.ticks)
+        print(f"{connections:>12} {wheel * 1e6:>10.1f}us {scan * 1e6:>10.1f}us")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+#TLS benchmark: handshake rate and message throughput against plain TCP
+#
+#Makes a self-signed certificate, starts irc_server.py on a free local port with a TLS port
+#next to it, then measures:
+#
+#  - connections/sec: --concurrency threads connect, register with NICK, wait for the welcome
+#    and disconnect, --connections times in all. Over plain TCP, over TLS with a full handshake
+#    every time, and over TLS resuming the session of the thread's previous connection (as a
+#    client reconnecting after a network blip does). Also the server's CPU time per
+#    connection (Linux only), since on a small machine the clients here compete with the
+#    server for the same cores.
+#  - messages/sec: a ChatClient sends --messages room messages to a listener in the same room,
+#    over plain TCP and over TLS.
+#
+#    python benchmarks/tls.py --connections 2000 --concurrency 16
+#    python benchmarks/tls.py --server-args "--engine asyncio"
+
+import argparse
+import os
+import shlex
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from irc_client import ChatClient  # noqa: E402
+from irc_tls import TLSSocket, client_context, make_self_signed  # noqa: E402
+from load import free_port  # noqa: E402
+
+SERVER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'irc_server.py')
+
+
+def server_cpu(pid):
+    #CPU seconds used by the server process so far, None where /proc is not available
+    try:
+        with open(f'/proc/{pid}/stat') as stat:
+            fields = stat.read().rpartition(')')[2].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')  # utime + stime
+
+
+def register(host, port, nickname, context=None, session=None):
+    #One connection: connect, handshake, NICK, wait for the welcome, close. Returns the TLS
+    #session (to resume next time) and whether this connection resumed one.
+    sock = socket.create_connection((host, port))
+    reused = False
+    try:
+        if context is not None:
+            sock = TLSSocket(sock, context, server_hostname=host, session=session)
+            sock.do_handshake()
+            reused = sock.session_reused
+        sock.sendall(f"NICK {nickname}\n".encode())
+        reply = b''
+        while b'\n' not in reply:
+            data = sock.recv(4096)
+            if not data:
+                raise ConnectionResetError("Server closed the connection")
+            reply += data
+        if b'Welcome' not in reply:
+            raise ConnectionRefusedError(reply.decode(errors='replace').strip())
+        session = sock.session if context is not None else None
+    finally:
+        sock.close()
+    return session, reused
+
+
+def connection_rate(host, port, connections, concurrency, context=None, resume=False):
+    #Connections/sec, and how many of them resumed a TLS session
+    per_thread = connections // concurrency
+    resumed = [0] * concurrency
+    errors = []
+
+    def worker(index):
+        session = None
+        try:
+            for i in range(per_thread):
+                session, reused = register(host, port, f"c{index}x{i}", context, session if resume else None)
+                resumed[index] += reused
+        except OSError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    if errors:
+        print(f"  {len(errors)} threads failed, first error: {errors[0]}")
+    return per_thread * concurrency / elapsed, sum(resumed)
+
+
+def message_rate(host, port, messages, context=None):
+    #Messages/sec from one sender to one listener in a room
+    received = threading.Event()
+    count = [0]
+
+    def on_message(message):
+        count[0] += 1
+        if count[0] == messages:
+            received.set()
+
+    listener = ChatClient(host, port, 'listener', on_message=on_message, tls_context=context).connect()
+    sender = ChatClient(host, port, 'sender', tls_context=context).connect()
+    listener.create('bench')
+    listener.join('bench')
+    listener.flush()
+    time.sleep(0.2)
+    sender.join('bench')
+    sender.flush()
+    time.sleep(0.2)
+
+    text = 'x' * 100
+    start = time.perf_counter()
+    for i in range(messages):
+        sender.msg('bench', f"{i} {text}")
+    finished = received.wait(60)
+    elapsed = time.perf_counter() - start
+    sender.close()
+    listener.close()
+    if not finished:
+        print(f"  only {count[0]} of {messages} messages arrived")
+    return count[0] / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TLS benchmark")
+    parser.add_argument('--connections', type=int, default=2000, help="Connections per handshake test")
+    parser.add_argument('--concurrency', type=int, default=16, help="Threads connecting at once")
+    parser.add_argument('--messages', type=int, default=50000)
+    parser.add_argument('--server-args', default='--queue-size 1000000',
+                        help="Arguments for the irc_server.py this starts, e.g. \"--engine asyncio\"")
+    args = parser.parse_args()
+
+    host, port, tls_port = '127.0.0.1', free_port(), free_port()
+    with tempfile.TemporaryDirectory() as directory:
+        certfile, keyfile = make_self_signed(directory)
+        context = client_context(certfile)
+        server = subprocess.Popen([sys.executable, SERVER, '--host', host, '--port', str(port),
+                                   '--tls-port', str(tls_port), '--tls-cert', certfile, '--tls-key', keyfile,
+                                   '--log-level', 'WARNING', '--max-connections', '0',
+                                   *shlex.split(args.server_args)])
+        try:
+            for _ in range(100):
+                try:
+                    socket.create_connection((host, tls_port)).close()
+                    break
+                except OSError:
+                    time.sleep(0.1)
+
+            print(f"{args.connections} connections, {args.concurrency} at a time")
+            for name, target, tls, resume in (("plain TCP", port, None, False), ("TLS full", tls_port, context, False),
+                                              ("TLS resumed", tls_port, context, True)):
+                cpu = server_cpu(server.pid)
+                rate, resumed = connection_rate(host, target, args.connections, args.concurrency, tls, resume)
+                line = f"{name:<12}: {rate:>8.0f} connections/sec"
+                if cpu is not None:
+                    line += f", server CPU {(server_cpu(server.pid) - cpu) / args.connections * 1e3:.2f}ms each"
+                print(line + (f" ({resumed} resumed)" if resume else ""))
+
+            print(f"{args.messages} messages of about 100 bytes")
+            print(f"plain TCP   : {message_rate(host, port, args.messages):>8.0f} messages/sec")
+            print(f"TLS         : {message_rate(host, tls_port, args.messages, context):>8.0f} messages/sec")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main()
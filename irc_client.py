@@ -1,84 +1,583 @@
+import asyncio
+import logging
 import socket
 import threading
-import sys
+import time
+from typing import NamedTuple, Optional
 
-class IRCClient:
-    def __init__(self, host='localhost', port=6667):
+from irc_framing import RECV_SIZE, FrameDecoder, LineFramer, StreamEncoder
+from irc_tls import TLSSocket, client_context
+
+REPLY_MAX_LINE = 1 << 20  # Server replies such as LIST can be long
+RECONNECT_DELAYS = (0.5, 1, 2, 5, 10)  # Backoff between reconnect attempts
+NICK_CHANGED = 'SUCCESS: You are now known as '  # Reply to NICK, followed by the nickname and a full stop
+HISTORY_START = 'HISTORY: '  # First line of a HISTORY reply, also sent on JOIN by a server with --history-on-join
+HISTORY_END = 'END HISTORY '
+
+log = logging.getLogger('irc.client')
+
+
+class RoomMessage(NamedTuple):
+    room: str
+    nickname: str
+    text: str
+
+
+def parse_room_message(line) -> Optional[RoomMessage]:
+    #A "[room] nick: text" line as broadcast by the server, None for any other line
+    if not line.startswith('['):
+        return None
+    room, separator, rest = line[1:].partition('] ')
+    if not separator:
+        return None
+    nickname, separator, text = rest.partition(': ')
+    if not separator:
+        return None
+    return RoomMessage(room, nickname, text)
+
+
+def replayed(client, line):
+    #True for the lines of a HISTORY reply: old messages, which go to on_line rather than being
+    #handed out as new ones (every reconnect rejoins the rooms, and the server replays on join)
+    if client.replaying or line.startswith(HISTORY_START):
+        client.replaying = not line.startswith(HISTORY_END)
+        return True
+    return False
+
+
+def command_line(command):
+    #Encode one command; a line ending inside it would smuggle in a second command
+    if '\n' in command or '\r' in command:
+        raise ValueError("Commands cannot contain line breaks")
+    return f"{command}\n".encode()
+
+
+def registration_reply(line):
+    #True once the server welcomed us, raises if it refused the nickname, None if still waiting
+    if 'Welcome:' in line:  # The nickname prompt has no line ending, so it shares a line with the reply
+        return True
+    if 'ERROR' in line:
+        raise ConnectionRefusedError(line.partition('ERROR: ')[2] or line)
+    return None
+
+
+class Registration:
+    #Reads the replies to NICK, and to CAP REQ if capabilities were asked for. The server sends
+    #frames straight after its CAP ACK line, so lines are taken off the received bytes one at a
+    #time, and whatever follows the ACK goes to a FrameDecoder instead of being split as text.
+    def __init__(self, capabilities=()):
+        self.capabilities = capabilities
+        self.pending = bytearray()
+        self.registered = False
+        self.negotiating = bool(capabilities)
+        self.accepted = ()  # Capabilities the server acknowledged
+        self.early = []  # Lines that arrived with the replies, for handle_line
+
+    def request(self, nickname):
+        #The registration commands, sent together so negotiating costs no extra round trip
+        data = command_line(f"NICK {nickname}")
+        if self.capabilities:
+            data += command_line(f"CAP REQ {' '.join(self.capabilities)}")
+        return data
+
+    def feed(self, data):
+        #Returns True once the welcome (and the answer to CAP REQ) are here
+        pending = self.pending
+        pending += data
+        while self.negotiating or not self.registered:
+            end = pending.find(b'\n')
+            if end < 0:
+                if len(pending) > REPLY_MAX_LINE:
+                    raise ConnectionResetError("Reply too long during registration")
+                return False
+            line = pending[:end].rstrip(b'\r').decode('utf-8', 'replace')
+            del pending[:end + 1]
+            if not self.registered:
+                if registration_reply(line):
+                    self.registered = True
+                    self.early.append(line[line.find('Welcome:'):])  # Without the nickname prompt
+            elif line.startswith('CAP ACK:'):
+                self.accepted = tuple(line[len('CAP ACK:'):].split())
+                self.negotiating = False
+            elif line.startswith(('CAP NAK:', 'ERROR')):
+                self.negotiating = False  # Refused, or a server without CAP: carry on with plain lines
+            else:
+                self.early.append(line)
+        return True
+
+    def framer(self):
+        #Framer for the rest of the connection, fed what arrived after the replies
+        framer = FrameDecoder(REPLY_MAX_LINE) if self.accepted else LineFramer(REPLY_MAX_LINE)
+        self.early.extend(line for line in framer.feed(self.pending) if line is not None)
+        return framer
+
+    def encoder(self):
+        #StreamEncoder for what the client sends, None for plain lines
+        return StreamEncoder('zlib' in self.accepted) if self.accepted else None
+
+
+class ChatClient:
+    #Scriptable client for bots and tools. Commands are appended to a buffer and written by a
+    #writer thread with sendall, so whatever piles up while a write is in progress goes out in
+    #the next single write (pipelining). Lines from the server are handed to on_message (room
+    #messages, as RoomMessage) or on_line (everything else, HISTORY replies included) on the reader thread. If the
+    #connection drops, the client reconnects with backoff, registers again, rejoins its rooms
+    #and then sends the commands that were buffered meanwhile. With a tls_context (see
+    #irc_tls.client_context) it connects to the server's TLS port and resumes its TLS session
+    #when it reconnects, which skips most of the handshake. capabilities=('zlib',) asks the
+    #server for compressed binary frames (('frames',) for frames alone), which cuts the bytes a
+    #busy bot sends and receives; a server that refuses them is spoken to in plain lines.
+    def __init__(self, host='localhost', port=6667, nickname='', on_message=None, on_line=None,
+                 on_disconnect=None, reconnect=True, tls_context=None, capabilities=()):
         self.host = host
         self.port = port
+        self.nickname = nickname
+        self.tls_context = tls_context  # ssl.SSLContext for a TLS port, None for plain TCP
+        self.tls_session = None  # Last TLS session from the server, offered again on the next connection
+        self.on_message = on_message
+        self.on_line = on_line
+        self.on_disconnect = on_disconnect  # Called when the connection is lost for good
+        self.reconnect = reconnect
+        self.capabilities = tuple(capabilities)  # Asked for with CAP REQ on every connection
         self.socket = None
+        self.framer = None
+        self.encoder = None  # StreamEncoder once the server accepted frames
         self.connected = False
-        self.nickname = ""
+        self.closed = False
+        self.rooms = set()  # Rooms joined, rejoined after a reconnect
+        self.condition = threading.Condition()  # Guards buffer, writing and the connection state
+        self.buffer = bytearray()  # Encoded commands waiting for the writer
+        self.writing = False
+        self.finished = threading.Event()  # Set when the reader stops for good
+        self.sent = 0  # Commands sent
+        self.received = 0  # Lines received
+        self.replaying = False  # Inside a HISTORY reply
 
     def connect(self):
-        #Connect to the IRC server
+        #Connect and register; raises OSError, or ConnectionRefusedError if the nickname is taken
+        self.open_connection()
+        threading.Thread(target=self.read_loop, daemon=True).start()
+        threading.Thread(target=self.write_loop, daemon=True).start()
+        return self
 
+    def open_connection(self):
+        sock = socket.create_connection((self.host, self.port))
+        registration = Registration(self.capabilities)
         try:
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socket.connect((self.host, self.port))
+            if self.tls_context is not None:
+                sock = TLSSocket(sock, self.tls_context, server_hostname=self.host, session=self.tls_session)
+                sock.do_handshake()
+            sock.sendall(registration.request(self.nickname))
+            while True:
+                data = sock.recv(RECV_SIZE)
+                if not data:
+                    raise ConnectionResetError("Server closed the connection during registration")
+                if registration.feed(data):
+                    break
+            framer = registration.framer()
+        except BaseException:
+            sock.close()
+            raise
+        if self.tls_context is not None:
+            self.tls_session = sock.session  # TLS 1.3 sends the session tickets before any reply, so it is resumable by now
+
+        with self.condition:
+            self.socket = sock
+            self.framer = framer
+            self.replaying = False
+            self.encoder = registration.encoder()
             self.connected = True
-            
-            print(f"Connected to IRC server at {self.host}:{self.port}") 
-
-            # Handle nickname registration
-            self.register_nickname()
-            
-            # Start receiving messages in a separate thread
-            receive_thread = threading.Thread(target=self.receive_messages)
-            receive_thread.daemon = True
-            receive_thread.start()   
-
-            return True 
-        
-        except Exception as e:
-            print(f"Failed to connect to IRC server: {e}")
-            return False
-        
-    def register_nickname(self):
-        #Register the nickname with the IRC server
+            self.buffer[:0] = b''.join(command_line(f"JOIN {room}") for room in sorted(self.rooms))
+            self.condition.notify_all()
+        for line in registration.early:
+            self.handle_line(line)
+
+    def send(self, command):
+        #Queue a raw command line; it is written in the background
+        data = command_line(command)
+        with self.condition:
+            self.buffer += data
+            self.sent += 1
+            if not self.writing:
+                self.condition.notify_all()
+
+    def send_many(self, commands):
+        #Queue several commands at once, written together
+        data = b''.join(command_line(command) for command in commands)
+        with self.condition:
+            self.buffer += data
+            self.sent += len(commands)
+            self.condition.notify_all()
+
+    def create(self, room):
+        self.send(f"CREATE {room}")
+
+    def join(self, room):
+        self.rooms.add(room)
+        self.send(f"JOIN {room}")
+
+    def leave(self, room):
+        self.rooms.discard(room)
+        self.send(f"LEAVE {room}")
+
+    def msg(self, room, text):
+        self.send(f"MSG {room} {text}")
+
+    def privmsg(self, nickname, text):
+        self.send(f"PRIVMSG {nickname} {text}")
+
+    def flush(self, timeout=None):
+        #Wait until everything queued has been written; returns False on timeout
+        with self.condition:
+            return self.condition.wait_for(lambda: (not self.buffer and not self.writing) or self.closed, timeout)
+
+    def write_loop(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: (self.buffer and self.connected) or self.closed)
+                if self.closed:
+                    return
+                data = bytes(self.buffer)
+                self.buffer.clear()
+                sock = self.socket
+                encoder = self.encoder
+                self.writing = True
+
+            try:
+                sock.sendall(encoder.encode(data) if encoder is not None else data)
+                failed = False
+            except OSError:
+                failed = True
+
+            with self.condition:
+                self.writing = False
+                if failed and not self.closed:
+                    #Lost mid-write: keep the batch for after the reconnect (it may have been partly sent);
+                    #it is kept as lines and encoded for whatever the next connection negotiates
+                    self.buffer[:0] = data
+                    self.connected = False
+                self.condition.notify_all()
+
+    def read_loop(self):
+        while True:
+            try:
+                data = self.socket.recv(RECV_SIZE)
+            except OSError:
+                data = b''
+            if data:
+                for line in self.framer.feed(data):
+                    if line is not None:
+                        self.handle_line(line)
+                continue
+
+            with self.condition:
+                self.connected = False
+                self.condition.notify_all()
+            if self.closed or not self.reconnect or not self.reconnect_loop():
+                break
+
+        self.finished.set()
+        if not self.closed and self.on_disconnect:
+            self.on_disconnect()
+
+    def reconnect_loop(self):
+        #Reconnect with backoff until it works or the client is closed
+        self.socket.close()
+        attempt = 0
+        while not self.closed:
+            time.sleep(RECONNECT_DELAYS[min(attempt, len(RECONNECT_DELAYS) - 1)])
+            attempt += 1
+            try:
+                self.open_connection()
+                log.info("Reconnected to %s:%s", self.host, self.port)
+                return True
+            except OSError as e:  # Includes a refused nickname: the old session may not be gone yet
+                log.info("Reconnect to %s:%s failed: %s", self.host, self.port, e)
+        return False
+
+    def handle_line(self, line):
+        self.received += 1
+        if line.startswith('PING '):
+            self.send(f"PONG {line[5:]}")  # Keepalive from the server, answered without bothering the callbacks
+            return
+        if line.startswith(NICK_CHANGED):
+            self.nickname = line[len(NICK_CHANGED):-1]  # Register under the new nickname after a reconnect
+        message = None if replayed(self, line) else parse_room_message(line)
         try:
-            # Wait for server prompt
-            response = self.socket.recv(1024).decode('utf-8')
-            print(response, end='')
-            
-            # Get nickname from user
+            if message is not None and self.on_message:
+                self.on_message(message)
+            elif self.on_line:
+                self.on_line(line)
+        except Exception:
+            log.exception("Error in callback for %r", line)
+
+    def close(self, timeout=2.0):
+        #Send QUIT and wait up to timeout for the server to close the connection. Closing with
+        #replies still unread would reset the connection and lose the commands not yet processed.
+        if self.closed:
+            return
+        connected = self.connected
+        if connected:
+            self.send("QUIT")
+            self.flush(timeout)
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        if self.socket:
+            try:
+                if connected:
+                    self.socket.shutdown(socket.SHUT_WR)
+                    self.finished.wait(timeout)
+                self.socket.close()
+            except OSError:
+                pass
+
+
+class AsyncChatClient:
+    #asyncio counterpart of ChatClient. Commands are collected in a buffer and handed to the
+    #transport once per event loop iteration, so a burst costs one write. Room messages are
+    #read with `async for message in client`; other lines, HISTORY replies included, go to on_line. A tls_context
+    #connects with TLS; asyncio cannot offer a saved session, so reconnects do a full handshake.
+    #capabilities asks for binary frames as in ChatClient.
+    def __init__(self, host='localhost', port=6667, nickname='', on_line=None, reconnect=True,
+                 max_pending=10000, tls_context=None, capabilities=()):
+        self.host = host
+        self.port = port
+        self.nickname = nickname
+        self.tls_context = tls_context
+        self.capabilities = tuple(capabilities)
+        self.on_line = on_line
+        self.reconnect = reconnect
+        self.reader = None
+        self.writer = None
+        self.framer = None
+        self.encoder = None
+        self.connected = False
+        self.closed = False
+        self.rooms = set()
+        self.buffer = bytearray()
+        self.flush_scheduled = False
+        self.messages = asyncio.Queue(max_pending)  # Room messages not yet taken by the iterator
+        self.task = None
+        self.sent = 0
+        self.received = 0
+        self.replaying = False
+
+    async def connect(self):
+        await self.open_connection()
+        self.task = asyncio.ensure_future(self.read_loop())
+        return self
+
+    async def open_connection(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port, ssl=self.tls_context)
+        registration = Registration(self.capabilities)
+        try:
+            writer.write(registration.request(self.nickname))
             while True:
-                nickname = input().strip()
-                if nickname:
-                    self.nickname = nickname
-                    self.socket.send(f"NICK {nickname}".encode())
+                data = await reader.read(RECV_SIZE)
+                if not data:
+                    raise ConnectionResetError("Server closed the connection during registration")
+                if registration.feed(data):
                     break
-                else:
-                    print("Please enter a valid nickname: ", end='')
-        except Exception as e:
-            print(f"Error during nickname registration: {e}")
+            framer = registration.framer()
+        except BaseException:
+            writer.close()
+            raise
+
+        self.reader, self.writer, self.framer = reader, writer, framer
+        self.replaying = False
+        self.encoder = registration.encoder()
+        self.connected = True
+        self.buffer[:0] = b''.join(command_line(f"JOIN {room}") for room in sorted(self.rooms))
+        self.schedule_flush()
+        for line in registration.early:
+            self.handle_line(line)
+
+    def send(self, command):
+        self.buffer += command_line(command)
+        self.sent += 1
+        self.schedule_flush()
+
+    def create(self, room):
+        self.send(f"CREATE {room}")
+
+    def join(self, room):
+        self.rooms.add(room)
+        self.send(f"JOIN {room}")
+
+    def leave(self, room):
+        self.rooms.discard(room)
+        self.send(f"LEAVE {room}")
+
+    def msg(self, room, text):
+        self.send(f"MSG {room} {text}")
+
+    def privmsg(self, nickname, text):
+        self.send(f"PRIVMSG {nickname} {text}")
+
+    def schedule_flush(self):
+        if not self.flush_scheduled and self.connected and self.buffer:
+            self.flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self.write_buffer)
+
+    def write_buffer(self):
+        self.flush_scheduled = False
+        if self.buffer and self.connected:
+            data = bytes(self.buffer)
+            if self.encoder is not None:
+                data = self.encoder.encode(data)
+            self.writer.write(data)  # The transport keeps whatever the socket does not take yet
+            self.buffer.clear()
+
+    async def drain(self):
+        #Write the buffer and wait until the transport is below its high-water mark
+        self.write_buffer()
+        if self.connected:
+            try:
+                await self.writer.drain()
+            except OSError:
+                pass
+
+    async def read_loop(self):
+        while True:
+            try:
+                data = await self.reader.read(RECV_SIZE)
+            except OSError:  # ssl.SSLError and TimeoutError too, which would otherwise end the loop for good
+                data = b''
+            if data:
+                for line in self.framer.feed(data):
+                    if line is not None:
+                        self.handle_line(line)
+                continue
+
             self.connected = False
+            self.writer.close()
+            if self.closed or not self.reconnect or not await self.reconnect_loop():
+                break
 
-    def receive_messages(self):
-        #Receive and display messages from the IRC server
-        while self.connected:
+        if self.messages.full():
+            self.messages.get_nowait()
+        self.messages.put_nowait(None)  # Ends the iterator
+
+    async def reconnect_loop(self):
+        attempt = 0
+        while not self.closed:
+            await asyncio.sleep(RECONNECT_DELAYS[min(attempt, len(RECONNECT_DELAYS) - 1)])
+            attempt += 1
             try:
-                message = self.socket.recv(1024).decode('utf-8')    
-                if not message:
-                    break
+                await self.open_connection()
+                log.info("Reconnected to %s:%s", self.host, self.port)
+                return True
+            except OSError as e:
+                log.info("Reconnect to %s:%s failed: %s", self.host, self.port, e)
+        return False
 
-                # Print the received message
-                print(message, end='')
+    def handle_line(self, line):
+        self.received += 1
+        if line.startswith('PING '):
+            self.send(f"PONG {line[5:]}")
+            return
+        if line.startswith(NICK_CHANGED):
+            self.nickname = line[len(NICK_CHANGED):-1]
+        message = None if replayed(self, line) else parse_room_message(line)
+        if message is not None:
+            if self.messages.full():
+                self.messages.get_nowait()  # Nobody is keeping up: drop the oldest, like the server does
+            self.messages.put_nowait(message)
+        elif self.on_line:
+            try:
+                self.on_line(line)
+            except Exception:
+                log.exception("Error in callback for %r", line)
 
-                #Check for server shutdown or error messages
-                if "Server is shutting down" in message or "ERROR" in message:
-                    print("Server is shutting down or an error occurred.")
-                    self.connected = False
-                    break
+    def __aiter__(self):
+        return self
 
-            except socket.error:
-                if self.connected:
-                    print("Connection lost to server.")
-                    break
+    async def __anext__(self):
+        message = await self.messages.get()
+        if message is None:
+            raise StopAsyncIteration
+        return message
+
+    async def close(self, timeout=2.0):
+        #Send QUIT and wait up to timeout for the server to close the connection, as ChatClient.close does
+        if self.closed:
+            return
+        self.closed = True
+        if self.connected:
+            self.send("QUIT")
+            await self.drain()
+            if self.writer.can_write_eof():
+                self.writer.write_eof()
+        if self.task:
+            try:
+                await asyncio.wait_for(self.task, timeout)  # The read loop ends when the server closes
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                pass
+        if self.writer:
+            self.writer.close()
+
+
+class IRCClient:
+    #Interactive command-line client on top of ChatClient
+    def __init__(self, host='localhost', port=6667, nickname="", tls_context=None):
+        self.host = host
+        self.port = port
+        self.tls_context = tls_context  # Connect with TLS when set
+        self.client = None
+        self.connected = False
+        self.nickname = nickname  # Asked for at the prompt when empty
+
+    def connect(self):
+        #Connect to the IRC server
+
+        while True:
+            if not self.register_nickname():
+                return False
+            self.client = ChatClient(self.host, self.port, self.nickname, on_message=self.show_message,
+                                     on_line=self.show_line, on_disconnect=self.connection_lost, reconnect=False,
+                                     tls_context=self.tls_context)
+            try:
+                self.client.connect()
+            except ConnectionRefusedError as e:
+                print(f"{e} Please choose another nickname.")
+                self.nickname = ""
+                continue
             except Exception as e:
-                print(f"Error receiving message: {e}")
-                break
+                print(f"Failed to connect to IRC server: {e}")
+                return False
 
+            self.connected = True
+            secure = f" with {self.client.socket.version()}" if self.tls_context is not None else ""
+            print(f"Connected to IRC server at {self.host}:{self.port}{secure}")
+            return True
+
+    def register_nickname(self):
+        #Ask for a nickname unless one was given
+        try:
+            while not self.nickname:
+                nickname = input("Enter your nickname: ").strip()
+                if nickname:
+                    self.nickname = nickname
+                else:
+                    print("Please enter a valid nickname.")
+            return True
+        except (EOFError, KeyboardInterrupt):
+            return False
+
+    def show_message(self, message):
+        print(f"[{message.room}] {message.nickname}: {message.text}")
+
+    def show_line(self, line):
+        print(line)
+        self.nickname = self.client.nickname  # Follows NICK changes, for the prompt
+        if "Server is shutting down" in line:
+            print("Server is shutting down.")
+            self.connected = False
+
+    def connection_lost(self):
+        if self.connected:
+            print("Connection lost to server.")
         self.connected = False
 
     def send_command(self, command):
@@ -87,20 +586,24 @@ class IRCClient:
             if not self.connected:
                 print("Not connected to server")
                 return False
-            
-            self.socket.send(command.encode())
+            if command.split(' ', 1)[0].upper() == 'CAP':
+                #The server would answer in binary frames, which this client does not read
+                print("CAP is for the client library (ChatClient capabilities=...), not this client")
+                return True
+
+            self.client.send(command)
             return True
-        
+
         except Exception as e:
             print(f"Error sending command: {e}")
             self.connected = False
             return False
-        
+
     def run(self):
         #main client loop
         if not self.connect():
             return
-        
+
         print("\n" + "=" * 50)
         print("IRC CLIENT - Type 'help' for commands or 'quit' to exit")
         print("="*50)
@@ -116,7 +619,6 @@ class IRCClient:
 
                     #handle commands
                     if user_input.lower() == 'quit':
-                        self.send_command('QUIT')
                         break
                     elif user_input.lower() == 'help':
                         self.show_help()
@@ -132,7 +634,6 @@ class IRCClient:
 
                 except KeyboardInterrupt:
                     print("\nDisconnecting....")
-                    self.send_command('QUIT')
                     break
                 except EOFError:
                     print("\nDisconnecting...")
@@ -152,9 +653,13 @@ SERVER COMMANDS:
   CREATE <room_name>     - Create a new room
   JOIN <room_name>       - Join an existing room
   LEAVE <room_name>      - Leave a room
-  LIST                   - List all rooms
-  WHO <room_name>        - List members in a room
+  LIST [pattern] [opts]  - List rooms, a page at a time
+  WHO <room> [pattern]   - List members in a room
   MSG <room_name> <text> - Send message to room
+  PRIVMSG <nick> <text>  - Send a private message to a user
+  NICK <nickname>        - Change your nickname
+  HISTORY <room> [count] - Show recent messages in a room
+  STATS                  - Show server metrics (local server only)
 
 EXAMPLES:
   CREATE general
@@ -163,17 +668,16 @@ EXAMPLES:
   WHO general
   LEAVE general
   LIST
+  LIST dev* sort=-size limit=20
+  LIST after=dev-42     (the cursor from a MORE: line)
         """
         print(help_text)
 
     def disconnect(self):
-        #Disconnects from the server
+        #Disconnects from the server, sending QUIT first
         self.connected = False
-        if self.socket:
-            try:
-                self.socket.close()
-            except:
-                pass
+        if self.client:
+            self.client.close()
         print("Disconnected from IRC server.")
 
 
@@ -194,12 +698,14 @@ def main():
             port = 6667
             print("Invalid port, using default 6667.")
 
+        tls_context = None
+        if input("Use TLS? (y/N): ").strip().lower().startswith('y'):
+            cafile = input("CA certificate for a self-signed server (default: the system's): ").strip()
+            tls_context = client_context(cafile or None)
+
         #Create and run the client
-        client = IRCClient(host, port)
+        client = IRCClient(host, port, tls_context=tls_context)
         client.run()
 
 if __name__ == "__main__":
     main()
-
-
-                    
\ No newline at end of file
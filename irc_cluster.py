@@ -0,0 +1,318 @@
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import tempfile
+import threading
+import time
+from typing import Dict, Set, Tuple
+
+from irc_framing import RECV_SIZE, LineFramer
+from irc_metrics import start_logging
+
+log = logging.getLogger('irc.cluster')
+
+BUS_MAX_LINE = 1 << 20  # Bus events carry whole chat messages
+
+
+def event_line(*fields):
+    #Bus events are JSON arrays, one per line: [kind, origin, args...]
+    return json.dumps(fields, separators=(',', ':'))
+
+
+def encode_event(*fields):
+    return event_line(*fields).encode() + b'\n'
+
+
+class BusHub:
+    #Runs in the master process of a cluster. Every event a worker publishes is sent to every
+    #worker (the publisher included) in the order the hub receives it, so all workers apply
+    #room traffic in one global order.
+    def __init__(self, path):
+        self.path = path
+        self.socket = None
+        self.running = False
+        self.lock = threading.Lock()  # Held while fanning out, which is what fixes the order
+        self.workers: Dict[str, socket.socket] = {}
+
+        #What the hub has seen, so a worker that (re)connects can be brought up to date
+        self.rooms: Dict[str, Set[Tuple[str, str]]] = {}  # room name -> {(origin, nickname)}
+
+    def start(self):
+        #Listen on the Unix socket and accept workers in the background
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.bind(self.path)
+        self.socket.listen(64)
+        self.running = True
+        threading.Thread(target=self.accept_loop, daemon=True).start()
+
+    def accept_loop(self):
+        while self.running:
+            try:
+                worker_socket, _ = self.socket.accept()
+            except OSError:
+                break
+            threading.Thread(target=self.handle_worker, args=(worker_socket,), daemon=True).start()
+
+    def handle_worker(self, worker_socket):
+        #Read events from one worker and fan them out
+        framer = LineFramer(BUS_MAX_LINE)
+        origin = None
+        try:
+            while self.running:
+                data = worker_socket.recv(RECV_SIZE)
+                if not data:
+                    break
+
+                batch = []
+                for line in framer.feed(data):
+                    if line is None:
+                        continue
+                    if origin is None:
+                        #The first line is the worker's HELLO
+                        origin = json.loads(line)[1]
+                        self.add_worker(origin, worker_socket)
+                        continue
+                    batch.append(line)
+
+                if batch:
+                    self.publish(batch)
+        except OSError:
+            pass
+        finally:
+            if origin is not None:
+                self.remove_worker(origin, worker_socket)
+            worker_socket.close()
+
+    def add_worker(self, origin, worker_socket):
+        #Register a worker and send it the rooms and members it missed
+        with self.lock:
+            burst = []
+            for room_name, members in self.rooms.items():
+                burst.append(encode_event('CREATE', '', room_name))
+                for member_origin, nickname in members:
+                    burst.append(encode_event('JOIN', member_origin, room_name, nickname))
+            if burst:
+                worker_socket.sendall(b''.join(burst))
+            self.workers[origin] = worker_socket
+
+    def remove_worker(self, origin, worker_socket):
+        #A worker went away: tell the others to forget its members
+        with self.lock:
+            if self.workers.get(origin) is worker_socket:
+                del self.workers[origin]
+        self.publish([event_line('DROP', origin)])
+
+    def publish(self, lines):
+        #Apply a batch of events to the hub's view and send it to every worker
+        data = ''.join(line + '\n' for line in lines).encode()
+        with self.lock:
+            for line in lines:
+                if not line.startswith('["MSG"'):  # Messages do not change membership, skip parsing them
+                    self.track(json.loads(line))
+
+            for origin, worker_socket in list(self.workers.items()):
+                try:
+                    worker_socket.sendall(data)
+                except OSError:
+                    del self.workers[origin]
+
+    def track(self, event):
+        #Keep the room/member view used for bursts
+        kind, origin, *args = event
+        if kind == 'CREATE':
+            self.rooms.setdefault(args[0], set())
+        elif kind == 'JOIN':
+            self.rooms.setdefault(args[0], set()).add((origin, args[1]))
+        elif kind == 'LEAVE':
+            self.rooms.get(args[0], set()).discard((origin, args[1]))
+        elif kind == 'QUIT':
+            for members in self.rooms.values():
+                members.discard((origin, args[0]))
+        elif kind == 'NICK':
+            for members in self.rooms.values():
+                if (origin, args[0]) in members:
+                    members.discard((origin, args[0]))
+                    members.add((origin, args[1]))
+        elif kind == 'DROP':
+            for room_name, members in self.rooms.items():
+                self.rooms[room_name] = {member for member in members if member[0] != origin}
+
+    def stop(self):
+        self.running = False
+        if self.socket:
+            self.socket.close()
+        with self.lock:
+            for worker_socket in self.workers.values():
+                try:
+                    worker_socket.close()
+                except OSError:
+                    pass
+            self.workers.clear()
+
+
+class BusLink:
+    #A worker's connection to the hub. Local room events are published for the other workers;
+    #events coming back from the hub are applied to the worker's IRCServer.
+    def __init__(self, path, origin, server):
+        self.path = path
+        self.origin = origin  # Unique name of this worker on the bus
+        self.server = server
+        self.socket = None
+        self.send_lock = threading.Lock()
+        self.tokens = itertools.count()
+        self.pending = {}  # Token -> session id of the sender of our MSGs that have not come back from the hub yet
+        self.closed = False  # Closed by the worker itself, so losing the bus is expected
+        self.lost = False
+
+    def start(self):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(self.path)
+        self.socket.sendall(encode_event('HELLO', self.origin))
+        threading.Thread(target=self.receive_loop, daemon=True).start()
+
+    def publish(self, kind, *args):
+        #Returns False if the bus is gone
+        data = encode_event(kind, self.origin, *args)
+        try:
+            with self.send_lock:
+                self.socket.sendall(data)
+            return True
+        except OSError:
+            self.lose()
+            return False
+
+    def publish_message(self, session_id, room_name, nickname, message):
+        #Room messages are delivered when the hub sends them back, locally included, so every
+        #worker shows them in the same order. Returns False if the message could not be sent.
+        token = next(self.tokens)
+        self.pending[token] = session_id  # Before sending: the hub can echo it back before sendall returns
+        if self.publish('MSG', token, room_name, nickname, message):
+            return True
+        self.pending.pop(token, None)
+        return False
+
+    def receive_loop(self):
+        framer = LineFramer(BUS_MAX_LINE)
+        try:
+            while True:
+                data = self.socket.recv(RECV_SIZE)
+                if not data:
+                    break
+                events = [json.loads(line) for line in framer.feed(data) if line is not None]
+                if events:
+                    self.server.call_soon(self.apply_events, events)
+        except OSError:
+            pass
+        self.lose()
+
+    def lose(self):
+        #Without the hub this worker can no longer agree with the others on rooms and message
+        #order (the master has gone): stop serving, so clients reconnect to a cluster that works
+        if self.closed or self.lost:
+            return
+        self.lost = True
+        log.error("Lost connection to the cluster bus, shutting down")
+        self.server.stop()
+
+    def apply_events(self, events):
+        #Runs on the server's engine thread
+        server = self.server
+        for kind, origin, *args in events:
+            if kind == 'MSG':
+                token, room_name, nickname, message = args
+                exclude = self.pending.pop(token, None) if origin == self.origin else None
+                server.remote_message(room_name, nickname, message, exclude)
+            elif origin == self.origin:
+                continue  # Our own membership change, already applied locally
+            elif kind == 'CREATE':
+                server.ensure_room(args[0])
+            elif kind == 'JOIN':
+                server.remote_join(origin, args[0], args[1])
+            elif kind == 'LEAVE':
+                server.remote_leave(origin, args[0], args[1])
+            elif kind == 'QUIT':
+                server.remote_quit(origin, args[0])
+            elif kind == 'NICK':
+                server.remote_nick(origin, args[0], args[1])
+            elif kind == 'DROP':
+                server.remote_drop(origin)
+
+    def close(self):
+        self.closed = True
+        if self.socket:
+            try:
+                self.socket.close()
+            except OSError:
+                pass
+
+
+def run_worker(worker_id, bus_path, host, port, log_level, options):
+    #Entry point of a worker process: an IRCServer sharing the port through SO_REUSEPORT
+    from irc_server import IRCServer
+
+    listener = start_logging(log_level)
+
+    #The master stops workers with SIGTERM. stop() rather than a KeyboardInterrupt, so a worker
+    #that got Ctrl+C from the terminal as well is not interrupted again while it drains.
+    server = IRCServer(host, port, reuse_port=True, **options)
+    signal.signal(signal.SIGTERM, lambda signum, frame: server.stop())
+    server.bus = BusLink(bus_path, f"worker{worker_id}", server)  # Started by the server once its engine is running
+    try:
+        server.start()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.bus.close()
+        listener.stop()
+
+
+def run_cluster(workers, host='localhost', port=6667, log_level='INFO', **options):
+    #Start the bus hub and one worker process per core (or as many as asked for)
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        raise RuntimeError("Multi-process mode needs SO_REUSEPORT, which this platform does not have")
+
+    listener = start_logging(log_level)
+    bus_dir = tempfile.mkdtemp(prefix='irc-bus-')
+    bus_path = os.path.join(bus_dir, 'bus.sock')
+    hub = BusHub(bus_path)
+    hub.start()
+    log.info("Starting %d workers on %s:%s", workers, host, port)
+
+    context = multiprocessing.get_context('spawn')  # The hub already runs threads, so do not fork
+    processes = [
+        context.Process(target=run_worker, args=(i, bus_path, host, port, log_level, options), daemon=True)
+        for i in range(workers)
+    ]
+    #SIGTERM (what service managers send) stops the workers too, instead of leaving them on the port without a bus
+    signal.signal(signal.SIGTERM, lambda signum, frame: signal.raise_signal(signal.SIGINT))
+    try:
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        log.info("Received interrupt signal, stopping the workers")
+        signal.signal(signal.SIGINT, signal.SIG_IGN)  # A second Ctrl+C or SIGTERM must not cut the drain short
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        for process in processes:
+            if process.is_alive():
+                process.terminate()  # SIGTERM: the worker drains its clients and exits
+        deadline = time.monotonic() + options.get('drain_timeout', 5.0) + 5.0
+        for process in processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+        for process in processes:
+            if process.is_alive():
+                process.kill()
+                process.join()
+    finally:
+        hub.stop()
+        try:
+            os.unlink(bus_path)
+            os.rmdir(bus_dir)
+        except OSError:
+            pass
+        listener.stop()
@@ -0,0 +1,324 @@
+import asyncio
+import os
+import socket
+import threading
+from collections import deque
+
+from irc_framing import RECV_SIZE
+
+SLOW_CONSUMER_POLICIES = ('drop_oldest', 'disconnect', 'block')
+
+try:
+    IOV_MAX = os.sysconf('SC_IOV_MAX')  # Most buffers a single sendmsg call accepts
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = 1024
+
+
+def send_buffers(sock, buffers):
+    #Write a batch of buffers with one scatter/gather sendmsg call per IOV_MAX buffers,
+    #resuming from the right place after a partial write
+    if not hasattr(sock, 'sendmsg'):
+        sock.sendall(b''.join(buffers))  # No sendmsg on Windows
+        return
+
+    index = 0
+    while index < len(buffers):
+        sent = sock.sendmsg(buffers[index:index + IOV_MAX])
+        while sent:
+            size = len(buffers[index])
+            if sent >= size:
+                sent -= size
+                index += 1
+            else:
+                buffers[index] = memoryview(buffers[index])[sent:]  # Rest of a partially sent buffer, without copying
+                sent = 0
+
+
+class OutboundStats:
+    #Server-wide counters shared by the outbound queues of every connection
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.dropped = 0  # Messages thrown away by the drop_oldest policy
+        self.slow_disconnects = 0  # Clients disconnected by the disconnect policy (or a block timeout)
+        self.blocked = 0  # Times a producer had to wait for a full queue
+        self.backlogged = set()  # asyncio connections over their limit under the block policy
+
+    def count(self, name):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+
+class ClientConnection:
+    #A client connection with a bounded outbound queue that is drained by its own writer,
+    #so broadcasting to a client only enqueues and never waits on the client's socket
+    def __init__(self, address, max_queue=1024, policy='drop_oldest', block_timeout=5.0, stats=None):
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unknown slow consumer policy '{policy}', expected one of {SLOW_CONSUMER_POLICIES}")
+
+        self.address = address
+        self.outbound = deque()  # Encoded messages waiting for the writer
+        self.max_queue = max_queue
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.stats = stats if stats is not None else OutboundStats()
+        self.dropped = 0
+        self.high_water = 0  # Deepest the queue has been
+        self.closing = False
+        self.seen = True  # Set by the server whenever the client sends something, cleared by its keepalive check
+        self.pinged = False  # A keepalive PING is waiting for an answer
+        self.framer = None  # Splits what the client sends into lines: LineFramer, or FrameDecoder after CAP REQ
+        self.encoder = None  # FrameEncoder once the client asked for frames, None for plain lines
+        self.tls = False  # Set by the server for a TLS connection
+        self.handoff = False  # Being handed to a new server process: its reader stops without disconnecting it
+
+    @property
+    def queue_depth(self):
+        return len(self.outbound)
+
+    def send(self, data):
+        #Queue data for the writer, applying the slow consumer policy when the queue is full
+        if self.closing:
+            raise ConnectionResetError("Connection is closed")
+
+        if len(self.outbound) >= self.max_queue and not self.make_room():
+            return 0
+
+        encoder = self.encoder
+        if encoder is not None:
+            data = encoder.encode(data)  # A broadcast reuses the frame made for the previous recipient
+        self.outbound.append(data)
+        if len(self.outbound) > self.high_water:
+            self.high_water = len(self.outbound)
+        self.wake_writer()
+        return len(data)
+
+    def use_frames(self, reply, encoder, decoder):
+        #Send reply as the last plain line, then switch both directions to frames
+        self.send(reply)
+        self.encoder = encoder
+        self.framer = decoder
+
+    def make_room(self):
+        #Apply the slow consumer policy to a full queue, returns False if the data should not be queued
+        if self.policy == 'drop_oldest':
+            self.outbound.popleft()
+            self.dropped += 1
+            self.stats.count('dropped')
+            return True
+
+        if self.policy == 'block':
+            self.stats.count('blocked')
+            if self.wait_for_room():
+                return True
+
+        self.stats.count('slow_disconnects')
+        self.abort()
+        return False
+
+    def wait_for_room(self):
+        raise NotImplementedError
+
+    def wake_writer(self):
+        raise NotImplementedError
+
+    @property
+    def flushed(self):
+        #Nothing queued and nothing part way out to the socket
+        raise NotImplementedError
+
+    def close(self):
+        #Flush whatever is queued, then close the connection
+        raise NotImplementedError
+
+    def abort(self):
+        #Drop the queue and tear the connection down now; the reader notices and disconnects the client
+        raise NotImplementedError
+
+    def detach(self):
+        #Stop the writer without sending anything more or shutting the socket down: the socket has
+        #been handed to another process, and this one only closes its own descriptor
+        raise NotImplementedError
+
+
+class ThreadedConnection(ClientConnection):
+    #Connection for the thread engine: a writer thread per client sends the queued data
+    def __init__(self, sock, address, **kwargs):
+        super().__init__(address, **kwargs)
+        self.sock = sock
+        self.cond = threading.Condition()
+        self.writing = False  # The writer has taken a batch and is sending it
+        self.detached = False  # Handed to another process: close our descriptor, leave the connection alone
+        self.writer = threading.Thread(target=self.write_loop, daemon=True)
+        self.writer.start()
+
+    def send(self, data):
+        with self.cond:
+            return super().send(data)
+
+    def use_frames(self, reply, encoder, decoder):
+        with self.cond:  # No broadcast can slip a plain line in after the reply
+            super().use_frames(reply, encoder, decoder)
+
+    def wait_for_room(self):
+        #Called with self.cond held; wait for the writer to take the queued data
+        return self.cond.wait_for(
+            lambda: self.closing or len(self.outbound) < self.max_queue, self.block_timeout
+        ) and not self.closing
+
+    def wake_writer(self):
+        self.cond.notify_all()
+
+    def write_loop(self):
+        #Writer thread: take everything queued and send it until the connection closes
+        try:
+            while True:
+                with self.cond:
+                    self.writing = False
+                    self.cond.wait_for(lambda: self.outbound or self.closing)
+                    if not self.outbound:
+                        break  # Closing and fully flushed
+                    batch = list(self.outbound)
+                    self.outbound.clear()
+                    self.writing = True
+                    self.cond.notify_all()  # Wake producers waiting under the block policy
+
+                send_buffers(self.sock, batch)
+        except OSError:
+            self.abort()
+        finally:
+            if not self.detached:
+                try:
+                    self.sock.shutdown(socket.SHUT_RDWR)  # The peer sees EOF and our reader's recv returns
+                except OSError:
+                    pass
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+
+    @property
+    def flushed(self):
+        return not self.outbound and not self.writing
+
+    def close(self):
+        with self.cond:
+            self.closing = True
+            self.cond.notify_all()
+
+    def abort(self):
+        with self.cond:
+            self.closing = True
+            self.outbound.clear()
+            self.cond.notify_all()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)  # Unblocks the reader thread's recv
+        except OSError:
+            pass
+
+    def detach(self):
+        with self.cond:
+            self.detached = True
+            self.closing = True
+            self.outbound.clear()
+            self.cond.notify_all()  # The writer stops and closes its socket object
+
+    def wait_closed(self, timeout=None):
+        self.writer.join(timeout)
+
+
+class AsyncConnection(ClientConnection):
+    #Connection for the asyncio engine: a writer task per client drains the queue into the StreamWriter
+    def __init__(self, writer, address, **kwargs):
+        super().__init__(address, **kwargs)
+        self.writer = writer
+        self.ready = asyncio.Event()  # Set when there is data to write or the connection is closing
+        self.drained = asyncio.Event()  # Set when the queue is back under its limit
+        self.drained.set()
+        self.reader = None  # The client's StreamReader and the task reading it, set by the server
+        self.reader_task = None
+        self.idle = False  # The reader is waiting for data, so stopping it loses nothing
+        self.task = asyncio.ensure_future(self.write_loop())
+
+    def wait_for_room(self):
+        #The event loop cannot block, so queue past the limit and make the producer wait in wait_drained
+        self.drained.clear()
+        self.stats.backlogged.add(self)
+        return True
+
+    def wake_writer(self):
+        self.ready.set()
+
+    async def write_loop(self):
+        #Writer task: take everything queued and write it until the connection closes
+        try:
+            while True:
+                await self.ready.wait()
+                self.ready.clear()
+                if not self.outbound:
+                    if self.closing:
+                        break
+                    continue
+
+                batch = list(self.outbound)
+                self.outbound.clear()
+                self.writer.writelines(batch)
+                if self.closing:
+                    break
+                await self.writer.drain()  # Waits while the client is not reading
+
+                if not self.drained.is_set() and len(self.outbound) < self.max_queue:
+                    self.drained.set()
+                    self.stats.backlogged.discard(self)
+        except (ConnectionError, OSError):
+            self.abort()
+        finally:
+            self.drained.set()
+            self.stats.backlogged.discard(self)
+            self.writer.close()
+
+    async def wait_drained(self, timeout):
+        #Wait for a backlogged queue to drain, returns False if it did not within the timeout
+        try:
+            await asyncio.wait_for(self.drained.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    @property
+    def flushed(self):
+        return not self.outbound and not self.writer.transport.get_write_buffer_size()
+
+    def close(self):
+        self.closing = True
+        self.ready.set()
+
+    def abort(self):
+        self.closing = True
+        self.outbound.clear()
+        self.ready.set()
+        self.writer.transport.abort()  # The reader sees EOF and disconnects the client
+
+    def detach(self):
+        self.closing = True
+        self.outbound.clear()
+        self.ready.set()  # The writer task stops and closes the transport, which only closes our descriptor
+
+    async def read_buffered(self):
+        #What the StreamReader holds that the reader never took: data that woke the reader just
+        #before a handoff cancelled it. Called with reading paused; reads until a read would
+        #have to wait for the socket.
+        data = bytearray()
+        while True:
+            self.writer.transport.pause_reading()  # Again: the StreamReader resumes reading once its buffer drains
+            read = asyncio.ensure_future(self.reader.read(RECV_SIZE))
+            await asyncio.sleep(0)  # The read runs up to its first wait, if it has one
+            if not read.done():
+                read.cancel()  # Nothing buffered; a read cancelled while waiting takes nothing
+                await asyncio.wait([read])
+                return bytes(data)
+            if read.exception() is not None or not read.result():
+                return bytes(data)  # Gone or at EOF, which the reader finds out when it runs again
+            data += read.result()
+
+    async def wait_closed(self, timeout=None):
+        await asyncio.wait([self.task], timeout=timeout)
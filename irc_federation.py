@@ -0,0 +1,243 @@
+import json
+import logging
+import socket
+import threading
+import time
+from typing import Dict, Set
+
+from irc_cluster import BUS_MAX_LINE, encode_event
+from irc_connection import ThreadedConnection
+from irc_framing import RECV_SIZE, LineFramer
+
+LINK_QUEUE_SIZE = 65536  # Events a peer may have waiting; links block rather than drop
+LINK_TIMEOUT = 30.0  # Seconds a link may stay blocked before it is treated as split
+RECONNECT_DELAYS = (1, 2, 5, 10, 30)  # Backoff between attempts to re-link to a configured peer
+
+log = logging.getLogger('irc.federation')
+
+
+class Link:
+    #One server-to-server connection and the servers reachable through it
+    def __init__(self, name, sock, address):
+        self.name = name  # The peer server's name
+        self.servers: Set[str] = {name}  # Every server on the far side of this link
+        self.conn = ThreadedConnection(sock, address, max_queue=LINK_QUEUE_SIZE,
+                                       policy='block', block_timeout=LINK_TIMEOUT)
+
+    def send(self, data):
+        try:
+            self.conn.send(data)
+        except ConnectionResetError:
+            pass  # Link is going down, the reader will handle the split
+
+
+class Federation:
+    #Links IRCServer instances into one network. Servers form a spanning tree: a link to a
+    #server that is already reachable is refused, so every event has exactly one path to
+    #every server. Local room events are sent on every link, and an event from one link is
+    #applied locally and forwarded on all the others. When a link drops, every server behind
+    #it is gone (a netsplit): its members are removed and the rest of the tree is told.
+    def __init__(self, server, name, link_host='localhost', link_port=None, peers=()):
+        self.server = server
+        self.name = name  # Unique name of this server in the network
+        self.link_host = link_host
+        self.link_port = link_port  # Port other servers link to, None to only dial out
+        self.peers = list(peers)  # (host, port) of servers to dial
+        self.socket = None
+        self.running = False
+        self.lock = threading.Lock()  # Guards links and routes
+        self.links: Dict[str, Link] = {}  # Peer name -> link
+        self.routes: Dict[str, Link] = {}  # Server name -> link it is reachable through
+
+    def start(self):
+        self.running = True
+        if self.link_port is not None:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.socket.bind((self.link_host, self.link_port))
+            self.socket.listen(16)
+            threading.Thread(target=self.accept_loop, daemon=True).start()
+            log.info("Server %s accepting links on %s:%s", self.name, self.link_host, self.link_port)
+
+        for host, port in self.peers:
+            threading.Thread(target=self.dial_loop, args=(host, port), daemon=True).start()
+
+    def accept_loop(self):
+        while self.running:
+            try:
+                sock, address = self.socket.accept()
+            except OSError:
+                break
+            threading.Thread(target=self.run_link, args=(sock, address), daemon=True).start()
+
+    def dial_loop(self, host, port):
+        #Keep a link to a configured peer, re-dialling with backoff after a split
+        attempt = 0
+        while self.running:
+            try:
+                sock = socket.create_connection((host, port), timeout=5)
+                sock.settimeout(None)
+            except OSError:
+                time.sleep(RECONNECT_DELAYS[min(attempt, len(RECONNECT_DELAYS) - 1)])
+                attempt += 1
+                continue
+
+            if self.run_link(sock, (host, port)):
+                attempt = 0  # Was linked, so try again straight after the split
+            else:
+                attempt += 1  # Refused, e.g. the peer is already reachable another way
+            if self.running:
+                time.sleep(RECONNECT_DELAYS[min(attempt, len(RECONNECT_DELAYS) - 1)])
+
+    def run_link(self, sock, address):
+        #Handshake, burst, then relay events until the link drops; returns False if the link was refused
+        framer = LineFramer(BUS_MAX_LINE)
+        link = None
+        try:
+            sock.sendall(encode_event('SERVER', self.name, self.name))
+            while self.running:
+                data = sock.recv(RECV_SIZE)
+                if not data:
+                    break
+
+                for line in framer.feed(data):
+                    if line is None:
+                        continue
+                    event = json.loads(line)
+                    if link is None:
+                        link = self.add_link(event, sock, address)
+                        if link is None:
+                            return False
+                    else:
+                        self.handle_event(link, event)
+        except (OSError, ValueError):
+            pass
+        finally:
+            if link is not None:
+                self.remove_link(link)
+            else:
+                sock.close()
+        return link is not None
+
+    def add_link(self, event, sock, address):
+        #The peer's first line names it; refuse names already in the tree so it stays a tree
+        kind, _, name = event
+        with self.lock:
+            if kind != 'SERVER' or name == self.name or name in self.routes:
+                sock.sendall(encode_event('ERROR', self.name, f"Server {name} is already linked"))
+                log.warning("Refused link from %s at %s: already linked", name, address)
+                return None
+
+            link = Link(name, sock, address)
+            self.links[name] = link
+            self.routes[name] = link
+            others = [other for other in self.links.values() if other is not link]
+            known = [server for server, route in self.routes.items() if route is not link]
+
+        log.info("Linked to server %s at %s", name, address)
+        for other in others:
+            other.send(encode_event('SERVER', self.name, name))
+        self.send_burst(link, known)
+        return link
+
+    def send_burst(self, link, known):
+        #Tell a new peer about every server, room and member on our side of the link
+        burst = [encode_event('SERVER', self.name, server) for server in known]
+        server = self.server
+        for room in server.all_rooms():
+            room_name = room.name
+            burst.append(encode_event('CREATE', self.name, room_name))
+            for session_id in room.member_snapshot():
+                session = server.sessions.get(session_id)
+                if session is not None:
+                    burst.append(encode_event('JOIN', self.name, room_name, session.nickname))
+            for origin, nickname in room.remote_members:
+                if self.routes.get(origin) is not link:
+                    burst.append(encode_event('JOIN', origin, room_name, nickname))
+        if burst:
+            link.send(b''.join(burst))
+
+    def remove_link(self, link):
+        #Netsplit: forget every server behind the link and tell the rest of the tree
+        with self.lock:
+            if self.links.get(link.name) is link:
+                del self.links[link.name]
+            lost = [server for server in link.servers if self.routes.get(server) is link]
+            for server in lost:
+                del self.routes[server]
+            others = list(self.links.values())
+
+        link.conn.abort()
+        log.warning("Netsplit: lost %s", ', '.join(sorted(lost)) or link.name)
+        for server in lost:
+            for other in others:
+                other.send(encode_event('SQUIT', self.name, server))
+            self.server.call_soon(self.server.remote_drop, server, f"netsplit {self.name} {link.name}")
+
+    def handle_event(self, link, event):
+        #Apply an event from a peer and forward it to the rest of the tree
+        kind, origin, *args = event
+        if kind == 'SERVER':
+            with self.lock:
+                if args[0] in self.routes or args[0] == self.name:
+                    loop = True
+                else:
+                    loop = False
+                    self.routes[args[0]] = link
+                    link.servers.add(args[0])
+            if loop:
+                link.conn.abort()  # Two paths to one server: break the cycle
+                return
+        elif kind == 'SQUIT':
+            with self.lock:
+                if self.routes.get(args[0]) is link:
+                    del self.routes[args[0]]
+                link.servers.discard(args[0])
+            self.server.call_soon(self.server.remote_drop, args[0], f"netsplit {origin} {args[0]}")
+        elif kind == 'ERROR':
+            log.warning("Link error from %s: %s", link.name, args[0])
+            return
+        elif origin == self.name:
+            return  # Our own event came back, only possible mid-split
+        else:
+            self.server.call_soon(self.apply_event, kind, origin, args)
+
+        data = encode_event(kind, origin, *args)
+        for other in list(self.links.values()):
+            if other is not link:
+                other.send(data)
+
+    def apply_event(self, kind, origin, args):
+        #Runs on the server's engine thread
+        server = self.server
+        if kind == 'MSG':
+            server.remote_message(args[0], args[1], args[2])
+        elif kind == 'CREATE':
+            server.ensure_room(args[0])
+        elif kind == 'JOIN':
+            server.remote_join(origin, args[0], args[1])
+        elif kind == 'LEAVE':
+            server.remote_leave(origin, args[0], args[1])
+        elif kind == 'QUIT':
+            server.remote_quit(origin, args[0])
+        elif kind == 'NICK':
+            server.remote_nick(origin, args[0], args[1])
+
+    def publish(self, kind, *args):
+        #Send a local room event to every peer
+        data = encode_event(kind, self.name, *args)
+        for link in list(self.links.values()):
+            link.send(data)
+
+    def close(self):
+        self.running = False
+        if self.socket:
+            self.socket.close()
+        for link in list(self.links.values()):
+            link.conn.abort()
+
+
+def parse_peer(value):
+    #host:port from the command line
+    host, _, port = value.rpartition(':')
+    return (host or 'localhost', int(port))
@@ -0,0 +1,204 @@
+import struct
+import zlib
+from typing import List, Optional
+
+RECV_SIZE = 16384  # Bytes read from a socket per call
+MAX_LINE_LENGTH = 4096  # Longest command line accepted, in bytes
+
+#Binary frames, negotiated with CAP REQ frames (or zlib): a 4 byte big-endian header holding the
+#payload length, with the top bit set when the payload is deflated, then the payload, which is
+#one or more complete lines. Compressed payloads are raw deflate primed with ZDICT.
+FRAME_HEADER = struct.Struct('>I')
+COMPRESSED = 0x80000000  # Header flag: the payload is deflated
+MAX_FRAME = 256 * 1024  # Largest payload accepted, in bytes after decompression
+COMPRESS_MIN = 256  # Shorter server frames are sent as they are, see FrameEncoder
+COMPRESS_LEVEL = 1  # Server frames are compressed on the broadcast path, so fast beats small
+WINDOW_BITS = 12  # Server frames are mostly short messages; a 4KB window is much cheaper to set up
+MEM_LEVEL = 4
+
+#Preset dictionary for deflate: text that recurs in replies and commands, so a frame compresses
+#from its first bytes. The most common strings are at the end, where matches are cheapest.
+ZDICT = (
+    b"INFO: No more rooms.\nMORE: after=ROOMS:\nMembers in room ' does not exist.\n"
+    b"ERROR: You are not in room 'ERROR: Room '' already exists.\nSUCCESS: You are now known as "
+    b" is now known as  disconnected.\nSUCCESS: Left room 'SUCCESS: Joined room '"
+    b"LIST WHO JOIN LEAVE CREATE HISTORY PONG PING PRIVMSG MSG "
+    b"the and you that this for with have not but are was what just will ing ed "
+    b"NOTIFICATION:  has left the room 'NOTIFICATION:  has joined the room '.\n"
+    b"MESSAGE_SENT: [] : \n["
+)
+
+
+class LineFramer:
+    #Incremental framer for newline terminated (\n or \r\n) lines.
+    #Bytes are buffered until a full line has arrived, so commands split across reads are joined and
+    #several pipelined commands in one read come back as separate lines. Lines are split on the raw
+    #bytes before decoding; '\n' never occurs inside a multibyte UTF-8 sequence, so a character split
+    #across two reads is only decoded once the whole line is here.
+    def __init__(self, max_line_length=MAX_LINE_LENGTH):
+        self.buffer = bytearray()  # Bytes of the incomplete line at the end of the stream
+        self.max_line_length = max_line_length
+        self.discarding = False  # True while skipping the rest of an overlong line
+
+    def feed(self, data) -> List[Optional[str]]:
+        #Add received bytes and return the complete lines, without their line endings.
+        #An overlong line is dropped and reported as a single None entry.
+        buffer = self.buffer
+        buffer += data
+        lines = []
+        start = 0
+        while True:
+            end = buffer.find(b'\n', start)
+            if end < 0:
+                break
+
+            if self.discarding:
+                self.discarding = False  # The end of the overlong line, already reported
+            elif end - start > self.max_line_length:
+                lines.append(None)
+            else:
+                stop = end - 1 if end > start and buffer[end - 1] == 13 else end  # Drop the \r of \r\n
+                lines.append(buffer[start:stop].decode('utf-8', 'replace'))
+            start = end + 1
+
+        if start:
+            del buffer[:start]
+
+        if len(buffer) > self.max_line_length:
+            #No line ending in sight: drop what we have and skip ahead to the next one
+            buffer.clear()
+            if not self.discarding:
+                self.discarding = True
+                lines.append(None)
+        elif self.discarding:
+            buffer.clear()
+        return lines
+
+
+def frame(payload, compressed=False):
+    #One frame around an already encoded (and maybe deflated) payload
+    return FRAME_HEADER.pack(len(payload) | (COMPRESSED if compressed else 0)) + payload
+
+
+def split_payloads(data, size=MAX_FRAME):
+    #Cut data into pieces of at most size bytes, at line endings where possible
+    start = 0
+    while start < len(data):
+        end = start + size
+        if end < len(data):
+            cut = data.rfind(b'\n', start, end)
+            if cut >= start:
+                end = cut + 1
+        yield data[start:end]
+        start = end
+
+
+class FrameEncoder:
+    #Frames for the server to send. A compressed frame is deflated on its own, needing nothing but
+    #ZDICT to read, so the same frame can go to every client that asked for compression: one
+    #encoder is shared by all of them and remembers its last frame, so a broadcast handing the same
+    #bytes object to each recipient is compressed once. Safe to share between threads: the cache
+    #is one tuple, swapped whole. Payloads under COMPRESS_MIN are only framed: deflate saves a few
+    #bytes on a chat line, and on the thread engine every zlib call lets the writer threads in,
+    #which breaks up their batches, so compressing each short broadcast costs far more than it saves.
+    def __init__(self, compress=False):
+        self.compress = compress
+        self.last = (None, b'')  # (data, its frame)
+
+    def encode(self, data):
+        last = self.last
+        if last[0] is data:
+            return last[1]
+        if len(data) > MAX_FRAME:
+            encoded = b''.join(self.encode_payload(payload) for payload in split_payloads(data))
+        else:
+            encoded = self.encode_payload(data)
+        self.last = (data, encoded)
+        return encoded
+
+    def encode_payload(self, payload):
+        if self.compress and len(payload) >= COMPRESS_MIN:
+            compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, -WINDOW_BITS, MEM_LEVEL, zdict=ZDICT)
+            deflated = compressor.compress(payload) + compressor.flush()
+            if len(deflated) < len(payload):
+                return frame(deflated, True)
+        return frame(payload)
+
+
+class StreamEncoder:
+    #Frames for a client to send. Its connection is the only reader, so compressed frames carry
+    #on one deflate stream, flushed at the end of each frame: later commands refer back to earlier
+    #ones, which is where a bot repeating itself saves the most. Everything is compressed: the
+    #cost is per write, and a write carries whatever commands piled up meanwhile.
+    def __init__(self, compress=False):
+        self.compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15, zdict=ZDICT) if compress else None
+
+    def encode(self, data):
+        frames = []
+        for payload in split_payloads(data):
+            if self.compressor is not None:
+                frames.append(frame(self.compressor.compress(payload) + self.compressor.flush(zlib.Z_SYNC_FLUSH), True))
+            else:
+                frames.append(frame(payload))
+        return b''.join(frames)
+
+
+class FrameDecoder:
+    #Incremental decoder for frames, a drop-in for LineFramer once frames are negotiated: feed
+    #returns the lines of every complete frame, with None for a line over max_line_length.
+    #stream=True reads frames from StreamEncoder (one deflate stream), False from FrameEncoder
+    #(each frame on its own). Raises ValueError for a frame over max_frame bytes or a payload that
+    #does not inflate, after which the stream cannot be trusted.
+    def __init__(self, max_line_length=MAX_LINE_LENGTH, max_frame=MAX_FRAME, stream=False):
+        self.buffer = bytearray()
+        self.max_line_length = max_line_length
+        self.max_frame = max_frame
+        self.stream = zlib.decompressobj(-15, zdict=ZDICT) if stream else None
+
+    def feed(self, data) -> List[Optional[str]]:
+        buffer = self.buffer
+        buffer += data
+        lines = []
+        start = 0
+        header_size = FRAME_HEADER.size
+        while len(buffer) - start >= header_size:
+            header, = FRAME_HEADER.unpack_from(buffer, start)
+            size = header & ~COMPRESSED
+            if size > self.max_frame:
+                raise ValueError("Frame too long")
+            end = start + header_size + size
+            if end > len(buffer):
+                break
+            if header & COMPRESSED:
+                payload = self.inflate(buffer[start + header_size:end])
+                self.split(payload, 0, len(payload), lines)
+            else:
+                self.split(buffer, start + header_size, end, lines)
+            start = end
+
+        if start:
+            del buffer[:start]
+        return lines
+
+    def inflate(self, payload):
+        decompressor = self.stream or zlib.decompressobj(-15, zdict=ZDICT)
+        try:
+            inflated = decompressor.decompress(payload, self.max_frame + 1)
+        except zlib.error as e:
+            raise ValueError(f"Bad compressed frame: {e}") from None
+        if len(inflated) > self.max_frame or decompressor.unconsumed_tail:
+            raise ValueError("Frame too long")
+        return inflated
+
+    def split(self, data, start, end, lines):
+        #The lines of one payload, data[start:end]; the last one ends with the payload, line ending or not
+        while start < end:
+            stop = data.find(b'\n', start, end)
+            if stop < 0:
+                stop = end
+            if stop - start > self.max_line_length:
+                lines.append(None)
+            else:
+                line_end = stop - 1 if stop > start and data[stop - 1] == 13 else stop  # Drop the \r of \r\n
+                lines.append(data[start:line_end].decode('utf-8', 'replace'))
+            start = stop + 1
@@ -0,0 +1,163 @@
+import json
+import logging
+import os
+import socket
+import struct
+import threading
+
+HEADER = struct.Struct('>I')  # Length of the JSON message that follows it
+MAX_FDS = 200  # Descriptors passed per message; Linux takes at most 253 in one (SCM_MAX_FD)
+HANDOFF_TIMEOUT = 10.0  # Seconds either side waits for the other at each step of a handoff
+
+log = logging.getLogger('irc.handoff')
+
+#Zero-downtime restart. The running server listens on a Unix socket; a new server process
+#started with the same path connects to it and the two talk in length-prefixed JSON messages,
+#with file descriptors passed alongside them (SCM_RIGHTS):
+#
+#  new -> old  takeover          the old server stops accepting and reading, and drains its queues
+#  old -> new  state + listeners rooms with their history, the session counter and the listening sockets
+#  old -> new  clients + sockets one per connection handed over, MAX_FDS to a message
+#  old -> new  end
+#  new -> old  ready             the old server lets go and exits; until then it can still resume
+#
+#The new server waits for the old one to close the channel before it binds anything of its own.
+
+
+def send_message(sock, message, sockets=()):
+    #One message, with the descriptors of sockets passed along with its first byte
+    data = json.dumps(message, separators=(',', ':')).encode()
+    packet = HEADER.pack(len(data)) + data
+    if sockets:
+        sent = socket.send_fds(sock, [packet], [s.fileno() for s in sockets])
+        packet = packet[sent:]
+    if packet:
+        sock.sendall(packet)
+
+
+def receive_message(sock):
+    #The next message and the sockets that came with it; (None, []) when the other side has gone
+    header, fds, flags, _ = socket.recv_fds(sock, HEADER.size, MAX_FDS)
+    sockets = [socket.socket(fileno=fd) for fd in fds]
+    if flags & socket.MSG_CTRUNC:
+        for sock in sockets:
+            sock.close()
+        raise OSError("Descriptors were lost in the handoff (is the open file limit too low?)")
+    if not header:
+        return None, sockets
+    header += receive_exactly(sock, HEADER.size - len(header))
+    size, = HEADER.unpack(header)
+    return json.loads(receive_exactly(sock, size)), sockets
+
+
+def receive_exactly(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionResetError("The other server went away during the handoff")
+        data += chunk
+    return data
+
+
+class HandoffListener:
+    #Unix socket where a new server process asks this one to hand over. A connection is passed
+    #to on_successor(channel) on the listener's own thread and closed when it returns.
+    def __init__(self, path, on_successor):
+        self.path = path
+        self.on_successor = on_successor
+        self.socket = None
+        self.running = False
+
+    def start(self):
+        try:
+            os.unlink(self.path)  # Left behind by a server that did not shut down
+        except FileNotFoundError:
+            pass
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.bind(self.path)
+        self.socket.listen(1)
+        self.running = True
+        threading.Thread(target=self.accept_loop, daemon=True).start()
+        log.info("Listening for a successor on %s", self.path)
+
+    def accept_loop(self):
+        while self.running:
+            try:
+                channel, _ = self.socket.accept()
+            except OSError:
+                break  # Closed
+            try:
+                channel.settimeout(HANDOFF_TIMEOUT)
+                self.on_successor(channel)
+            except Exception as e:
+                log.warning("Handoff failed: %s", e)
+            finally:
+                channel.close()
+
+    def close(self):
+        #Stop listening and remove the socket file, so the next server can listen there
+        if not self.running:
+            return
+        self.running = False
+        self.socket.close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class Handover:
+    #What a new server received from the one it replaces: its state, its listening sockets as
+    #(entry, socket) and its client connections as (entry, socket)
+    def __init__(self, channel, state, listeners, clients):
+        self.channel = channel
+        self.state = state
+        self.listeners = listeners
+        self.clients = clients
+
+    def finish(self, timeout=HANDOFF_TIMEOUT):
+        #Tell the old server everything arrived, and wait until it has let go of its ports
+        try:
+            send_message(self.channel, {'type': 'ready'})
+            self.channel.settimeout(timeout)
+            self.channel.recv(1)  # Returns at EOF, once the old server is done
+        except OSError as e:
+            log.warning("The old server did not confirm the handoff: %s", e)
+        finally:
+            self.channel.close()
+
+
+def take_over(path, timeout=HANDOFF_TIMEOUT):
+    #Ask the server listening at path to hand over to this process; returns the Handover, or
+    #None if no server is listening there
+    channel = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        channel.connect(path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        channel.close()
+        return None
+
+    try:
+        channel.settimeout(timeout)
+        send_message(channel, {'type': 'takeover', 'pid': os.getpid()})
+        state, listeners = receive_message(channel)
+        if state is None or state.get('type') != 'state':
+            raise ConnectionResetError("The old server refused the handoff")
+        if len(listeners) != len(state['listeners']):
+            raise ValueError("Listening sockets missing from the handoff")
+
+        clients = []
+        while True:
+            message, sockets = receive_message(channel)
+            if message is None:
+                raise ConnectionResetError("The old server went away during the handoff")
+            if message['type'] == 'end':
+                break
+            if len(sockets) != len(message['clients']):
+                raise ValueError("Client sockets missing from the handoff")
+            clients.extend(zip(message['clients'], sockets))
+    except BaseException:
+        channel.close()
+        raise
+    return Handover(channel, state, list(zip(state['listeners'], listeners)), clients)
@@ -0,0 +1,91 @@
+import threading
+from collections import OrderedDict, deque
+from itertools import islice
+
+
+class HistoryBudget:
+    #Server-wide cap on the bytes held by all room histories together. When it is exceeded,
+    #the room that has gone longest without a message gives up its oldest messages first, so
+    #rooms that went quiet make way for the ones in use instead of keeping the budget forever.
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.used = 0
+        self.rooms = OrderedDict()  # RoomHistory -> None, least recently appended to first; only non-empty ones
+        self.lock = threading.Lock()
+
+    def reserve(self, history, size):
+        #Count size bytes added to history (negative if it shrank); returns the bytes over
+        #budget, <= 0 if within it
+        with self.lock:
+            self.used += size
+            self.rooms[history] = None
+            self.rooms.move_to_end(history)
+            return self.used - self.max_bytes
+
+    def evict(self, size):
+        #Free at least size bytes, starting with the least recently appended room. Each room is
+        #trimmed under its own history lock, never while holding self.lock.
+        freed = 0
+        while freed < size:
+            with self.lock:
+                if not self.rooms:
+                    break
+                history = next(iter(self.rooms))
+            dropped = history.drop_oldest(size - freed)
+            freed += dropped
+            with self.lock:
+                self.used -= dropped
+                if not history.entries:
+                    self.rooms.pop(history, None)  # Back in line with its next append
+
+
+class RoomHistory:
+    #Ring buffer of a room's recent messages, stored as the encoded lines sent to members.
+    #Bounded by a message count and a byte size per room, and by the server-wide budget.
+    #Writers hold the room's lock; self.lock is only taken briefly, so the budget can trim
+    #this history from whichever room went over.
+    def __init__(self, max_messages, max_bytes, budget):
+        self.entries = deque()
+        self.size = 0  # Bytes held by self.entries
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.budget = budget
+        self.lock = threading.Lock()  # Guards entries and size; no other lock is taken while holding it
+
+    def __len__(self):
+        return len(self.entries)
+
+    def append(self, data):
+        if self.max_messages <= 0 or len(data) > self.max_bytes:
+            return
+
+        freed = 0
+        with self.lock:
+            self.entries.append(data)
+            self.size += len(data)
+            while len(self.entries) > self.max_messages or self.size > self.max_bytes:
+                oldest = self.entries.popleft()
+                self.size -= len(oldest)
+                freed += len(oldest)
+        over_budget = self.budget.reserve(self, len(data) - freed)
+        if over_budget > 0:
+            self.budget.evict(over_budget)
+
+    def drop_oldest(self, size):
+        #Drop the oldest messages until size bytes are freed or none are left; returns the bytes freed
+        freed = 0
+        with self.lock:
+            while self.entries and freed < size:
+                oldest = self.entries.popleft()
+                self.size -= len(oldest)
+                freed += len(oldest)
+        return freed
+
+    def last(self, count=None):
+        #The most recent count messages (all of them if count is None), oldest first
+        with self.lock:
+            if count is None or count >= len(self.entries):
+                return list(self.entries)
+            if count <= 0:
+                return []
+            return list(islice(self.entries, len(self.entries) - count, None))
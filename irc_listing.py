@@ -0,0 +1,165 @@
+import re
+from bisect import bisect_left, bisect_right, insort
+from fnmatch import translate
+from heapq import nlargest, nsmallest
+from itertools import chain, islice
+
+DEFAULT_LIMIT = 100  # Entries per LIST/WHO page unless limit= asks otherwise
+MAX_LIMIT = 1000
+GLOB_CHARS = '*?['
+SORT_BELOW = 10  # select_page sorts inputs up to this many pages long instead of heap-selecting
+CHUNK = 512  # Names per chunk of a SortedNames; a chunk is split in two when it doubles
+
+
+class ListingQuery:
+    #Arguments of LIST and WHO: [pattern] [sort=KEY] [limit=N] [after=CURSOR]. A pattern
+    #with * ? or [ is a glob, any other pattern is a prefix.
+    __slots__ = ('pattern', 'sort', 'limit', 'after')
+
+    def __init__(self, pattern=None, sort='name', limit=DEFAULT_LIMIT, after=None):
+        self.pattern = pattern
+        self.sort = sort
+        self.limit = limit
+        self.after = after
+
+    @property
+    def glob(self):
+        return self.pattern is not None and any(char in GLOB_CHARS for char in self.pattern)
+
+    def prefix(self):
+        #The literal start of the pattern: every match begins with it
+        pattern = self.pattern or ''
+        for index, char in enumerate(pattern):
+            if char in GLOB_CHARS:
+                return pattern[:index]
+        return pattern
+
+    def glob_match(self):
+        #The compiled glob's match function, or None if the prefix alone decides (no glob, or
+        #a glob like "abc*")
+        if not self.glob or self.pattern == self.prefix() + '*':
+            return None
+        return re.compile(translate(self.pattern)).match
+
+
+class SortedNames:
+    #Sorted index of names that is read without a lock while names are added. The names are
+    #kept in chunks: add() copies one chunk and the list of chunks into a new SortedNames and
+    #leaves this one as it was, so a reader holding it keeps a consistent snapshot and a
+    #writer copies a few hundred names instead of all of them.
+    __slots__ = ('chunks', 'firsts', 'length')
+
+    def __init__(self, names=()):
+        names = sorted(names)
+        self.chunks = [names[i:i + CHUNK] for i in range(0, len(names), CHUNK)]
+        self.firsts = [chunk[0] for chunk in self.chunks]  # First name of every chunk, to bisect on
+        self.length = len(names)
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return chain.from_iterable(self.chunks)
+
+    def add(self, name):
+        #A new SortedNames with name in it as well
+        chunks = list(self.chunks)
+        firsts = list(self.firsts)
+        if not chunks:
+            chunks.append([name])
+            firsts.append(name)
+        else:
+            index = max(0, bisect_right(firsts, name) - 1)
+            chunk = list(chunks[index])
+            insort(chunk, name)
+            if len(chunk) >= 2 * CHUNK:
+                chunks[index:index + 1] = [chunk[:CHUNK], chunk[CHUNK:]]
+                firsts[index:index + 1] = [chunk[0], chunk[CHUNK]]
+            else:
+                chunks[index] = chunk
+                firsts[index] = chunk[0]
+        added = SortedNames.__new__(SortedNames)
+        added.chunks = chunks
+        added.firsts = firsts
+        added.length = self.length + 1
+        return added
+
+    def starting_at(self, key, inclusive=True):
+        #The names from key on (after key if not inclusive), in order
+        index = max(0, bisect_right(self.firsts, key) - 1)  # The chunk key would be in
+        chunks = self.chunks[index:]
+        if not chunks:
+            return iter(())
+        start = (bisect_left if inclusive else bisect_right)(chunks[0], key)
+        return chain(islice(chunks[0], start, None), chain.from_iterable(chunks[1:]))
+
+
+def parse_query(args, sorts):
+    #Parse the words after LIST/WHO; sorts are the allowed sort keys, the first is the
+    #default. Raises ValueError with a message for the client.
+    query = ListingQuery(sort=sorts[0])
+    for word in ' '.join(arg for arg in args if arg).split():
+        key, separator, value = word.partition('=')
+        key = key.lower()
+        if separator and key == 'sort':
+            if value not in sorts:
+                raise ValueError(f"sort must be one of {', '.join(sorts)}")
+            query.sort = value
+        elif separator and key == 'limit':
+            if not value.isdigit() or not 1 <= int(value) <= MAX_LIMIT:
+                raise ValueError(f"limit must be a number from 1 to {MAX_LIMIT}")
+            query.limit = int(value)
+        elif separator and key == 'after':
+            query.after = value
+        elif query.pattern is None:
+            query.pattern = word
+        else:
+            raise ValueError(f"unexpected '{word}'")
+    return query
+
+
+def page_sorted(names, query):
+    #One page of names in order from a SortedNames: a prefix (or the literal start of a glob)
+    #and the cursor are found by bisection, so only the page itself is scanned, plus the
+    #names a glob rejects. Returns the page and whether more names follow.
+    prefix = query.prefix()
+    if query.after is not None and query.after >= prefix:
+        following = names.starting_at(query.after, inclusive=False)
+    else:
+        following = names.starting_at(prefix)
+    glob = query.glob_match()
+    page = []
+    for name in following:
+        if not name.startswith(prefix):
+            break
+        if glob is not None and not glob(name):
+            continue
+        if len(page) == query.limit:
+            return page, True
+        page.append(name)
+    return page, False
+
+
+def filter_names(names, query):
+    #The names matching the query's pattern, in their original order
+    if query.pattern is None:
+        return names
+    prefix = query.prefix()
+    if prefix:
+        names = [name for name in names if name.startswith(prefix)]
+    glob = query.glob_match()
+    if glob is not None:
+        names = [name for name in names if glob(name)]
+    return names
+
+
+def select_page(keys, after, limit, reverse=False):
+    #One page of sort keys in order (descending if reverse), starting after the cursor key,
+    #without sorting everything. Returns the page and whether more follow.
+    if after is not None:
+        keys = [key for key in keys if key < after] if reverse else [key for key in keys if key > after]
+    if len(keys) <= SORT_BELOW * limit:
+        page = sorted(keys, reverse=reverse)[:limit + 1]  # Cheaper than a heap when the page is a good part of the input
+    else:
+        page = (nlargest if reverse else nsmallest)(limit + 1, keys)
+    return page[:limit], len(page) > limit
@@ -0,0 +1,274 @@
+import logging
+import queue
+import socket
+import sys
+import threading
+import time
+from bisect import bisect_left
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict
+
+#Histogram bucket upper bounds
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+                   0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)  # Seconds
+FANOUT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)  # Recipients
+LATENCY_SAMPLE = 16  # Time one command in this many; reading the clock costs more than a cheap command
+
+log = logging.getLogger('irc.metrics')
+
+
+class Histogram:
+    #Fixed-bucket histogram. observe() takes no lock: it runs on the hot path of every command,
+    #and an increment lost to a thread switch now and then does not matter to a metric.
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # One per bound, the last one for values above them all
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def quantile(self, q):
+        #Upper bound of the bucket holding the q-quantile, inf if it is above every bound
+        total = self.count
+        if not total:
+            return 0.0
+        rank = q * total
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def samples(self, name, labels=''):
+        #Prometheus text format lines: cumulative buckets, then sum and count
+        prefix = labels + ',' if labels else ''
+        lines = []
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {seen}')
+        seen += self.counts[-1]
+        lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {seen}')
+        suffix = f'{{{labels}}}' if labels else ''
+        lines.append(f'{name}_sum{suffix} {self.sum}')
+        lines.append(f'{name}_count{suffix} {seen}')
+        return lines
+
+
+class CommandHistogram(Histogram):
+    #Latency of one command type. Only one call in LATENCY_SAMPLE is timed, so the buckets hold
+    #a sample; calls counts them all.
+    def __init__(self, bounds):
+        super().__init__(bounds)
+        self.calls = 0
+
+    def timed(self, handler):
+        #handler wrapped to observe how long each call takes, called in place of it when a call is sampled
+        def call(*args):
+            started = time.perf_counter()
+            result = handler(*args)
+            self.observe(time.perf_counter() - started)
+            return result
+        return call
+
+
+class TimedLock:
+    #A threading.Lock that records how long each acquisition waited. The uncontended case is a
+    #single non-blocking acquire; only a contended one reads the clock.
+    def __init__(self, waits):
+        self.lock = threading.Lock()
+        self.waits = waits  # Histogram of wait times, only updated while the lock is held
+
+    def __enter__(self):
+        if self.lock.acquire(False):
+            self.waits.observe(0.0)
+        else:
+            started = time.perf_counter()
+            self.lock.acquire()
+            self.waits.observe(time.perf_counter() - started)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.lock.release()
+
+
+class Metrics:
+    #Counters and histograms of one server. Gauges (connections, rooms, queue depths) are not
+    #kept here but read from the server when a report is made.
+    def __init__(self):
+        self.started = time.monotonic()
+        self.connections_accepted = 0
+        self.connections_rejected: Dict[str, int] = {}  # Reason ('full', 'per_ip') -> connections turned away
+        self.unknown_commands = 0
+        self.command_errors = 0
+        self.rate_limited: Dict[str, int] = {}  # Rate limit name ('msg', 'join', 'room') -> commands refused
+        self.flood_disconnects = 0
+        self.ping_timeouts = 0  # Connections dropped for not answering a keepalive PING (or not registering) in time
+        self.tls_handshakes: Dict[str, int] = {}  # Result ('full', 'resumed', 'failed') -> TLS handshakes
+        self.commands: Dict[str, CommandHistogram] = {}  # Command name -> its calls and sampled latencies
+        self.fanout = Histogram(FANOUT_BUCKETS)  # Recipients per room broadcast
+        self.lock_wait = Histogram(LATENCY_BUCKETS)  # Seconds spent waiting for IRCServer.lock
+
+    def command(self, name):
+        #The latency histogram of a command, created when the dispatch table is built
+        return self.commands.setdefault(name, CommandHistogram(LATENCY_BUCKETS))
+
+    def tls_handshake(self, result):
+        self.tls_handshakes[result] = self.tls_handshakes.get(result, 0) + 1
+
+    def summary(self, gauges):
+        #Lines for the STATS command
+        uptime = max(time.monotonic() - self.started, 1e-9)
+        rejected = ', '.join(f"{reason} {count}" for reason, count in sorted(self.connections_rejected.items()))
+        lines = [
+            f"STATS: uptime {uptime:.0f}s, {gauges['connections']} connections "
+            f"({self.connections_accepted} accepted, rejected {rejected or 'none'}), {gauges['rooms']} rooms",
+        ]
+        for name, latency in sorted(self.commands.items()):
+            count = latency.calls
+            if count:
+                lines.append(f"STATS: {name} {count} ({count / uptime:.1f}/s) latency p50 "
+                             f"{latency.quantile(0.5) * 1000:.3f}ms p99 {latency.quantile(0.99) * 1000:.3f}ms")
+        lines.append(f"STATS: unknown commands {self.unknown_commands}, failed commands {self.command_errors}")
+        limited = ', '.join(f"{name} {count}" for name, count in sorted(self.rate_limited.items())) or 'none'
+        lines.append(f"STATS: rate limited {limited}, flood disconnects {self.flood_disconnects}, "
+                     f"ping timeouts {self.ping_timeouts}")
+        if self.tls_handshakes:
+            handshakes = self.tls_handshakes
+            lines.append(f"STATS: TLS handshakes full {handshakes.get('full', 0)}, "
+                         f"resumed {handshakes.get('resumed', 0)}, failed {handshakes.get('failed', 0)}")
+        lines.append(f"STATS: broadcast fan-out {self.fanout.count} broadcasts, p50 {self.fanout.quantile(0.5)} "
+                     f"p99 {self.fanout.quantile(0.99)} recipients")
+        lines.append(f"STATS: server lock wait p99 {self.lock_wait.quantile(0.99) * 1000:.3f}ms, "
+                     f"{self.lock_wait.count - self.lock_wait.counts[0]} contended of {self.lock_wait.count}")
+        lines.append(f"STATS: outbound queued {gauges['queued']}, deepest {gauges['max_depth']}, "
+                     f"dropped {gauges['dropped']}, slow disconnects {gauges['slow_disconnects']}")
+        return lines
+
+    def prometheus(self, gauges):
+        #The Prometheus text exposition format
+        lines = [
+            '# TYPE irc_uptime_seconds gauge',
+            f'irc_uptime_seconds {time.monotonic() - self.started}',
+            '# TYPE irc_connections gauge',
+            f"irc_connections {gauges['connections']}",
+            '# TYPE irc_connections_accepted_total counter',
+            f'irc_connections_accepted_total {self.connections_accepted}',
+            '# TYPE irc_connections_rejected_total counter',
+            *(f'irc_connections_rejected_total{{reason="{reason}"}} {count}'
+              for reason, count in sorted(self.connections_rejected.items())),
+            '# TYPE irc_rooms gauge',
+            f"irc_rooms {gauges['rooms']}",
+            '# TYPE irc_commands_total counter',
+        ]
+        for name, latency in sorted(self.commands.items()):
+            lines.append(f'irc_commands_total{{command="{name}"}} {latency.calls}')
+        lines += [
+            '# TYPE irc_unknown_commands_total counter',
+            f'irc_unknown_commands_total {self.unknown_commands}',
+            '# TYPE irc_command_errors_total counter',
+            f'irc_command_errors_total {self.command_errors}',
+            '# TYPE irc_rate_limited_total counter',
+            *(f'irc_rate_limited_total{{limit="{name}"}} {count}' for name, count in sorted(self.rate_limited.items())),
+            '# TYPE irc_flood_disconnects_total counter',
+            f'irc_flood_disconnects_total {self.flood_disconnects}',
+            '# TYPE irc_ping_timeouts_total counter',
+            f'irc_ping_timeouts_total {self.ping_timeouts}',
+            '# TYPE irc_tls_handshakes_total counter',
+            *(f'irc_tls_handshakes_total{{result="{result}"}} {count}'
+              for result, count in sorted(self.tls_handshakes.items())),
+            '# TYPE irc_command_seconds histogram',
+        ]
+        for name, latency in sorted(self.commands.items()):
+            lines += latency.samples('irc_command_seconds', f'command="{name}"')
+        lines.append('# TYPE irc_broadcast_fanout histogram')
+        lines += self.fanout.samples('irc_broadcast_fanout')
+        lines.append('# TYPE irc_lock_wait_seconds histogram')
+        lines += self.lock_wait.samples('irc_lock_wait_seconds')
+        lines += [
+            '# TYPE irc_outbound_queued gauge',
+            f"irc_outbound_queued {gauges['queued']}",
+            '# TYPE irc_outbound_queue_depth_max gauge',
+            f"irc_outbound_queue_depth_max {gauges['max_depth']}",
+            '# TYPE irc_outbound_dropped_total counter',
+            f"irc_outbound_dropped_total {gauges['dropped']}",
+            '# TYPE irc_slow_disconnects_total counter',
+            f"irc_slow_disconnects_total {gauges['slow_disconnects']}",
+            '# TYPE irc_blocked_total counter',
+            f"irc_blocked_total {gauges['blocked']}",
+        ]
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsEndpoint:
+    #Local scrape socket: every connection gets the metrics in the Prometheus text format as an
+    #HTTP response, so both a Prometheus scraper and `curl`/`nc` can read it
+    def __init__(self, server, host='127.0.0.1', port=9100):
+        self.server = server
+        self.host = host
+        self.port = port
+        self.socket = None
+        self.running = False
+
+    def start(self):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((self.host, self.port))
+        self.socket.listen(16)
+        self.running = True
+        threading.Thread(target=self.accept_loop, daemon=True).start()
+        log.info("Metrics on http://%s:%s/metrics", self.host, self.port)
+
+    def accept_loop(self):
+        while self.running:
+            try:
+                sock, _ = self.socket.accept()
+            except OSError:
+                break
+            try:
+                sock.settimeout(1.0)
+                try:
+                    sock.recv(4096)  # The request; every path gets the metrics
+                except socket.timeout:
+                    pass
+                body = self.server.metrics.prometheus(self.server.metrics_gauges()).encode()
+                sock.sendall(b"HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                             b"Content-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body)
+            except OSError:
+                pass
+            finally:
+                sock.close()
+
+    def close(self):
+        self.running = False
+        if self.socket:
+            self.socket.close()
+
+
+class DeferredQueueHandler(QueueHandler):
+    #Hand records to the queue as they are; the listener thread formats them, not the caller
+    def prepare(self, record):
+        return record
+
+
+def start_logging(level='INFO'):
+    #Route the 'irc' loggers through a queue so logging never waits on stdout; returns the
+    #listener, which writes the records from its own thread until it is stopped
+    log_queue = queue.SimpleQueue()
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+    listener = QueueListener(log_queue, handler)
+
+    logger = logging.getLogger('irc')
+    logger.setLevel(level)
+    logger.addHandler(DeferredQueueHandler(log_queue))
+    logger.propagate = False
+    listener.start()
+    return listener
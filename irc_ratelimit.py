@@ -0,0 +1,64 @@
+from time import monotonic
+
+
+class TokenBucket:
+    #Allows `rate` actions per second with bursts of up to `burst`. Tokens are refilled lazily
+    #from the time since the last take, so a check is a few arithmetic operations and no timer.
+    #Not locked: each bucket belongs to one connection, or is taken under its room's lock.
+    __slots__ = ('rate', 'burst', 'tokens', 'stamp')
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.stamp = monotonic()
+
+    def take(self):
+        #Use one token, returns False (and uses none) if the bucket is empty
+        now = monotonic()
+        tokens = self.tokens + (now - self.stamp) * self.rate
+        if tokens > self.burst:
+            tokens = self.burst
+        self.stamp = now
+        if tokens < 1.0:
+            self.tokens = tokens
+            return False
+        self.tokens = tokens - 1.0
+        return True
+
+
+class RateLimits:
+    #Rate limit settings of a server. A rate of 0 turns that limit off.
+    # - msg: MSG/PRIVMSG commands per second from one connection
+    # - join: CREATE/JOIN/LEAVE/NICK commands per second from one connection
+    # - room: messages per second into one room, from all of its members together
+    #A connection whose commands are rejected more than flood_strikes times in quick succession
+    #(one strike is forgiven per second) is disconnected; 0 never disconnects.
+    def __init__(self, msg_rate=0.0, msg_burst=10, join_rate=0.0, join_burst=5, room_rate=0.0, room_burst=50,
+                 flood_strikes=0):
+        self.msg_rate = msg_rate
+        self.msg_burst = msg_burst
+        self.join_rate = join_rate
+        self.join_burst = join_burst
+        self.room_rate = room_rate
+        self.room_burst = room_burst
+        self.flood_strikes = flood_strikes
+
+    def client_buckets(self):
+        #Limit name -> bucket for a new connection, only for the limits that are on
+        buckets = {}
+        if self.msg_rate > 0:
+            buckets['msg'] = TokenBucket(self.msg_rate, self.msg_burst)
+        if self.join_rate > 0:
+            buckets['join'] = TokenBucket(self.join_rate, self.join_burst)
+        return buckets
+
+    def strikes_bucket(self):
+        return TokenBucket(1.0, self.flood_strikes) if self.flood_strikes > 0 else None
+
+    def room_bucket(self):
+        return TokenBucket(self.room_rate, self.room_burst) if self.room_rate > 0 else None
+
+    def enabled(self, limit):
+        #Whether the per-connection limit of that name is on
+        return (self.msg_rate if limit == 'msg' else self.join_rate) > 0
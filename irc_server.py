@@ -1,340 +1,1872 @@
+import argparse
+import asyncio
+import base64
+import errno
+import functools
+import ipaddress
+import itertools
+import logging
+import os
+import select
+import selectors
+import signal
 import socket
+import ssl
 import sys
 import threading
 import time
-from typing import Dict, List, Set
+from time import perf_counter
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+from irc_connection import (SLOW_CONSUMER_POLICIES, AsyncConnection, ClientConnection,
+                            OutboundStats, ThreadedConnection)
+from irc_framing import MAX_LINE_LENGTH, RECV_SIZE, FrameDecoder, FrameEncoder, LineFramer
+from irc_handoff import MAX_FDS, HandoffListener, receive_message, send_message, take_over
+from irc_history import HistoryBudget, RoomHistory
+from irc_listing import SortedNames, filter_names, page_sorted, parse_query, select_page
+from irc_metrics import LATENCY_SAMPLE, Metrics, MetricsEndpoint, TimedLock, start_logging
+from irc_ratelimit import RateLimits
+from irc_timerwheel import TimerWheel
+from irc_tls import HANDSHAKE_TIMEOUT, TLSSocket, server_context
+from irc_wal import CREATE, JOIN, LEAVE, MSG, WriteAheadLog, recover
+
+log = logging.getLogger('irc')
+
+ENGINES = ('thread', 'asyncio')
+ACCEPT_BATCH = 128  # Connections the thread engine accepts per wakeup before checking for other events
+LISTING_CHUNK = 16 * 1024  # Bytes per send when a LIST/WHO page is streamed out
+ROOM_SORTS = ('name', '-name', 'size', '-size')
+MEMBER_SORTS = ('name', '-name')
+
+#Static replies, encoded once
+HELP_MESSAGE = (
+    "Available commands:\n"
+    " - CREATE <room_name>: Create a new room.\n"
+    " - JOIN <room_name>: Join an existing room.\n"
+    " - LEAVE <room_name>: Leave a room.\n"
+    " - LIST [pattern] [sort=name|-name|size|-size] [limit=N] [after=CURSOR]: List rooms, a page at a time.\n"
+    " - WHO <room_name> [pattern] [sort=name|-name] [limit=N] [after=CURSOR]: List members of a room.\n"
+    " - MSG <room_name> <message>: Send a message to a room.\n"
+    " - PRIVMSG <nickname> <message>: Send a private message to a user.\n"
+    " - NICK <nickname>: Change your nickname.\n"
+    " - HISTORY <room_name> [count]: Show recent messages in a room.\n"
+    " - STATS: Show server metrics (local connections only).\n"
+    " - PONG <token>: Answer a PING from the server (clients do this automatically).\n"
+    " - QUIT: Disconnect from the server.\n"
+    " - HELP: Show this help message.\n"
+    " - CAP LS | CAP REQ <frames|zlib>: Switch to binary frames, optionally compressed (for bots).\n"
+).encode()
+UNKNOWN_COMMAND = b"ERROR: Unknown command. Type HELP for commands.\n"
+SERVER_FULL = b"ERROR: Server is full, try again later.\n"
+TOO_MANY_FROM_ADDRESS = b"ERROR: Too many connections from your address.\n"
+RATE_LIMITED = b"ERROR: Rate limit exceeded, slow down.\n"
+COMMAND_FAILED = b"ERROR: Failed to process command.\n"
+NICKNAME_IN_USE = b"ERROR: Nickname already in use.\n"
+SHUTTING_DOWN = b"SERVER: Server is shutting down.\n"
+RESTARTING = b"SERVER: Server is restarting, please reconnect.\n"
+CAPABILITIES = ('frames', 'zlib')  # Offered by CAP LS; zlib is frames with compression
+PING = b"PING keepalive\n"
+
+
+def nick_key(nickname):
+    #Nicknames are unique regardless of case: the nickname index is keyed by this
+    key = nickname.casefold()
+    return nickname if key == nickname else key  # Share the string when it is already folded
+
+
+class Session:
+    #A registered client. A server holds one per connection, so it is slotted, and rooms refer
+    #to it by its small integer id instead of by the connection object.
+    __slots__ = ('id', 'nickname', 'key', 'connection', 'rooms', 'buckets', 'strikes')
+
+    def __init__(self, session_id, nickname, key, connection, buckets=None, strikes=None):
+        self.id = session_id
+        self.nickname = nickname
+        self.key = key  # nick_key(nickname): the nickname index and WHO order use it
+        self.connection = connection
+        self.rooms: Tuple[str, ...] = ()  # Names of the rooms joined, as the room table's own strings; replaced, not mutated
+        self.buckets = buckets  # Rate limit name -> TokenBucket, None when no per-connection limit is on
+        self.strikes = strikes  # TokenBucket of rejected commands allowed before a flood disconnect, or None
+
+
+class Room:
+    #A chat room with its own lock, so traffic in one room never waits on another
+    def __init__(self, name, history, bucket=None):
+        self.name = name  # The one copy of the name; members' Session.rooms refer to this string
+        self.history = history  # RoomHistory of recent messages, guarded by self.lock
+        self.bucket = bucket  # TokenBucket limiting messages into the room, taken under self.lock; None for no limit
+        self.lock = threading.Lock()  # Serializes membership changes and messages in this room
+        self.members: Dict[int, ClientConnection] = {}  # Session id -> connection; changed and iterated only under self.lock
+        self.snapshot: Optional[Dict[int, ClientConnection]] = None  # Copy of members for readers without the lock, None once stale
+        self.remote_members: FrozenSet[Tuple[str, str]] = frozenset()  # (origin, nickname) of members on other cluster workers
+
+    def add_member(self, session_id, connection):
+        #Callers hold self.lock
+        self.members[session_id] = connection
+        self.snapshot = None
+
+    def remove_members(self, session_ids):
+        #Callers hold self.lock
+        members = self.members
+        for session_id in session_ids:
+            members.pop(session_id, None)
+        self.snapshot = None
+
+    def member_snapshot(self):
+        #The members as a dict that is never mutated, for readers that do not hold self.lock
+        #(WHO, the federation burst). It is copied when asked for after a change, not on every
+        #join and leave, so filling or emptying a big room stays linear. Callers must not hold self.lock.
+        snapshot = self.snapshot
+        if snapshot is None:
+            with self.lock:
+                snapshot = self.snapshot
+                if snapshot is None:
+                    snapshot = self.snapshot = dict(self.members)
+        return snapshot
 
 
 class IRCServer:
-    def __init__(self, host='localhost', port=6667):
+    #Command name -> (handler method, required arguments, maximum arguments). The last
+    #argument of a two-argument command takes the rest of the line, e.g. the text of MSG.
+    #Arguments past the required ones are optional and left out of the handler call.
+    COMMANDS = {
+        'CREATE': ('create_room', 1, 1),
+        'JOIN': ('join_room', 1, 1),
+        'LEAVE': ('leave_room', 1, 1),
+        'LIST': ('list_rooms', 0, 2),
+        'WHO': ('list_room_members', 1, 2),
+        'MSG': ('send_room_message', 2, 2),
+        'PRIVMSG': ('send_private_message', 2, 2),
+        'NICK': ('change_nickname', 1, 1),
+        'HISTORY': ('send_history', 1, 2),
+        'STATS': ('send_stats', 0, 0),
+        'PONG': ('receive_pong', 1, 1),
+        'QUIT': ('quit_client', 0, 0),
+        'HELP': ('send_help', 0, 0),
+        'CAP': ('negotiate_capabilities', 1, 2),
+    }
+
+    #Command name -> the per-connection rate limit it counts against
+    RATE_LIMITED = {
+        'MSG': 'msg',
+        'PRIVMSG': 'msg',
+        'NICK': 'join',
+        'CREATE': 'join',
+        'JOIN': 'join',
+        'LEAVE': 'join',
+    }
+
+    def __init__(self, host='localhost', port=6667, engine='thread',
+                 max_queue=1024, slow_consumer='drop_oldest', block_timeout=5.0,
+                 max_line_length=MAX_LINE_LENGTH, reuse_port=False,
+                 history_size=100, history_bytes=64 * 1024, history_total_bytes=64 * 1024 * 1024,
+                 history_on_join=0, rate_limits=None, backlog=1024, max_connections=0, max_per_ip=0,
+                 ping_interval=60.0, ping_timeout=60.0,
+                 tls_port=None, tls_cert=None, tls_key=None, tls_handshake_timeout=HANDSHAKE_TIMEOUT,
+                 drain_timeout=5.0):
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine '{engine}', expected one of {ENGINES}")
+        if slow_consumer not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unknown slow consumer policy '{slow_consumer}', expected one of {SLOW_CONSUMER_POLICIES}")
+        if tls_port is not None and tls_cert is None:
+            raise ValueError("A TLS port needs a certificate (tls_cert)")
+        if tls_port is not None and engine == 'asyncio' and not hasattr(asyncio.StreamWriter, 'start_tls'):
+            raise ValueError("TLS on the asyncio engine needs Python 3.11 or newer")
+
         self.host = host
         self.port = port
-        self.socket = None
+        self.engine = engine  # 'thread' = one thread per client, 'asyncio' = one event loop for all clients
+        self.listeners: List[Tuple[socket.socket, bool]] = []  # Thread engine: (listening socket, speaks TLS)
+        self.async_servers: List[Tuple[asyncio.AbstractServer, bool]] = []  # asyncio engine: (server, speaks TLS)
         self.running = False
+        self.stopped = None  # asyncio.Event that ends serve_async, set by stop()
+        self.shut_down = False  # shutdown() has run; it runs once however many paths call it
+        self.drain_timeout = drain_timeout  # Seconds to flush outbound queues when shutting down or handing over
+        self.max_line_length = max_line_length  # Longest command line accepted from a client, in bytes
+        self.reuse_port = reuse_port  # Share the port with other worker processes (SO_REUSEPORT)
+        self.backlog = backlog  # Connections the kernel queues for us before accept
+        self.wakeup = None  # socketpair that wakes the thread engine's accept loop on shutdown
+        self.loop = None  # Event loop of the asyncio engine, for callbacks from other threads
+        self.bus = None  # irc_cluster.BusLink when running as one worker of a multi-process cluster
+        self.federation = None  # irc_federation.Federation when linked to other servers
+        self.wal = None  # irc_wal.WriteAheadLog when room events are logged to disk
+
+        #Zero-downtime restart: a new process can take over the listening sockets, connections
+        #and rooms through self.handoff_listener. While a handoff is under way the server is
+        #frozen: it accepts nothing, its timers stop, and readers of the connections moving stop.
+        self.handoff_listener = None  # irc_handoff.HandoffListener when a new process may take over
+        self.adopted = None  # irc_handoff.Handover this server was started from, until its engine starts
+        self.frozen = False
+        self.handed_off = False  # The connections now belong to a new process: do not close them
+        self.thawed = threading.Event()  # Cleared while frozen; the thread engine's accept loop waits on it
+        self.thawed.set()
+        self.freeze_pipe = None  # os.pipe() that wakes the thread engine's readers for a handoff
+        self.freeze_cond = threading.Condition()  # Guards self.frozen_readers and the clients' handoff flags
+        self.frozen_clients: List[ClientConnection] = []  # Connections picked for the handoff under way
+        self.frozen_readers: Set[ClientConnection] = set()  # Those of them whose reader has stopped
+        self.frozen_listeners: List[Tuple[socket.socket, bool]] = []  # asyncio engine: listening sockets kept for a handoff
+
+        #TLS: an optional second port where clients connect with TLS. Handshakes run on the
+        #client's own thread (thread engine) or coroutine (asyncio), never in the accept loop.
+        self.tls_port = tls_port
+        self.tls_context = server_context(tls_cert, tls_key) if tls_port is not None else None
+        self.tls_handshake_timeout = tls_handshake_timeout  # Seconds a TLS client has to finish its handshake
+
+        #Outbound queue settings: every client gets a bounded queue drained by its own writer
+        self.max_queue = max_queue  # Messages a client may have waiting before the slow consumer policy applies
+        self.slow_consumer = slow_consumer  # 'drop_oldest', 'disconnect' or 'block'
+        self.block_timeout = block_timeout  # Seconds a producer waits on a full queue before disconnecting the client
+        self.outbound_stats = OutboundStats()
+
+        #Clients that negotiated frames share one encoder per format, so a broadcast is framed
+        #(and compressed) once however many of them are in the room
+        self.frame_encoders = {'frames': FrameEncoder(), 'zlib': FrameEncoder(compress=True)}
+
+        #Room history: every room keeps its recent messages, bounded per room and server-wide
+        self.history_size = history_size  # Messages kept per room
+        self.history_bytes = history_bytes  # Bytes kept per room
+        self.history_budget = HistoryBudget(history_total_bytes)  # Bytes kept by all rooms together
+        self.history_on_join = history_on_join  # Messages replayed to a client that joins a room, 0 for none
+
+        #Token bucket rate limits per connection and per room
+        self.rate_limits = rate_limits or RateLimits()
+
+        #Admission control: connections are counted from accept to close, including ones still choosing a nickname
+        self.max_connections = max_connections  # 0 for no limit
+        self.max_per_ip = max_per_ip  # 0 for no limit
+        self.connection_count = 0
+        self.connections_per_ip: Dict[str, int] = {}
+
+        #Keepalive: a client that sends nothing for ping_interval seconds gets a PING and is
+        #disconnected if it still sends nothing for ping_timeout seconds; one that has not
+        #chosen a nickname by then is disconnected without a PING
+        self.ping_interval = ping_interval  # 0 to turn keepalives off
+        self.ping_timeout = ping_timeout
+        self.timers = TimerWheel() if ping_interval > 0 else None  # Keepalive timer of every connection
 
         #Data structures to manage clients and rooms
-        self.clients: Dict[socket.socket, Dict] = {} # Dictionary to hold client data
-        self.rooms: Dict[str, Set[socket.socket]] = {}  # Dictionary to hold rooms and their clients
-        self.nicknames: Dict[str, socket.socket] = {}  # Map nicknames to sockets
+        self.clients: Dict[ClientConnection, Session] = {} # Session of every registered connection
+        self.connections: Set[ClientConnection] = set()  # Every connection being read, registered or not, for a handoff
+        self.sessions: Dict[int, Session] = {}  # Session id -> session, to resolve room members
+        self.session_ids = itertools.count(1)
+        self.rooms: Dict[str, Room] = {}  # Dictionary to hold rooms by name; rooms are added under self.lock and looked up without it
+        self.room_names = SortedNames()  # Sorted index of self.rooms for LIST, replaced when a room is added; iterate this, not self.rooms
+        self.nicknames: Dict[str, Session] = {}  # nick_key(nickname) -> session; changed under self.lock, read without it
+
+        self.metrics = Metrics()
+        self.metrics_endpoint = None  # irc_metrics.MetricsEndpoint serving a scrape socket
+        self.lock = TimedLock(self.metrics.lock_wait)  # Guards the client registry and room creation; each Room has its own lock
 
-        self.lock = threading.Lock()  # Lock for thread-safe operations
+        #Bound handlers looked up by process_message, built once instead of per command. Each command is
+        #under its name in upper and lower case, so neither has to be case-folded first.
+        self.dispatch = {}
+        for name, (method, required, maximum) in self.COMMANDS.items():
+            handler, latency = getattr(self, method), self.metrics.command(name)
+            self.dispatch[name] = self.dispatch[name.lower()] = (
+                handler, latency.timed(handler), required, maximum, latency, self.limit_for(name))
 
     def start(self):
-        #Start the server
+        #Start the server with the selected engine
+        if self.engine == 'asyncio':
+            self.start_async()
+            return
+
         try:
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1) #set the socket option to reuse the address
-            self.socket.settimeout(1)
-            self.socket.bind((self.host, self.port))
-            self.socket.listen(5)  # Listen for incoming connections, allowing a backlog of 5 connections
+            if self.adopted is not None:
+                for entry, listener in self.adopted.listeners:
+                    listener.setblocking(False)
+                    self.listeners.append((listener, entry['tls']))
+            else:
+                self.listeners.append((self.listen(self.port), False))
+                if self.tls_port is not None:
+                    self.listeners.append((self.listen(self.tls_port), True))
+            if self.handoff_listener is not None:
+                self.freeze_pipe = os.pipe()
             self.running = True
+            self.start_links()
+            if self.adopted is not None:
+                clients = []
+                for entry, sock in self.adopted.clients:
+                    sock.setblocking(True)  # The old process may have been an asyncio one
+                    clients.append((entry, ThreadedConnection(sock, tuple(entry['address']), **self.connection_options())))
+                for client in self.adopt_clients(clients):
+                    self.start_reader(client)
 
-            print(f"IRC Server started on {self.host}:{self.port}")
-            print("Waiting for clients to connect...")
+            log.info("IRC Server started on %s:%s", self.host, self.port)
+            if self.tls_port is not None:
+                log.info("TLS on %s:%s", self.host, self.tls_port)
+            log.info("Waiting for clients to connect...")
 
+            #Sleep until a connection arrives or the wakeup socket is written to (by shutdown()
+            #or a handoff). The key data of a listening socket tells whether its clients speak TLS.
+            self.wakeup = socket.socketpair()
+            selector = selectors.DefaultSelector()
+            for listener, tls in self.listeners:
+                selector.register(listener, selectors.EVENT_READ, tls)
+            selector.register(self.wakeup[0], selectors.EVENT_READ)
+            try:
+                while self.running:
+                    for key, _ in selector.select():
+                        if key.data is None:
+                            self.wakeup[0].recv(64)
+                        elif self.running and not self.frozen:
+                            self.accept_pending(key.fileobj, key.data)
+                    if self.frozen:
+                        self.thawed.wait()  # Leave the listening sockets alone until the handoff is decided
+            finally:
+                selector.close()
+                wakeup, self.wakeup = self.wakeup, None
+                for sock in wakeup:
+                    sock.close()
+        
+        except Exception as e:
+            log.error("Server error: %s", e)
+        finally:
+            self.shutdown()
 
-            while self.running:
+    def listen(self, port):
+        #A non-blocking listening socket for the thread engine's accept loop
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1) #set the socket option to reuse the address
+        if self.reuse_port:
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1) #let the kernel spread connections over the workers
+        listener.setblocking(False)  # Accepts are driven by the selector, not by polling
+        listener.bind((self.host, port))
+        listener.listen(self.backlog)  # Connections the kernel holds for us while we are busy
+        return listener
+
+    def accept_pending(self, listener, tls=False):
+        #Accept the connections waiting in the backlog, up to ACCEPT_BATCH per wakeup
+        for _ in range(ACCEPT_BATCH):
+            try:
+                client_socket, address = listener.accept()
+            except (BlockingIOError, InterruptedError):
+                return  # Backlog drained
+            except OSError as e:
+                if e.errno in (errno.EMFILE, errno.ENFILE, errno.ENOBUFS, errno.ENOMEM):
+                    log.warning("Cannot accept connections: %s", e)
+                    time.sleep(0.1)  # The connection stays queued; do not spin on it
+                    return
+                if e.errno == errno.ECONNABORTED:
+                    continue
+                raise
+
+            client_socket.setblocking(True)
+            self.metrics.connections_accepted += 1
+            refusal = self.admit(address)
+            if refusal is not None:
                 try:
-                    client_socket, address = self.socket.accept() #accept a new client connection, where client_socket is the socket object for the client and address is the address of the client
-                    print(f"Connected by {address}")
+                    client_socket.send(refusal)  # Best effort, a fresh socket has room for one line
+                except OSError:
+                    pass
+                client_socket.close()
+                continue
 
-                    #Start a new thread for each client
-                    client_thread = threading.Thread(target=self.handle_client, args=(client_socket, address)) # Create a new thread for each client
-                    client_thread.daemon = True  # Set the thread as a daemon so it exits when the main program exits
-                    client_thread.start()
+            log.debug("Connected by %s", address)
+            #Start a new thread for each client
+            client_thread = threading.Thread(target=self.handle_client, args=(client_socket, address, tls)) # Create a new thread for each client
+            client_thread.daemon = True  # Set the thread as a daemon so it exits when the main program exits
+            try:
+                client_thread.start()
+            except RuntimeError:
+                log.warning("Cannot start a thread for %s", address)
+                self.release(address)
+                client_socket.close()
 
-                except socket.timeout:
-                    continue
+    def admit(self, address):
+        #Count a new connection, or return the reply that turns it away
+        host = address[0] if isinstance(address, tuple) else None
+        with self.lock:
+            if self.max_connections and self.connection_count >= self.max_connections:
+                reason = 'full'
+            elif self.max_per_ip and host is not None and self.connections_per_ip.get(host, 0) >= self.max_per_ip:
+                reason = 'per_ip'
+            else:
+                self.connection_count += 1
+                if host is not None:
+                    self.connections_per_ip[host] = self.connections_per_ip.get(host, 0) + 1
+                return None
+
+        rejected = self.metrics.connections_rejected
+        rejected[reason] = rejected.get(reason, 0) + 1
+        return SERVER_FULL if reason == 'full' else TOO_MANY_FROM_ADDRESS
+
+    def release(self, address):
+        #A connection counted by admit() has closed
+        host = address[0] if isinstance(address, tuple) else None
+        with self.lock:
+            self.connection_count -= 1
+            if host is not None:
+                remaining = self.connections_per_ip.get(host, 0) - 1
+                if remaining > 0:
+                    self.connections_per_ip[host] = remaining
+                else:
+                    self.connections_per_ip.pop(host, None)
+
+    def handle_client(self, client_socket, address, tls=False):
+        #Handle individual slient connections
+        if tls:
+            client_socket = self.accept_tls(client_socket, address)
+            if client_socket is None:
+                self.release(address)
+                return
+        client = ThreadedConnection(client_socket, address, **self.connection_options())
+        client.tls = tls
+        client.framer = LineFramer(self.max_line_length)
+        if not self.track(client):
+            self.release(address)
+            return
+        self.watch(client)
+        client.send(b"NICK: Enter your nickname: ") # Prompt for nickname and send the string as a sequence of bytes
+        self.read_client(client)
 
+    def start_reader(self, client):
+        #Read a connection on a thread of its own (handed over, or resumed after a failed handoff)
+        reader = threading.Thread(target=self.read_client, args=(client,))
+        reader.daemon = True
+        reader.start()
+
+    def read_client(self, client):
+        #Read commands from a client until it disconnects, or until it is handed to a new process
+        recv_buffer = bytearray(RECV_SIZE)  # Reused for every read from this client
+        recv_view = memoryview(recv_buffer)
+        poller = None
+        if self.freeze_pipe is not None and not client.tls:
+            #Wait on the freeze pipe too, so a handoff can stop this reader without taking
+            #anything off the socket
+            poller = select.poll()
+            poller.register(client.sock, select.POLLIN)
+            poller.register(self.freeze_pipe[0], select.POLLIN)
+        try:
+            while self.running:
+                if poller is not None:
+                    events = poller.poll()
+                    if any(fd == self.freeze_pipe[0] for fd, _ in events):
+                        if client.handoff and self.stop_reading(client):
+                            return
+                        poller.unregister(self.freeze_pipe[0])  # Not moving; the handoff closes this connection
+                        continue
+                try:
+                    received = client.sock.recv_into(recv_buffer)  # Receive data from the client
                 except socket.error:
-                    if self.running:
-                        print("Socket error occurred while accepting connection.")
                     break
-        
+                if not received:
+                    break  # If no data, client has disconnected
+
+                #One read may hold several pipelined commands, or only part of one
+                if not self.handle_lines(client, client.framer.feed(recv_view[:received])):
+                    break
+
+        except Exception as e:
+            log.warning("Error handling client %s: %s", client.address, e)
+        if client.handoff and self.stop_reading(client):
+            return  # Stopped by a handoff as it was leaving anyway; the new process sees the close
+        self.disconnect_client(client)
+        self.release(client.address)
+
+    def accept_tls(self, client_socket, address):
+        #TLS handshake of a new connection on the thread engine, run on the client's own thread
+        #so a slow handshake (or a client that never sends one) does not hold up the accept
+        #loop. Returns the TLSSocket, or None if the handshake failed.
+        tls_socket = TLSSocket(client_socket, self.tls_context, server_side=True)
+        try:
+            tls_socket.do_handshake(self.tls_handshake_timeout)
+        except (ssl.SSLError, OSError) as e:
+            self.metrics.tls_handshake('failed')
+            log.debug("TLS handshake with %s failed: %s", address, e)
+            client_socket.close()
+            return None
+        self.metrics.tls_handshake('resumed' if tls_socket.session_reused else 'full')
+        return tls_socket
+
+    def start_async(self):
+        #Start the server on a single asyncio event loop
+        raise_fd_limit()  # Each client holds a file descriptor, so allow as many as the OS permits
+        try:
+            asyncio.run(self.serve_async())
         except Exception as e:
-            print(f"Server error: {e}")
+            log.error("Server error: %s", e)
         finally:
             self.shutdown()
 
-    def handle_client(self, client_socket, address):
-        #Handle individual slient connections
+    async def serve_async(self):
+        #Accept connections and run one coroutine per client until the server is closed
+        self.loop = asyncio.get_running_loop()
+        self.stopped = asyncio.Event()
+        if self.adopted is not None:
+            for entry, listener in self.adopted.listeners:
+                await self.serve_socket(listener, entry['tls'])
+        else:
+            self.async_servers.append((await asyncio.start_server(
+                self.handle_client_async, self.host, self.port, reuse_address=True,
+                reuse_port=self.reuse_port or None, backlog=self.backlog  # asyncio accepts up to backlog connections per wakeup
+            ), False))
+            if self.tls_port is not None:
+                #Plain TCP here too: the handshake is started by handle_client_async after admission control
+                self.async_servers.append((await asyncio.start_server(
+                    functools.partial(self.handle_client_async, tls=True), self.host, self.tls_port, reuse_address=True,
+                    reuse_port=self.reuse_port or None, backlog=self.backlog
+                ), True))
+        self.running = True
+        self.start_links()  # Events from other servers are handed to this loop, so it has to exist first
+        if self.adopted is not None:
+            clients = []
+            for entry, sock in self.adopted.clients:
+                reader, writer = await asyncio.open_connection(sock=sock)
+                client = AsyncConnection(writer, tuple(entry['address']), **self.connection_options())
+                client.reader = reader
+                clients.append((entry, client))
+            for client in self.adopt_clients(clients):
+                client.reader_task = asyncio.ensure_future(self.read_client_async(client))
+
+        log.info("IRC Server (asyncio) started on %s:%s", self.host, self.port)
+        if self.tls_port is not None:
+            log.info("TLS on %s:%s", self.host, self.tls_port)
+        log.info("Waiting for clients to connect...")
+
         try:
-            client_socket.send(b"NICK: Enter your nickname: ") # Prompt for nickname and send the string as a sequence of bytes
-            nickname_data = client_socket.recv(1024).decode('utf-8').strip()  # Receive the nickname from the client
-            if not nickname_data:
-                client_socket.close()
-                return
-            
-            nickname = nickname_data.replace('NICK ', '') #Replace the NICK command with an empty string to get the nickname
+            await self.stopped.wait()
+        finally:
+            #Stop accepting, then flush the shutdown notice while the event loop is still running
+            for server, _ in self.async_servers:
+                server.close()
+            clients = self.close_clients()
+            if clients:
+                await asyncio.wait([client.task for client in clients], timeout=self.drain_timeout)
 
+    async def serve_socket(self, listener, tls):
+        #Accept on a listening socket that came from a handoff, or that a failed one gave back
+        self.async_servers.append((await asyncio.start_server(
+            functools.partial(self.handle_client_async, tls=tls), sock=listener, backlog=self.backlog), tls))
 
-            #check if the nickname is already in use
-            with self.lock:
-                if nickname in self.nicknames:
-                    client_socket.send(b"ERROR: Nickname already in use.\n")
-                    client_socket.close()
-                    return
-                
-                #Register the client
-                self.clients[client_socket] = {
-                    'nickname': nickname,
-                    'address': address,
-                    'rooms': set()  # Set to hold the rooms the client is in
-                }
-
-            client_socket.send(f"Welcome: Hello {nickname}! Type HELP for commands.\n".encode())
-            print(f"Client {nickname} connected from {address}")
-                
+    async def handle_client_async(self, reader, writer, tls=False):
+        #Handle an individual client connection as a coroutine on the event loop
+        address = writer.get_extra_info('peername')
+        self.metrics.connections_accepted += 1
+        refusal = self.admit(address)
+        if refusal is not None:
+            if not tls:
+                writer.write(refusal)  # A TLS client could not read it before its handshake
+            writer.close()  # The transport sends the reply before closing
+            return
 
-            while self.running:
-                try:
-                    data = client_socket.recv(1024).decode('utf-8').strip()  # Receive data from the client
-                    if not data:
-                        break  # If no data, client has disconnected
+        if tls and not await self.accept_tls_async(writer, address):
+            self.release(address)
+            return
 
-                    if not self.process_message(client_socket, data):# Process the received message
-                        break  
+        client = AsyncConnection(writer, address, **self.connection_options())
+        client.tls = tls
+        client.framer = LineFramer(self.max_line_length)
+        client.reader = reader
+        if not self.track(client):
+            self.release(address)
+            return
+        log.debug("Connected by %s", address)
+        self.watch(client)
+        client.send(b"NICK: Enter your nickname: ")
+        client.reader_task = asyncio.current_task()
+        await self.read_client_async(client)
 
-                except socket.error:
+    async def read_client_async(self, client):
+        #Read commands from a client until it disconnects, or until a handoff cancels this while
+        #it waits for data (client.idle) with reading paused
+        reader = client.reader
+        try:
+            while self.running:
+                client.idle = True
+                data = await reader.read(RECV_SIZE)
+                client.idle = False
+                if not data:
+                    break  # If no data, client has disconnected
+
+                if not self.handle_lines(client, client.framer.feed(data)):
                     break
 
+                if self.outbound_stats.backlogged:
+                    await self.wait_for_backlog()
+
+        except (ConnectionError, OSError):
+            pass
+        except asyncio.CancelledError:
+            pass  # Server shutting down or handing over, end quietly
         except Exception as e:
-            print(f"Error handling client {address}: {e}")
-        finally:
-            self.disconnect_client(client_socket)
+            log.warning("Error handling client %s: %s", client.address, e)
+        client.idle = False
+        if client.handoff and self.stop_reading(client):
+            return
+        self.disconnect_client(client)
+        self.release(client.address)
+
+    async def accept_tls_async(self, writer, address):
+        #TLS handshake of a new connection on the asyncio engine. The event loop runs the
+        #handshake a message at a time, so other clients are served while it waits on this one.
+        try:
+            await writer.start_tls(self.tls_context, ssl_handshake_timeout=self.tls_handshake_timeout)
+        except (ssl.SSLError, OSError, asyncio.TimeoutError) as e:
+            self.metrics.tls_handshake('failed')
+            log.debug("TLS handshake with %s failed: %s", address, e)
+            writer.transport.abort()
+            return False
+        reused = writer.get_extra_info('ssl_object').session_reused
+        self.metrics.tls_handshake('resumed' if reused else 'full')
+        return True
+
+    async def wait_for_backlog(self):
+        #Block policy on the asyncio engine: hold back this producer until the full queues drain
+        for backlogged in list(self.outbound_stats.backlogged):
+            if not await backlogged.wait_drained(self.block_timeout):
+                self.outbound_stats.count('slow_disconnects')
+                backlogged.abort()
+
+    def start_links(self):
+        #Connect to the cluster bus and/or peer servers, and open the scrape socket, once the engine is running
+        if self.bus is not None:
+            self.bus.start()
+        if self.federation is not None:
+            self.federation.start()
+        if self.metrics_endpoint is not None:
+            self.metrics_endpoint.start()
+        if self.handoff_listener is not None:
+            self.handoff_listener.start()
+        if self.timers is not None:
+            if self.loop is not None:
+                self.loop.call_later(self.timers.tick, self.tick_async, self.loop.time() + self.timers.tick)
+            else:
+                threading.Thread(target=self.tick_loop, daemon=True).start()
+
+    def propagate(self, kind, *args):
+        #Tell the other workers and linked servers about a local room event
+        if self.bus is not None:
+            self.bus.publish(kind, *args)
+        if self.federation is not None:
+            self.federation.publish(kind, *args)
+
+    def call_soon(self, callback, *args):
+        #Run callback on the engine's thread: the event loop for asyncio, the calling thread otherwise
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(callback, *args)
+        else:
+            callback(*args)
+
+    def connection_options(self):
+        #Outbound queue settings passed to every new connection
+        return {
+            'max_queue': self.max_queue,
+            'policy': self.slow_consumer,
+            'block_timeout': self.block_timeout,
+            'stats': self.outbound_stats,
+        }
+
+    def queue_stats(self):
+        #Snapshot of outbound queue depths and slow consumer counters
+        with self.lock:
+            depths = [client.queue_depth for client in self.clients]
+        return {
+            'connections': len(depths),
+            'queued': sum(depths),
+            'max_depth': max(depths, default=0),
+            'dropped': self.outbound_stats.dropped,
+            'slow_disconnects': self.outbound_stats.slow_disconnects,
+            'blocked': self.outbound_stats.blocked,
+        }
+
+    def metrics_gauges(self):
+        #Current values reported alongside the counters of self.metrics
+        gauges = self.queue_stats()
+        gauges['rooms'] = len(self.rooms)
+        return gauges
+
+    def watch(self, client):
+        #Start the keepalive timer of a new connection
+        if self.timers is not None:
+            self.timers.schedule(client, self.ping_interval)
+
+    def tick_loop(self):
+        #Thread engine: advance the timer wheel once per tick until the server stops
+        deadline = time.monotonic()
+        while self.running:
+            deadline += self.timers.tick
+            time.sleep(max(0.0, deadline - time.monotonic()))
+            if not self.frozen:
+                self.expire_timers()
+
+    def tick_async(self, deadline):
+        #asyncio engine: the same, as a callback on the event loop
+        if not self.running:
+            return
+        if not self.frozen:
+            self.expire_timers()
+        deadline += self.timers.tick
+        self.loop.call_at(deadline, self.tick_async, deadline)
 
-    def process_message(self, client_socket, message):
+    def expire_timers(self):
+        #Check the connections whose keepalive timer went off, then set their next timers in one batch per delay
+        again = {self.ping_interval: [], self.ping_timeout: []}
+        for client in self.timers.advance():
+            try:
+                delay = self.check_keepalive(client)
+            except Exception as e:
+                log.warning("Keepalive check failed for %s: %s", client.address, e)
+                continue
+            if delay is not None:
+                again[delay].append(client)
+        for delay, clients in again.items():
+            if clients:
+                self.timers.schedule_many(clients, delay)
+
+    def check_keepalive(self, client):
+        #Ping a connection that went quiet and drop one that stayed quiet; returns the seconds
+        #until its next check, or None if it is gone
+        if client.closing:
+            return None  # Already being disconnected
+        if client.seen:
+            client.seen = False
+            client.pinged = False
+            return self.ping_interval
+        if client.pinged or client not in self.clients:
+            self.metrics.ping_timeouts += 1
+            log.debug("Ping timeout for %s", client.address)
+            client.abort()  # First, so a reader or writer stuck on a half-open connection lets go of the socket
+            self.disconnect_client(client, 'ping timeout')
+            return None
+        client.pinged = True
+        client.send(PING)
+        return self.ping_timeout
+
+    def handle_lines(self, client, lines):
+        #Handle the lines framed from one read, returns False when the client should be disconnected
+        client.seen = True  # Anything the client sends shows it is alive, not just PONG
+        for line in lines:
+            if client.closing:
+                return False  # Closed by QUIT, the server shutting down or a slow consumer policy: ignore the rest
+            if line is None:
+                client.send(b"ERROR: Line too long.\n")
+                continue
+
+            line = line.strip()
+            if client in self.clients:
+                if not self.process_message(client, line):
+                    return False
+                continue
+
+            #The first line is the nickname
+            if not line:
+                return False
+            nickname = line.replace('NICK ', '') #Replace the NICK command with an empty string to get the nickname
+            if not self.register_client(client, client.address, nickname):
+                return False
+        return True
+
+    def register_client(self, client, address, nickname):
+        #Register a new client under its nickname, returns False if the nickname is taken
+        key = nick_key(nickname)
+        with self.lock:
+            if key in self.nicknames:
+                client.send(NICKNAME_IN_USE)
+                client.close()
+                return False
+
+            #Register the client
+            session = Session(next(self.session_ids), nickname, key, client,
+                              self.rate_limits.client_buckets() or None, self.rate_limits.strikes_bucket())
+            self.clients[client] = session
+            self.sessions[session.id] = session
+            self.nicknames[key] = session
+
+        client.send(f"Welcome: Hello {nickname}! Type HELP for commands.\n".encode())
+        log.debug("Client %s connected from %s", nickname, address)
+        return True
+
+    def process_message(self, client, message):
         #Process client messages according to the IRC protocol
         try:
 
-            if not message:
-                return True  # If message is empty, just return
-
-            parts = message.split(' ', 2)  # Split the message into command and arguments
-            command = parts[0].upper()  # Get the command in uppercase
-
-            if command == 'CREATE' and len(parts) >= 2:
-                self.create_room(client_socket, parts[1])
-            elif command == 'JOIN' and len(parts) >= 2:
-                self.join_room(client_socket, parts[1])
-            elif command == 'LEAVE' and len(parts) >= 2:
-                self.leave_room(client_socket, parts[1])
-            elif command == 'LIST':
-                self.list_rooms(client_socket)
-            elif command == 'WHO' and len(parts) >= 2:
-                self.list_room_members(client_socket, parts[1])
-            elif command == 'MSG' and len(parts) >= 3:
-                room_name = parts[1]
-                message_text = parts[2]
-                self.send_room_message(client_socket, room_name, message_text)
-            elif command == 'QUIT':
-                return False  # Indicate to disconnect the client
-            elif command == 'HELP':
-                self.send_help(client_socket)
+            parts = message.split(' ', 2)  # The command, then arguments; the last argument is the rest of the line
+            entry = self.dispatch.get(parts[0]) or self.dispatch.get(parts[0].upper())
+            if entry is None:
+                if not message:
+                    return True  # If message is empty, just return
+                self.metrics.unknown_commands += 1
+                client.send(UNKNOWN_COMMAND)
+                return True
+
+            handler, timed, required, maximum, latency, limit = entry
+            if limit is not None and not self.clients[client].buckets[limit].take():
+                return self.reject_flood(client, limit)
+
+            count = len(parts) - 1
+            if count < required or (required and not parts[1]):
+                self.metrics.unknown_commands += 1
+                client.send(UNKNOWN_COMMAND)
+                return True
+
+            #One call in LATENCY_SAMPLE goes through the timed wrapper; the rest pay for the count alone
+            calls = latency.calls
+            latency.calls = calls + 1
+            if not calls % LATENCY_SAMPLE:
+                handler = timed
+
+            if maximum == 0 or not count or not parts[1]:
+                result = handler(client)  # No arguments taken, or only optional ones and none given
+            elif maximum == 1 or count == 1:
+                result = handler(client, parts[1])  # Anything after the argument is ignored
             else:
-                client_socket.send(b"ERROR: Unknown command. Type HELP for commands.\n")
+                result = handler(client, parts[1], parts[2])
+
+            return result is not False  # A handler returns False to disconnect the client
 
-            return True  # Indicate that the message was processed successfully
-        
         except Exception as e:
-            nickname = "Unknown"
-            if client_socket in self.clients:
-                nickname = self.clients[client_socket]['nickname']
-            print(f"Error processing message from {nickname}: {e}")
-            client_socket.send(b"ERROR: Failed to process command.\n")
+            session = self.clients.get(client)
+            nickname = session.nickname if session is not None else "Unknown"
+            self.metrics.command_errors += 1
+            log.warning("Error processing message from %s: %s", nickname, e)
+            client.send(COMMAND_FAILED)
             return True  # Continue processing other messages
 
-    def create_room(self, client_socket, room_name):
+    def limit_for(self, command):
+        #The per-connection rate limit a command counts against, None if it is not limited
+        limit = self.RATE_LIMITED.get(command)
+        return limit if limit is not None and self.rate_limits.enabled(limit) else None
+
+    def reject_flood(self, client, limit):
+        #A command went over a rate limit: refuse it, and disconnect a client that keeps going
+        metrics = self.metrics
+        metrics.rate_limited[limit] = metrics.rate_limited.get(limit, 0) + 1
+        session = self.clients[client]
+        if session.strikes is not None and not session.strikes.take():
+            metrics.flood_disconnects += 1
+            client.send(b"ERROR: Disconnected for flooding.\n")
+            log.info("Disconnecting %s for flooding", session.nickname)
+            return False
+        client.send(RATE_LIMITED)
+        return True
+
+    def receive_pong(self, client, token):
+        #PONG: the answer to a keepalive PING; handle_lines already marked the client as alive
+        pass
+
+    def quit_client(self, client):
+        #QUIT: tell the connection loop to disconnect the client
+        return False
+
+    def create_room(self, client, room_name):
         #Create a new chat room
         with self.lock:
             if room_name in self.rooms:
-                client_socket.send(f"ERROR: Room '{room_name}' already exists.\n".encode())
-            else:
-                self.rooms[room_name] = set() # Set to hold clients in the room\
-                nickname = self.clients[client_socket]['nickname'] #set the nickname of the client
-                client_socket.send(f"Room '{room_name}' created by {nickname}.\n".encode())
-                print(f"Room '{room_name}' created by {nickname}.")
+                client.send(f"ERROR: Room '{room_name}' already exists.\n".encode())
+                return
 
-    def join_room(self, client_socket, room_name):
+            self.add_room(self.new_room(room_name))
+            if self.wal is not None:
+                self.wal.append(CREATE, room_name)  # Under the lock, so it is logged before anything in the room
+
+        self.propagate('CREATE', room_name)
+        nickname = self.clients[client].nickname #set the nickname of the client
+        client.send(f"Room '{room_name}' created by {nickname}.\n".encode())
+        log.debug("Room '%s' created by %s.", room_name, nickname)
+
+    def join_room(self, client, room_name):
         #Join a client to a room
-        with self.lock:
-            if room_name not in self.rooms:
-                client_socket.send(f"ERROR: Room '{room_name}' does not exist.\n".encode())
-                return
-            
-            nickname = self.clients[client_socket]['nickname']
-            self.rooms[room_name].add(client_socket) # Add the client to the room
-            self.clients[client_socket]['rooms'].add(room_name) # Add the room to the client's list of rooms
+        room = self.rooms.get(room_name)
+        if room is None:
+            client.send(f"ERROR: Room '{room_name}' does not exist.\n".encode())
+            return
 
+        session = self.clients[client]
+        nickname = session.nickname
+        room_name = room.name  # Keep the room table's copy of the name, not the one parsed from this command
+        with room.lock:
+            room.add_member(session.id, client) # Add the client to the room
+            if room_name not in session.rooms:
+                session.rooms = session.rooms + (room_name,) # Add the room to the client's list of rooms
+            if self.wal is not None:
+                self.wal.append(JOIN, room_name, nickname)
 
-            client_socket.send(f"SUCCESS: Joined room '{room_name}'\n".encode())
+            client.send(f"SUCCESS: Joined room '{room_name}'\n".encode())
+            if self.history_on_join:
+                self.replay_history(client, room, self.history_on_join)
 
             #Notify other clients in the room
             join_msg = f"NOTIFICATION: {nickname} has joined the room '{room_name}'.\n"
-            self.broadcast_to_room(room_name, join_msg, client_socket)
-            print(f"{nickname} joined room '{room_name}'.")
+            self.broadcast_to_room(room, join_msg, session.id)
+            self.propagate('JOIN', room_name, nickname)
+        log.debug("%s joined room '%s'.", nickname, room_name)
 
-    def leave_room(self, client_socket, room_name):
+    def leave_room(self, client, room_name):
         #Remove a client from a room
-        with self.lock:
-            if room_name not in self.rooms:
-                client_socket.send(f"ERROR: Room '{room_name}' does not exist.\n".encode())
-                return
-            
-            if client_socket not in self.rooms[room_name]:
-                client_socket.send(f"ERROR: You are not in room '{room_name}'.\n".encode())
+        room = self.rooms.get(room_name)
+        if room is None:
+            client.send(f"ERROR: Room '{room_name}' does not exist.\n".encode())
+            return
+
+        session = self.clients[client]
+        nickname = session.nickname
+        with room.lock:
+            if session.id not in room.members:
+                client.send(f"ERROR: You are not in room '{room_name}'.\n".encode())
                 return
-            
-            nickname = self.clients[client_socket]['nickname']
-            self.rooms[room_name].remove(client_socket) # Remove the client from the room
-            self.clients[client_socket]['rooms'].remove(room_name) # Remove the room from the client's list of rooms
 
-            client_socket.send(f"SUCCESS: Left room '{room_name}'\n".encode())
+            room.remove_members((session.id,)) # Remove the client from the room
+            session.rooms = tuple(name for name in session.rooms if name != room_name) # Remove the room from the client's list of rooms
+            if self.wal is not None:
+                self.wal.append(LEAVE, room_name, nickname)
+
+            client.send(f"SUCCESS: Left room '{room_name}'\n".encode())
 
             #Notify other clients in the room
             leave_msg = f"NOTIFICATION: {nickname} has left the room '{room_name}'.\n"
-            self.broadcast_to_room(room_name, leave_msg, client_socket)
-            print(f"{nickname} left room '{room_name}'.")
+            self.broadcast_to_room(room, leave_msg, session.id)
+            self.propagate('LEAVE', room_name, nickname)
+        log.debug("%s left room '%s'.", nickname, room_name)
 
+    def list_rooms(self, client, *args):
+        #LIST [pattern] [sort=KEY] [limit=N] [after=CURSOR]: one page of rooms, from the current
+        #snapshots without taking any lock. In name order the page is found in the sorted
+        #index by bisection; by size, only the page is picked out of the matching rooms.
+        try:
+            query = parse_query(args, ROOM_SORTS)
+        except ValueError as e:
+            client.send(f"ERROR: LIST: {e}.\n".encode())
+            return
 
-    def list_rooms(self, client_socket):
-        #List all available rooms
-        with self.lock:
-            if not self.rooms:
-                client_socket.send(b"INFO: No rooms available.\n")
+        names = self.room_names  # Before self.rooms, so every name is in the mapping
+        rooms = self.rooms
+        if query.sort == 'name':
+            page, more = page_sorted(names, query)
+            cursor = page[-1] if more else None
+        else:
+            names = filter_names(names, query)
+            if query.sort == '-name':
+                page, more = select_page(names, query.after, query.limit, reverse=True)
+                cursor = page[-1] if more else None
             else:
-                room_list = "ROOMS:\n"
-                for room_name, members in self.rooms.items():
-                    room_list += f" - {room_name} ({len(members)} members)\n" # Get the name of each room and the number of members in it
-                client_socket.send(room_list.encode())
+                after = None
+                if query.after is not None:
+                    size, _, name = query.after.partition(':')
+                    if not size.isdigit():
+                        client.send(b"ERROR: LIST: after must be a cursor from MORE.\n")
+                        return
+                    after = (int(size), name)
+                keys = [(len(rooms[name].members) + len(rooms[name].remote_members), name) for name in names]
+                selected, more = select_page(keys, after, query.limit, query.sort == '-size')
+                page = [name for _, name in selected]
+                cursor = f"{selected[-1][0]}:{selected[-1][1]}" if more else None
 
-    def list_room_members(self, client_socket, room_name):
-        #List members of a specific room
-        with self.lock:
-            if room_name not in self.rooms:
-                client_socket.send(f"ERROR: Room '{room_name}' does not exist.\n".encode())
-                return
-            
-            members = self.rooms[room_name]
-            if not members:
-                client_socket.send(f"INFO: No members in room '{room_name}'.\n".encode())
+        if not page:
+            if query.after is not None:
+                client.send(b"INFO: No more rooms.\n")
+            elif query.pattern is not None:
+                client.send(f"INFO: No rooms match '{query.pattern}'.\n".encode())
             else:
-                member_list = f"Members in room '{room_name}':\n"
-                for member_socket in members:
-                    nickname = self.clients[member_socket]['nickname']
-                    member_list += f" - {nickname}\n" # Get the nickname of each member in the room
-                client_socket.send(member_list.encode())
+                client.send(b"INFO: No rooms available.\n")
+            return
+
+        lines = []
+        for name in page:
+            room = rooms[name]
+            lines.append(f" - {name} ({len(room.members) + len(room.remote_members)} members)\n") # Get the name of each room and the number of members in it
+        self.send_listing(client, "ROOMS:\n", lines, cursor)
+
+    def list_room_members(self, client, room_name, options=None):
+        #WHO <room> [pattern] [sort=name|-name] [limit=N] [after=CURSOR]: one page of the members
+        #of a room by nickname, ignoring case, from its member snapshot, which only takes the room lock to recopy after a change
+        try:
+            query = parse_query((options,), MEMBER_SORTS)
+        except ValueError as e:
+            client.send(f"ERROR: WHO: {e}.\n".encode())
+            return
+
+        room = self.rooms.get(room_name)
+        if room is None:
+            client.send(f"ERROR: Room '{room_name}' does not exist.\n".encode())
+            return
+
+        members = room.member_snapshot()
+        remote_members = room.remote_members
+        if not members and not remote_members:
+            client.send(f"INFO: No members in room '{room_name}'.\n".encode())
+            return
+
+        if query.pattern is not None:
+            query.pattern = nick_key(query.pattern)
+        #Select on the nickname keys alone, which the nickname index keeps unique, then look up
+        #the page's nicknames. A member that disconnected after the snapshot was taken is skipped.
+        keys = [session.key for session in map(self.sessions.get, members) if session is not None]
+        remote = {nick_key(nickname): nickname for _, nickname in remote_members}
+        keys += remote
+        keys = filter_names(keys, query)
+        after = nick_key(query.after) if query.after is not None else None
+        selected, more = select_page(keys, after, query.limit, query.sort == '-name')
+
+        lines = []
+        nicknames = self.nicknames
+        for key in selected:
+            session = nicknames.get(key)
+            if session is not None and session.id in members:
+                lines.append(f" - {session.nickname}\n")
+            elif key in remote:
+                lines.append(f" - {remote[key]}\n")
+        if not lines:
+            if query.after is not None:
+                client.send(f"INFO: No more members in room '{room_name}'.\n".encode())
+            else:
+                client.send(f"INFO: No members in room '{room_name}' match '{query.pattern}'.\n".encode())
+            return
+        self.send_listing(client, f"Members in room '{room_name}':\n", lines, selected[-1] if more else None)
+
+    def send_listing(self, client, header, lines, cursor=None):
+        #Stream a LIST/WHO page out in chunks of about LISTING_CHUNK bytes, ending with the cursor
+        #of the next page if there is one
+        chunk = [header]
+        size = len(header)
+        for line in lines:
+            chunk.append(line)
+            size += len(line)
+            if size >= LISTING_CHUNK:
+                client.send("".join(chunk).encode())
+                chunk = []
+                size = 0
+        if cursor is not None:
+            chunk.append(f"MORE: after={cursor}\n")
+        if chunk:
+            client.send("".join(chunk).encode())
 
-    def send_room_message(self, client_socket, room_name, message):
+    def send_room_message(self, client, room_name, message):
         #Send a message to all clients in a specific room
-        with self.lock:
-            if room_name not in self.rooms:
-                client_socket.send(f"ERROR: Room '{room_name}' does not exist.\n".encode())
+        room = self.rooms.get(room_name)
+        if room is None:
+            client.send(f"ERROR: Room '{room_name}' does not exist.\n".encode())
+            return
+
+        session = self.clients[client]
+        if session.id not in room.members:
+            client.send(f"ERROR: You are not in room '{room_name}'.\n".encode())
+            return
+
+        if room.bucket is not None:
+            with room.lock:
+                allowed = room.bucket.take()
+            if not allowed:
+                self.metrics.rate_limited['room'] = self.metrics.rate_limited.get('room', 0) + 1
+                client.send(f"ERROR: Room '{room_name}' is busy, message not sent.\n".encode())
                 return
-            
-            if client_socket not in self.rooms[room_name]:
-                client_socket.send(f"ERROR: You are not in room '{room_name}'.\n".encode())
+
+        nickname = session.nickname
+        if self.bus is not None:
+            #The bus orders messages across workers, ours are delivered when the hub sends them back
+            if not self.bus.publish_message(session.id, room_name, nickname, message):
+                client.send(f"ERROR: Message to '{room_name}' not sent, the server is shutting down.\n".encode())
                 return
-            
-            nickname = self.clients[client_socket]['nickname']
-            full_message = f"[{room_name}] {nickname}: {message}\n"
-            self.broadcast_to_room(room_name, full_message, exclude=client_socket)
-            
-            client_socket.send(f"MESSAGE_SENT: [{room_name}] {message}\n".encode())
+        else:
+            full_message = f"[{room_name}] {nickname}: {message}\n".encode()
+            with room.lock:  # Only this room is serialized, so every member sees its messages in the same order
+                room.history.append(full_message)
+                if self.wal is not None:
+                    self.wal.append(MSG, room_name, nickname, full_message)
+                self.broadcast_to_room(room, full_message, exclude=session.id)
+                if self.federation is not None:
+                    self.federation.publish('MSG', room_name, nickname, message)
+
+        client.send(f"MESSAGE_SENT: [{room_name}] {message}\n".encode())
 
-    def broadcast_to_room(self, room_name, message, exclude=None):
-        #Broadcast a message to all members of a room
-        if room_name not in self.rooms:
+    def send_private_message(self, client, nickname, message):
+        #PRIVMSG: deliver a message to one client, found through the nickname index without taking any lock
+        target = self.nicknames.get(nick_key(nickname))
+        if target is not None:
+            try:
+                target.connection.send(f"PRIVMSG {self.clients[client].nickname}: {message}\n".encode())
+            except ConnectionError:
+                target = None  # Disconnecting
+        if target is None:
+            client.send(f"ERROR: No such nickname '{nickname}'.\n".encode())
             return
-        
-        for client_socket in self.rooms[room_name].copy():
-            if client_socket != exclude:
+
+        client.send(f"PRIVMSG_SENT: [{target.nickname}] {message}\n".encode())
+
+    def change_nickname(self, client, nickname):
+        #NICK: rename a registered client and tell the rooms it is in
+        session = self.clients[client]
+        old = session.nickname
+        key = nick_key(nickname)
+        with self.lock:
+            holder = self.nicknames.get(key)
+            if holder is not None and holder is not session:
+                client.send(NICKNAME_IN_USE)
+                return
+            #Add the new key before removing the old one, so a lookup without the lock always finds the session
+            self.nicknames[key] = session
+            if session.key != key:
+                del self.nicknames[session.key]
+            session.nickname = nickname
+            session.key = key
+
+        client.send(f"SUCCESS: You are now known as {nickname}.\n".encode())
+        notice = f"NOTIFICATION: {old} is now known as {nickname}.\n".encode()
+        for room_name in session.rooms:
+            room = self.rooms.get(room_name)
+            if room is not None:
+                with room.lock:
+                    self.broadcast_to_room(room, notice, session.id)
+        self.propagate('NICK', old, nickname)
+        log.debug("%s is now known as %s", old, nickname)
+
+    def broadcast_to_room(self, room, message, exclude=None):
+        #Broadcast a message to all members of a room except the session id exclude, callers hold room.lock
+        members = room.members
+        if not members:
+            return
+
+        data = message.encode() if isinstance(message, str) else message  # Encode once, every queue shares the same bytes
+        self.metrics.fanout.observe(len(members) - (exclude in members))
+        failed = None
+        for session_id, member in members.items():  # Nothing changes members while room.lock is held, so no copy is needed
+            if session_id != exclude:
                 try:
-                    client_socket.send(message.encode())
+                    member.send(data)
                 except:
-                    #client disconnected, remove from room
-                    with self.lock:
-                        if room_name in self.rooms:
-                            self.rooms[room_name].discard(client_socket)  # Remove disconnected client from the room]
+                    failed = failed or []
+                    failed.append(session_id)
+
+        if failed:
+            #client disconnected, remove from room
+            room.remove_members(failed)
+
+    def send_history(self, client, room_name, count=None):
+        #HISTORY: send a member the recent messages of a room
+        room = self.rooms.get(room_name)
+        if room is None:
+            client.send(f"ERROR: Room '{room_name}' does not exist.\n".encode())
+            return
+
+        if self.clients[client].id not in room.members:
+            client.send(f"ERROR: You are not in room '{room_name}'.\n".encode())
+            return
+
+        if count is not None:
+            try:
+                count = int(count)
+            except ValueError:
+                client.send(b"ERROR: HISTORY count must be a number.\n")
+                return
+
+        with room.lock:
+            self.replay_history(client, room, count)
+
+    def replay_history(self, client, room, count=None):
+        #Send recent messages of a room to one client, callers hold room.lock
+        entries = room.history.last(count)
+        if not entries:
+            client.send(f"INFO: No history for room '{room.name}'.\n".encode())
+            return
+
+        client.send(b"".join([f"HISTORY: Last {len(entries)} messages in room '{room.name}':\n".encode(), *entries,
+                              f"END HISTORY '{room.name}'\n".encode()]))
+
+    def restore_log(self):
+        #Rebuild rooms and history from the write-ahead log, compact it and start appending to it
+        started = perf_counter()
+        state = recover(self.wal.path, self.history_size)
+        rooms = {}
+        for room_name, lines in state.rooms.items():
+            room = self.new_room(room_name)
+            for line in lines:
+                room.history.append(line)
+            rooms[room_name] = room
+        self.rooms = rooms
+        self.room_names = SortedNames(rooms)
+
+        self.wal.compact(state)
+        self.wal.start()
+        log.info("Recovered %d rooms from %d log records in %.2fs", len(rooms), state.records, perf_counter() - started)
+
+    def add_room(self, room):
+        #Callers hold self.lock. Setting a key is atomic, so lookups need no lock; the index is
+        #replaced by a new snapshot, which copies one chunk of it. The mapping goes first, so
+        #every indexed name is in it.
+        self.rooms[room.name] = room
+        self.room_names = self.room_names.add(room.name)
+
+    def all_rooms(self):
+        #Every room, from the index snapshot, so rooms created meanwhile do not upset the loop
+        rooms = self.rooms
+        return [rooms[name] for name in self.room_names]
+
+    def new_room(self, room_name):
+        return Room(room_name, RoomHistory(self.history_size, self.history_bytes, self.history_budget),
+                    self.rate_limits.room_bucket())
+
+    def ensure_room(self, room_name):
+        #Return the room, creating it if another worker announced it first
+        room = self.rooms.get(room_name)
+        if room is not None:
+            return room
+
+        with self.lock:
+            room = self.rooms.get(room_name)
+            if room is None:
+                room = self.new_room(room_name)
+                self.add_room(room)
+                if self.wal is not None:
+                    self.wal.append(CREATE, room_name)
+        return room
+
+    def remote_join(self, origin, room_name, nickname):
+        #A client on another worker joined a room
+        room = self.ensure_room(room_name)
+        with room.lock:
+            room.remote_members = room.remote_members | {(origin, nickname)}
+            self.broadcast_to_room(room, f"NOTIFICATION: {nickname} has joined the room '{room_name}'.\n")
+
+    def remote_leave(self, origin, room_name, nickname):
+        #A client on another worker left a room
+        room = self.rooms.get(room_name)
+        if room is None:
+            return
+        with room.lock:
+            if (origin, nickname) in room.remote_members:
+                room.remote_members = room.remote_members - {(origin, nickname)}
+                self.broadcast_to_room(room, f"NOTIFICATION: {nickname} has left the room '{room_name}'.\n")
+
+    def remote_quit(self, origin, nickname):
+        #A client on another worker disconnected
+        member = (origin, nickname)
+        leave_msg = f"NOTIFICATION: {nickname} disconnected.\n".encode()
+        for room in self.all_rooms():
+            if member in room.remote_members:
+                with room.lock:
+                    room.remote_members = room.remote_members - {member}
+                    self.broadcast_to_room(room, leave_msg)
+
+    def remote_nick(self, origin, old, new):
+        #A client on another worker or server changed its nickname
+        member = (origin, old)
+        notice = f"NOTIFICATION: {old} is now known as {new}.\n".encode()
+        for room in self.all_rooms():
+            if member in room.remote_members:
+                with room.lock:
+                    room.remote_members = (room.remote_members - {member}) | {(origin, new)}
+                    self.broadcast_to_room(room, notice)
+
+    def remote_drop(self, origin, reason=None):
+        #Another worker or server went away, along with all of its clients
+        for room in self.all_rooms():
+            gone = [nickname for member_origin, nickname in room.remote_members if member_origin == origin]
+            if not gone:
+                continue
+            with room.lock:
+                room.remote_members = frozenset(m for m in room.remote_members if m[0] != origin)
+                for nickname in gone:
+                    if reason:
+                        self.broadcast_to_room(room, f"NOTIFICATION: {nickname} disconnected ({reason}).\n")
+                    else:
+                        self.broadcast_to_room(room, f"NOTIFICATION: {nickname} disconnected.\n")
+
+    def remote_message(self, room_name, nickname, message, exclude=None):
+        #Deliver a room message from another worker or server to our members of the room
+        room = self.rooms.get(room_name)
+        if room is None:
+            return
+        full_message = f"[{room_name}] {nickname}: {message}\n".encode()
+        with room.lock:
+            room.history.append(full_message)
+            if self.wal is not None:
+                self.wal.append(MSG, room_name, nickname, full_message)
+            self.broadcast_to_room(room, full_message, exclude=exclude)
+
+    def send_stats(self, client):
+        #STATS: server metrics, for clients connected from this machine
+        host = client.address[0] if isinstance(client.address, tuple) else None
+        try:
+            local = host is not None and ipaddress.ip_address(host).is_loopback
+        except ValueError:
+            local = False
+        if not local:
+            client.send(b"ERROR: STATS is only available from localhost.\n")
+            return
+
+        lines = self.metrics.summary(self.metrics_gauges())
+        client.send(("\n".join(lines) + "\nEND STATS\n").encode())
+
+    def negotiate_capabilities(self, client, subcommand, capabilities=''):
+        #CAP LS lists what the server offers; CAP REQ switches the connection to frames, compressed
+        #with zlib if asked. The ACK is the last plain line: from then on the server sends frames
+        #and expects them, so the client waits for it before sending any.
+        subcommand = subcommand.upper()
+        if subcommand == 'LS':
+            client.send(f"CAP LS: {' '.join(CAPABILITIES)}\n".encode())
+            return
+        if subcommand != 'REQ':
+            client.send(b"ERROR: CAP: expected LS or REQ.\n")
+            return
+
+        requested = capabilities.lower().split()
+        unknown = [name for name in requested if name not in CAPABILITIES]
+        if not requested or unknown:
+            client.send(f"CAP NAK: {capabilities}\n".encode())
+            return
+        if client.encoder is not None:
+            client.send(b"ERROR: CAP: frames are already on.\n")
+            return
+
+        compress = 'zlib' in requested
+        decoder = FrameDecoder(self.max_line_length, stream=compress)
+        client.use_frames(f"CAP ACK: {' '.join(requested)}\n".encode(),
+                          self.frame_encoders['zlib' if compress else 'frames'], decoder)
 
-    def send_help(self, client_socket):
+    def send_help(self, client):
         #Send help message to the client
-        help_message = (
-            "Available commands:\n"
-            " - CREATE <room_name>: Create a new room.\n"
-            " - JOIN <room_name>: Join an existing room.\n"
-            " - LEAVE <room_name>: Leave a room.\n"
-            " - LIST: List all available rooms.\n"
-            " - WHO <room_name>: List members of a room.\n"
-            " - MSG <room_name> <message>: Send a message to a room.\n"
-            " - QUIT: Disconnect from the server.\n"
-            " - HELP: Show this help message.\n"
-        )
-        client_socket.send(help_message.encode())
-
-    def disconnect_client(self, client_socket):
+        client.send(HELP_MESSAGE)
+
+    def disconnect_client(self, client, reason=None):
         #Disconnect a client and clean up
+        if self.timers is not None:
+            self.timers.cancel(client)
         with self.lock:
-            if client_socket not in self.clients:
-                try:
-                    client_socket.close()  # Close the client socket if it was already removed
-                except:
-                    pass
-                return  # Client already disconnected
-            
-            nickname = self.clients[client_socket]['nickname']
-            rooms = self.clients[client_socket]['rooms'].copy()
+            self.connections.discard(client)
+            session = self.clients.pop(client, None)
+            if session is not None:
+                del self.sessions[session.id]
+                if self.nicknames.get(session.key) is session:
+                    del self.nicknames[session.key]  # Remove nickname mapping
 
+        if session is None:
+            try:
+                client.close()  # Close the client socket if it was already removed
+            except:
+                pass
+            return  # Client already disconnected
+
+        nickname = session.nickname
+        if reason:
+            leave_msg = f"NOTIFICATION: {nickname} disconnected ({reason}).\n".encode()
+        else:
+            leave_msg = f"NOTIFICATION: {nickname} disconnected.\n".encode()
 
-            #Remove from all rooms
-            for room_name in rooms:
-                if room_name in self.rooms:
-                    self.rooms[room_name].discard(client_socket)
+        #Remove from all rooms, one room lock at a time
+        for room_name in session.rooms:
+            room = self.rooms.get(room_name)
+            if room is not None:
+                with room.lock:
+                    room.remove_members((session.id,))
+                    if self.wal is not None:
+                        self.wal.append(LEAVE, room_name, nickname)
                     # Notify other clients in the room
-                    leave_msg = f"NOTIFICATION: {nickname} disconnected.\n"
-                    self.broadcast_to_room(room_name, leave_msg)
+                    self.broadcast_to_room(room, leave_msg)
 
-            #Clean up client data
-            if client_socket in self.clients:
-                del self.clients[client_socket]
-            if nickname in self.nicknames:
-                del self.nicknames[nickname]  # Remove nickname mapping
+        self.propagate('QUIT', nickname)
+        log.debug("Client %s disconnected%s", nickname, f" ({reason})" if reason else "")
 
-            print(f"Client {nickname} disconnected")
+        try:
+            client.close()  # Close the client socket
+        except:
+            pass
+
+    def close_clients(self):
+        #Send every client the shutdown notice and close it once its queue is flushed. After a
+        #handoff only the connections that stayed behind are left to close: the ones handed
+        #over are detached and refuse the notice.
+        with self.lock:
+            clients = list(self.clients.keys())
 
+        notice = RESTARTING if self.handed_off else SHUTTING_DOWN
+        for client in clients:
             try:
-                client_socket.close()  # Close the client socket
+                client.send(notice)
+                client.close()
             except:
                 pass
+        return clients
 
-    def shutdown(self):
-        #Shutdown the server
-        print("\nShutting down the server...")
+    def track(self, client):
+        #Add a new connection to those a handoff moves; during one it is told to reconnect instead
+        with self.lock:
+            if not self.frozen:
+                self.connections.add(client)
+                return True
+        client.send(RESTARTING)
+        client.close()
+        return False
+
+    def stop(self):
+        #Make the engine stop serving, from any thread; shutdown() follows
         self.running = False
+        self.thawed.set()
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.stopped.set)
+        elif self.wakeup is not None:
+            try:
+                self.wakeup[1].send(b'\0')  # Wake the accept loop so it sees running is False
+            except OSError:
+                pass
+
+    def hand_over(self, channel):
+        #A new process asked to take over (called on the HandoffListener's thread): freeze, send
+        #it the listening sockets, rooms and connections, and stop once it confirms, leaving the
+        #connections open. If it goes away before confirming, carry on serving.
+        message, _ = receive_message(channel)
+        if message is None or message.get('type') != 'takeover':
+            return
+        log.info("Handing over to process %s", message.get('pid'))
+        started = perf_counter()
+        clients = self.freeze()
+        try:
+            listeners = self.listening_sockets()
+            send_message(channel, self.snapshot(listeners), [listener for listener, _ in listeners])
+            entries = [self.snapshot_client(client) for client in clients]
+            for i in range(0, len(clients), MAX_FDS):
+                send_message(channel, {'type': 'clients', 'clients': entries[i:i + MAX_FDS]},
+                             [client.writer.get_extra_info('socket') if self.loop is not None else client.sock
+                              for client in clients[i:i + MAX_FDS]])
+            send_message(channel, {'type': 'end'})
+            reply, _ = receive_message(channel)
+            if reply is None or reply.get('type') != 'ready':
+                raise ConnectionResetError("The new process went away before taking over")
+        except (OSError, ValueError) as e:
+            log.warning("Handoff failed, resuming: %s", e)
+            self.resume()
+            return
+
+        log.info("Handed over %d connections in %.2fs", len(clients), perf_counter() - started)
+        self.handed_off = True
+        self.call_soon(self.detach_clients, clients)
+        #Let go of what the new process binds itself before it hears from us again
+        if self.metrics_endpoint is not None:
+            self.metrics_endpoint.close()
+        self.handoff_listener.close()
+        self.stop()
 
-        #Disconnect all clients
+    def freeze(self):
+        #Stop accepting, stop the timers and the readers of the connections that can move, and
+        #drain every queue, for up to drain_timeout; returns the connections ready to hand over
+        if self.loop is not None:
+            return asyncio.run_coroutine_threadsafe(self.freeze_async(), self.loop).result()
+
+        self.thawed.clear()
+        movable = self.pick_movable()
+        if self.wakeup is not None:
+            self.wakeup[1].send(b'\0')  # The accept loop sees frozen and waits for the outcome
+        os.write(self.freeze_pipe[1], b'\0')  # Readers wake up and stop if their connection is moving
+        deadline = time.monotonic() + self.drain_timeout
+        with self.freeze_cond:
+            self.freeze_cond.wait_for(lambda: len(self.frozen_readers) == len(movable),
+                                      self.drain_timeout)
+        if self.wal is not None:
+            self.wal.close()  # Written out and fsynced, for the new process to append to
+        while not all(client.flushed for client in movable) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return self.frozen_ready()
+
+    async def freeze_async(self):
+        #freeze() on the asyncio engine, run on the event loop. Reading is paused and a reader
+        #is only cancelled while it waits for data, so nothing it took off the socket is lost.
+        movable = self.pick_movable()
+        for server, tls in self.async_servers:
+            for listener in server.sockets:
+                self.frozen_listeners.append((socket.socket(fileno=os.dup(listener.fileno())), tls))
+            server.close()  # Our copy of the socket stays open for the new process or a resume
+        self.async_servers = []
+        for client in movable:
+            client.writer.transport.pause_reading()
+        deadline = time.monotonic() + self.drain_timeout
+        while not all(client.idle for client in movable) and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)  # Readers woken by data that came before the pause finish with it
+        stopping = [client for client in movable if client.idle]
+        for client in stopping:
+            client.reader_task.cancel()
+        if stopping:
+            await asyncio.wait([client.reader_task for client in stopping], timeout=1.0)
+        for client in stopping:
+            #idle is still set between data waking a reader and the reader running: keep that
+            #data after the partial line, for the new process (or a resume) to run first
+            client.framer.buffer += await client.read_buffered()
+        if self.wal is not None:
+            self.wal.close()
+        while not all(client.flushed for client in movable) and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        return self.frozen_ready()
+
+    def pick_movable(self):
+        #Freeze, and mark the connections that can move to a new process. TLS and compressed
+        #streams keep state that cannot leave this one, so those clients are asked to reconnect.
         with self.lock:
-            for client_socket in list(self.clients.keys()):
+            self.frozen = True
+            connections = list(self.connections)
+        movable = []
+        for client in connections:
+            if client.tls or getattr(client.framer, 'stream', None) is not None:
                 try:
-                    client_socket.send(b"SERVER: Server is shutting down.\n")
-                    client_socket.close()
-                except:
+                    client.send(RESTARTING)
+                    client.close()
+                except Exception:
                     pass
+            elif not client.closing:
+                movable.append(client)
+        with self.freeze_cond:
+            for client in movable:
+                client.handoff = True
+        self.frozen_clients = movable
+        return movable
+
+    def stop_reading(self, client):
+        #Called by a reader leaving for a handoff; False if the handoff was called off meanwhile
+        with self.freeze_cond:
+            if not client.handoff:
+                return False
+            self.frozen_readers.add(client)
+            self.freeze_cond.notify_all()
+            return True
+
+    def frozen_ready(self):
+        #The frozen connections with their reader stopped and nothing left to send; a
+        #connection that did not get there in time stays behind
+        ready = [client for client in self.frozen_clients if client in self.frozen_readers and client.flushed]
+        if len(ready) < len(self.frozen_clients):
+            log.warning("%d connections could not be drained for the handoff",
+                        len(self.frozen_clients) - len(ready))
+        return ready
+
+    def resume(self):
+        #The handoff failed: serve the frozen connections again and go back to accepting
+        if self.loop is not None:
+            asyncio.run_coroutine_threadsafe(self.resume_async(), self.loop).result()
+            return
+        with self.freeze_cond:
+            os.read(self.freeze_pipe[0], 1)
+            stopped = self.thaw_clients()
+        for client in stopped:
+            self.start_reader(client)
+        self.thaw()
 
-        if self.socket:
-            self.socket.close()
-        print("Server shut down complete.")
+    async def resume_async(self):
+        for listener, tls in self.frozen_listeners:
+            await self.serve_socket(listener, tls)
+        self.frozen_listeners = []
+        for client in self.frozen_clients:
+            if not client.closing:
+                client.writer.transport.resume_reading()
+        with self.freeze_cond:
+            stopped = self.thaw_clients()
+        for client in stopped:
+            if self.handle_buffered(client):
+                client.reader_task = asyncio.ensure_future(self.read_client_async(client))
+        self.thaw()
+
+    def thaw_clients(self):
+        #Callers hold self.freeze_cond. Returns the connections whose reader has to be restarted.
+        for client in self.frozen_clients:
+            client.handoff = False
+        stopped = list(self.frozen_readers)
+        self.frozen_readers.clear()
+        self.frozen_clients = []
+        return stopped
+
+    def thaw(self):
+        if self.wal is not None:
+            self.wal.start()
+        with self.lock:
+            self.frozen = False
+        self.thawed.set()
+        log.info("Serving again")
+
+    def detach_clients(self, clients):
+        #The new process has the connections: stop writing to them and close our descriptors
+        #without shutting the connections down
+        for client in clients:
+            if self.timers is not None:
+                self.timers.cancel(client)
+            client.detach()
+        for listener, _ in self.frozen_listeners:
+            listener.close()
+
+    def listening_sockets(self):
+        #(socket, speaks TLS) of every port this server accepts on
+        return self.frozen_listeners if self.loop is not None else self.listeners
+
+    def snapshot(self, listeners):
+        #What a new process needs besides the connections: rooms with their members and history,
+        #where session ids continue, and what each listening socket is for
+        rooms = []
+        for name in self.room_names:
+            room = self.rooms[name]
+            with room.lock:
+                rooms.append({'name': name, 'members': list(room.members),
+                              'history': [line.decode() for line in room.history.last()]})
+        return {'type': 'state', 'rooms': rooms, 'next_session_id': next(self.session_ids),
+                'listeners': [{'tls': tls} for _, tls in listeners]}
+
+    def snapshot_client(self, client):
+        #One connection: its session, its framing, and whatever it sent that was read but not yet run
+        session = self.clients.get(client)
+        return {
+            'address': list(client.address),
+            'session': None if session is None else {'id': session.id, 'nickname': session.nickname,
+                                                     'rooms': list(session.rooms)},
+            'frames': client.encoder is not None,
+            'input': base64.b64encode(client.framer.buffer).decode(),
+            'discarding': getattr(client.framer, 'discarding', False),
+        }
+
+    def adopt(self, handover):
+        #Take over the rooms of the process this one replaces, before starting; the engine
+        #takes over its listening sockets and connections when it starts
+        state = handover.state
+        rooms = {}
+        for entry in state['rooms']:
+            room = self.new_room(entry['name'])
+            for line in entry['history']:
+                room.history.append(line.encode())
+            rooms[room.name] = room
+        self.rooms = rooms
+        self.room_names = SortedNames(rooms)
+        self.session_ids = itertools.count(state['next_session_id'])
+        self.adopted = handover
+
+    def adopt_clients(self, clients):
+        #Give the handed over connections, as (entry, connection), their framing and sessions
+        #back, and put them back in their rooms in the order the members joined. Returns the
+        #connections to start reading; one whose input ended with QUIT is already gone.
+        for entry, client in clients:
+            if entry['frames']:
+                client.framer = FrameDecoder(self.max_line_length)
+                client.encoder = self.frame_encoders['frames']
+            else:
+                client.framer = LineFramer(self.max_line_length)
+                client.framer.discarding = entry['discarding']
+            client.framer.buffer += base64.b64decode(entry['input'])
+
+            host = client.address[0]
+            with self.lock:
+                self.connection_count += 1
+                self.connections_per_ip[host] = self.connections_per_ip.get(host, 0) + 1
+                self.connections.add(client)
+                saved = entry['session']
+                if saved is not None:
+                    session = Session(saved['id'], saved['nickname'], nick_key(saved['nickname']), client,
+                                      self.rate_limits.client_buckets() or None, self.rate_limits.strikes_bucket())
+                    session.rooms = tuple(self.rooms[name].name for name in saved['rooms'] if name in self.rooms)
+                    self.clients[client] = session
+                    self.sessions[session.id] = session
+                    self.nicknames[session.key] = session
+            self.watch(client)
+
+        for entry in self.adopted.state['rooms']:
+            room = self.rooms[entry['name']]
+            with room.lock:
+                room.members = {session_id: self.sessions[session_id].connection
+                                for session_id in entry['members'] if session_id in self.sessions}
+                room.snapshot = None
+
+        #Run the complete commands that came with the input, now that the rooms are back
+        reading = [client for _, client in clients if self.handle_buffered(client)]
+        log.info("Took over %d rooms and %d connections", len(self.rooms), len(clients))
+        self.adopted = None
+        return reading
+
+    def handle_buffered(self, client):
+        #Run the complete commands a handoff left in a connection's framer buffer, before its
+        #reader starts again. False if that disconnected the client (a QUIT, or a bad frame).
+        if not client.framer.buffer:
+            return True
+        try:
+            if self.handle_lines(client, client.framer.feed(b'')):
+                return True
+        except ValueError as e:
+            log.warning("Error handling client %s: %s", client.address, e)
+        self.disconnect_client(client)
+        self.release(client.address)
+        return False
+
+    def shutdown(self):
+        #Shutdown the server: stop accepting, tell every client, and give the writers up to
+        #drain_timeout to flush what they have queued. Runs once; later calls return at once.
+        with self.lock:
+            if self.shut_down:
+                return
+            self.shut_down = True
+        log.info("Shutting down the server...")
+        self.running = False
+        self.thawed.set()
+        if self.wakeup is not None:
+            try:
+                self.wakeup[1].send(b'\0')  # Wake the accept loop so it sees running is False
+            except OSError:
+                pass
+        for listener, _ in self.listeners:
+            listener.close()
+        for server, _ in self.async_servers:
+            server.close()
+        if self.handoff_listener is not None:
+            self.handoff_listener.close()
+
+        clients = self.close_clients()
+        if self.engine == 'thread':
+            #Give the writer threads time to flush their queues and the shutdown notice
+            deadline = time.monotonic() + self.drain_timeout
+            for client in clients:
+                client.wait_closed(max(0.0, deadline - time.monotonic()))
+
+        if self.federation is not None:
+            self.federation.close()
+        if self.metrics_endpoint is not None:
+            self.metrics_endpoint.close()
+        if self.wal is not None:
+            self.wal.close()  # Writes and fsyncs whatever is still queued
+        log.info("Server shut down complete.")
+
+
+def raise_fd_limit():
+    #Raise the soft open-file limit to the hard limit so one process can hold many client sockets
+    try:
+        import resource
+    except ImportError:
+        return  # Not available on Windows
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            pass
 
 def main():
         #Main function to start the server
-        server = IRCServer()
+        parser = argparse.ArgumentParser(description="IRC chat server")
+        parser.add_argument('--host', default='localhost', help="Address to bind to (default: localhost)")
+        parser.add_argument('--port', type=int, default=6667, help="Port to listen on (default: 6667)")
+        parser.add_argument('--engine', choices=ENGINES, default='thread',
+                            help="thread = one thread per client, asyncio = single event loop (scales to 10k+ clients)")
+        parser.add_argument('--queue-size', type=int, default=1024,
+                            help="Messages a client may have waiting to be sent (default: 1024)")
+        parser.add_argument('--slow-consumer', choices=SLOW_CONSUMER_POLICIES, default='drop_oldest',
+                            help="What to do when a client's queue is full (default: drop_oldest)")
+        parser.add_argument('--block-timeout', type=float, default=5.0,
+                            help="Seconds the block policy waits before disconnecting the client (default: 5)")
+        parser.add_argument('--max-line', type=int, default=MAX_LINE_LENGTH,
+                            help=f"Longest command line accepted, in bytes (default: {MAX_LINE_LENGTH})")
+        parser.add_argument('--backlog', type=int, default=1024,
+                            help="Pending connections the kernel queues before accept (default: 1024)")
+        parser.add_argument('--max-connections', type=int, default=0,
+                            help="Connections served at once, 0 for no limit (default: 0)")
+        parser.add_argument('--max-per-ip', type=int, default=0,
+                            help="Connections served at once from one address, 0 for no limit (default: 0)")
+        parser.add_argument('--ping-interval', type=float, default=60.0,
+                            help="Seconds of silence after which a client is sent a PING, 0 to turn keepalives off (default: 60)")
+        parser.add_argument('--ping-timeout', type=float, default=60.0,
+                            help="Seconds a client has to answer a PING before it is disconnected (default: 60)")
+        parser.add_argument('--tls-port', type=int, default=None,
+                            help="Also accept TLS connections on this port (needs --tls-cert)")
+        parser.add_argument('--tls-cert', default=None, metavar='PATH',
+                            help="PEM certificate chain for the TLS port, with the key unless --tls-key is given")
+        parser.add_argument('--tls-key', default=None, metavar='PATH', help="PEM private key for the TLS port")
+        parser.add_argument('--tls-handshake-timeout', type=float, default=HANDSHAKE_TIMEOUT,
+                            help=f"Seconds a TLS client has to finish its handshake (default: {HANDSHAKE_TIMEOUT:g})")
+        parser.add_argument('--drain-timeout', type=float, default=5.0,
+                            help="Seconds to flush what clients have queued when shutting down or handing over (default: 5)")
+        parser.add_argument('--handoff', default=None, metavar='PATH',
+                            help="Unix socket for zero-downtime restarts: a server started with the same path takes "
+                                 "over this one's port, connections and rooms")
+        parser.add_argument('--workers', type=int, default=1,
+                            help="Worker processes sharing the port through SO_REUSEPORT (default: 1)")
+        parser.add_argument('--history-size', type=int, default=100,
+                            help="Messages of history kept per room, 0 to disable (default: 100)")
+        parser.add_argument('--history-bytes', type=int, default=64 * 1024,
+                            help="Bytes of history kept per room (default: 65536)")
+        parser.add_argument('--history-total-bytes', type=int, default=64 * 1024 * 1024,
+                            help="Bytes of history kept by all rooms together (default: 64 MiB)")
+        parser.add_argument('--history-on-join', type=int, default=0,
+                            help="Messages of history replayed to a client joining a room (default: 0, off)")
+        parser.add_argument('--log', default=None, metavar='PATH',
+                            help="Write-ahead log of room events; rooms and history are recovered from it at startup")
+        parser.add_argument('--log-sync-interval', type=float, default=0.0,
+                            help="Seconds between fsyncs of the log, 0 to fsync every batch (default: 0)")
+        parser.add_argument('--msg-rate', type=float, default=0.0,
+                            help="MSG/PRIVMSG commands per second allowed from one client, 0 for no limit (default: 0)")
+        parser.add_argument('--msg-burst', type=int, default=10, help="Burst allowed above --msg-rate (default: 10)")
+        parser.add_argument('--join-rate', type=float, default=0.0,
+                            help="CREATE/JOIN/LEAVE/NICK commands per second allowed from one client, 0 for no limit (default: 0)")
+        parser.add_argument('--join-burst', type=int, default=5, help="Burst allowed above --join-rate (default: 5)")
+        parser.add_argument('--room-rate', type=float, default=0.0,
+                            help="Messages per second allowed into one room, 0 for no limit (default: 0)")
+        parser.add_argument('--room-burst', type=int, default=50, help="Burst allowed above --room-rate (default: 50)")
+        parser.add_argument('--flood-strikes', type=int, default=0,
+                            help="Rate-limited commands after which a client is disconnected, 0 to never disconnect "
+                                 "(one strike is forgiven per second; default: 0)")
+        parser.add_argument('--metrics-port', type=int, default=None,
+                            help="Serve Prometheus metrics on 127.0.0.1:PORT")
+        parser.add_argument('--log-level', default='INFO', choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'),
+                            help="DEBUG also logs every connection, join and leave (default: INFO)")
+        parser.add_argument('--name', default=None,
+                            help="Name of this server in a federated network (default: host:port)")
+        parser.add_argument('--link-port', type=int, default=None,
+                            help="Port other servers link to")
+        parser.add_argument('--peer', action='append', default=[], metavar='HOST:PORT',
+                            help="Link port of a server to link to (repeatable)")
+        args = parser.parse_args()
+        federated = args.link_port is not None or args.peer
+        if federated and args.workers > 1:
+            parser.error("--link-port/--peer cannot be combined with --workers")
+        if args.log and args.workers > 1:
+            parser.error("--log cannot be combined with --workers")
+        if args.tls_port is not None and args.tls_cert is None:
+            parser.error("--tls-port needs --tls-cert")
+        if args.metrics_port is not None and args.workers > 1:
+            parser.error("--metrics-port cannot be combined with --workers, use STATS on each worker")
+        if args.handoff and (args.workers > 1 or federated):
+            parser.error("--handoff cannot be combined with --workers or --link-port/--peer")
+
+        options = dict(engine=args.engine, max_queue=args.queue_size, slow_consumer=args.slow_consumer,
+                       block_timeout=args.block_timeout, max_line_length=args.max_line,
+                       history_size=args.history_size, history_bytes=args.history_bytes,
+                       history_total_bytes=args.history_total_bytes, history_on_join=args.history_on_join,
+                       rate_limits=RateLimits(args.msg_rate, args.msg_burst, args.join_rate, args.join_burst,
+                                              args.room_rate, args.room_burst, args.flood_strikes),
+                       backlog=args.backlog, max_connections=args.max_connections, max_per_ip=args.max_per_ip,
+                       ping_interval=args.ping_interval, ping_timeout=args.ping_timeout,
+                       tls_port=args.tls_port, tls_cert=args.tls_cert, tls_key=args.tls_key,
+                       tls_handshake_timeout=args.tls_handshake_timeout, drain_timeout=args.drain_timeout)
+        if args.workers > 1:
+            from irc_cluster import run_cluster
+            run_cluster(args.workers, args.host, args.port, log_level=args.log_level, **options)
+            return
+
+        listener = start_logging(args.log_level)
+        server = IRCServer(args.host, args.port, **options)
+        if federated:
+            from irc_federation import Federation, parse_peer
+            server.federation = Federation(server, args.name or f"{args.host}:{args.port}",
+                                           args.host, args.link_port, [parse_peer(peer) for peer in args.peer])
+        handover = None
+        if args.handoff:
+            #A server already running at this path hands us its port, connections and rooms
+            try:
+                handover = take_over(args.handoff)
+            except (OSError, ValueError) as e:
+                log.error("Taking over from the running server failed: %s", e)
+                listener.stop()
+                sys.exit(1)
+            if handover is not None:
+                server.adopt(handover)
+            server.handoff_listener = HandoffListener(args.handoff, server.hand_over)
+        if args.log:
+            server.wal = WriteAheadLog(args.log, args.log_sync_interval)
+            if handover is None:
+                server.restore_log()
+            else:
+                server.wal.start()  # The old process wrote its log out before handing over, and it already holds the rooms
+        if args.metrics_port is not None:
+            server.metrics_endpoint = MetricsEndpoint(server, port=args.metrics_port)
+        if handover is not None:
+            handover.finish()  # The old process lets go of its ports and exits
 
+        #SIGTERM (what service managers send) shuts down as gracefully as Ctrl-C
+        signal.signal(signal.SIGTERM, lambda signum, frame: signal.raise_signal(signal.SIGINT))
         try:
             server.start()
         except KeyboardInterrupt:
-            print("\nReceived interrupt signal")
+            log.info("Received interrupt signal")
         finally:
             server.shutdown()
+            listener.stop()  # Writes out the queued log records
 
     
 if __name__ == "__main__":
@@ -0,0 +1,62 @@
+import threading
+from math import ceil
+
+
+class TimerWheel:
+    #Hashed timer wheel: a ring of slots, one per tick, each holding the timers that expire in
+    #it. Scheduling and cancelling are a dict insert and delete, and a tick only looks at the
+    #timers in the current slot, so neither depends on how many timers there are. A timer set
+    #further out than one turn of the wheel waits in its slot for the turns it has left.
+    def __init__(self, tick=1.0, slots=512):
+        self.tick = tick  # Seconds per slot
+        self.slots = [{} for _ in range(slots)]  # Per slot: key -> tick number it expires on
+        self.where = {}  # key -> slot index, for cancelling
+        self.now = 0  # Ticks advanced so far
+        self.lock = threading.Lock()  # Timers are set from connection threads and expired from the ticking thread
+
+    def __len__(self):
+        return len(self.where)
+
+    def schedule(self, key, delay):
+        #Set the timer of key to expire delay seconds (rounded up to whole ticks) from now,
+        #replacing one it already has
+        self.schedule_many((key,), delay)
+
+    def schedule_many(self, keys, delay):
+        #schedule() for several keys with the same delay, taking the lock once
+        ticks = max(1, ceil(delay / self.tick))
+        slots = self.slots
+        where = self.where
+        with self.lock:
+            due = self.now + ticks
+            index = due % len(slots)
+            slot = slots[index]
+            for key in keys:
+                previous = where.get(key)
+                if previous is not None:
+                    del slots[previous][key]
+                slot[key] = due
+                where[key] = index
+
+    def cancel(self, key):
+        with self.lock:
+            index = self.where.pop(key, None)
+            if index is not None:
+                del self.slots[index][key]
+
+    def advance(self):
+        #Move on one tick, returns the keys whose timers expired
+        with self.lock:
+            self.now += 1
+            index = self.now % len(self.slots)
+            slot = self.slots[index]
+            self.slots[index] = {}
+            expired = []
+            where = self.where
+            for key, due in slot.items():
+                if due <= self.now:
+                    expired.append(key)
+                    del where[key]
+                else:
+                    self.slots[index][key] = due  # Due on a later turn of the wheel
+        return expired
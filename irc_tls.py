@@ -0,0 +1,167 @@
+import os
+import socket
+import ssl
+import subprocess
+import threading
+
+from irc_framing import RECV_SIZE
+
+TLS_TICKETS = 2  # TLS 1.3 session tickets sent after each handshake, for the client to resume with
+HANDSHAKE_TIMEOUT = 10.0  # Seconds a new connection has to finish its TLS handshake
+
+
+def server_context(certfile, keyfile=None):
+    #Server side TLS settings: TLS 1.2 or newer, and session resumption so a client that
+    #reconnects skips the certificate and signature. OpenSSL keeps a session cache for TLS
+    #1.2 and sends tickets for TLS 1.3; both are on by default, the ticket count is set here.
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.load_cert_chain(certfile, keyfile)
+    context.num_tickets = TLS_TICKETS
+    return context
+
+
+def client_context(cafile=None, verify=True):
+    #Client side TLS settings: cafile trusts a self-signed server certificate, verify=False
+    #accepts any certificate (for tests only)
+    context = ssl.create_default_context(cafile=cafile)
+    if not verify:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+def make_self_signed(directory, hostname='localhost'):
+    #Write a self-signed certificate for hostname and 127.0.0.1 with its key into directory,
+    #for tests and benchmarks; returns (certfile, keyfile). The ssl module cannot make
+    #certificates, so this runs the openssl command line tool. The key is ECDSA P-256,
+    #which signs handshakes much faster than RSA.
+    certfile = os.path.join(directory, 'cert.pem')
+    keyfile = os.path.join(directory, 'key.pem')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'ec', '-pkeyopt', 'ec_paramgen_curve:prime256v1',
+                    '-nodes', '-days', '30', '-subj', f'/CN={hostname}',
+                    '-addext', f'subjectAltName=DNS:{hostname},IP:127.0.0.1',
+                    '-keyout', keyfile, '-out', certfile],
+                   check=True, capture_output=True)
+    return certfile, keyfile
+
+
+class TLSSocket:
+    #A connected socket speaking TLS through an ssl.SSLObject and memory buffers. The thread
+    #engine and ChatClient read a connection on one thread while another writes it, which a
+    #single OpenSSL connection does not allow; here the TLS state is only touched under a
+    #lock and the socket reads and writes happen outside it. Offers the socket methods the
+    #connections use: recv, recv_into, sendall, shutdown and close.
+    def __init__(self, sock, context, server_side=False, server_hostname=None, session=None):
+        self.sock = sock
+        try:
+            #The handshake ends with small writes in a row (the last handshake message, tickets,
+            #the first command or reply); with Nagle's algorithm each would wait for an ACK
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError:
+            pass
+        self.incoming = ssl.MemoryBIO()  # Received bytes waiting to be decrypted
+        self.outgoing = ssl.MemoryBIO()  # TLS records waiting to be sent
+        self.tls = context.wrap_bio(self.incoming, self.outgoing, server_side, server_hostname, session)
+        self.lock = threading.Lock()  # Guards self.tls and both buffers
+        self.send_lock = threading.Lock()  # Taken before self.lock by whoever sends, so records go out in order
+
+    @property
+    def session(self):
+        #The TLS session to resume with on the next connection (ssl.SSLSession), once known
+        with self.lock:
+            return self.tls.session
+
+    @property
+    def session_reused(self):
+        return self.tls.session_reused
+
+    def version(self):
+        return self.tls.version()
+
+    def do_handshake(self, timeout=None):
+        #Run the handshake on the calling thread; raises ssl.SSLError, or OSError (including
+        #TimeoutError) if the connection fails or the peer takes longer than timeout
+        self.sock.settimeout(timeout)
+        try:
+            while True:
+                with self.lock:
+                    try:
+                        self.tls.do_handshake()
+                        done = True
+                    except ssl.SSLWantReadError:
+                        done = False
+                self.flush()
+                if done:
+                    return
+                data = self.sock.recv(RECV_SIZE)
+                if not data:
+                    raise ConnectionResetError("Connection closed during the TLS handshake")
+                with self.lock:
+                    self.incoming.write(data)
+        finally:
+            self.sock.settimeout(None)
+
+    def flush(self):
+        #Send the TLS records that are waiting
+        with self.send_lock:
+            with self.lock:
+                records = self.outgoing.read()
+            if records:
+                self.sock.sendall(records)
+
+    def read(self, size, buffer=None):
+        #Decrypted data: up to size bytes, or the count read into buffer. Empty (or 0) at the
+        #end of the connection, whether or not the peer said goodbye with close_notify.
+        while True:
+            with self.lock:
+                try:
+                    received = self.tls.read(size, buffer) if buffer is not None else self.tls.read(size)
+                except ssl.SSLWantReadError:
+                    received = None
+                except (ssl.SSLZeroReturnError, ssl.SSLEOFError):
+                    received = b'' if buffer is None else 0
+                replies = self.outgoing.pending  # Post-handshake messages such as a TLS 1.3 key update
+            if replies:
+                self.flush()
+            if received is not None:
+                return received
+
+            data = self.sock.recv(RECV_SIZE)
+            with self.lock:
+                if data:
+                    self.incoming.write(data)
+                else:
+                    self.incoming.write_eof()
+
+    def recv(self, size):
+        return self.read(size)
+
+    def recv_into(self, buffer, size=0):
+        return self.read(size or len(buffer), buffer)
+
+    def sendall(self, data):
+        with self.send_lock:
+            with self.lock:
+                self.tls.write(data)
+                records = self.outgoing.read()
+            self.sock.sendall(records)
+
+    def shutdown(self, how):
+        self.sock.shutdown(how)
+
+    def close(self):
+        #Send close_notify if the socket takes it at once, then close the socket
+        with self.lock:
+            try:
+                self.tls.unwrap()
+            except (ssl.SSLError, ValueError):
+                pass  # Still waiting for the peer's close_notify, or the handshake never finished
+            records = self.outgoing.read()
+        if records:
+            try:
+                self.sock.setblocking(False)
+                self.sock.send(records)
+            except OSError:
+                pass
+        self.sock.close()
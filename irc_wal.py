@@ -0,0 +1,187 @@
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+from typing import Dict, Iterator, List, Tuple
+
+#Record kinds
+CREATE = 1
+JOIN = 2
+LEAVE = 3
+MSG = 4
+
+#Every record is a fixed header followed by the room name, the nickname and the data:
+#crc32 of everything after the crc, kind, room length, nickname length, data length.
+#For MSG the data is the encoded line that was broadcast, so recovery can put it straight into the history.
+RECORD = struct.Struct('<IBHHI')
+MAX_PENDING_BYTES = 16 * 1024 * 1024  # Unwritten records before appenders wait for the disk
+
+
+def encode_record(kind, room_name, nickname=b'', data=b''):
+    body = RECORD.pack(0, kind, len(room_name), len(nickname), len(data))[4:] + room_name + nickname + data
+    return struct.pack('<I', zlib.crc32(body)) + body
+
+
+def read_records(path) -> Iterator[Tuple[int, bytes, bytes, bytes]]:
+    #Yield (kind, room name, nickname, data) as bytes for every intact record in a log. The file is
+    #mmapped rather than read, so recovering a large log does not copy it into memory first. Reading stops at
+    #the first short or corrupt record: a torn write at the end of the log from a crash.
+    try:
+        log_file = open(path, 'rb')
+    except FileNotFoundError:
+        return
+
+    with log_file:
+        size = os.fstat(log_file.fileno()).st_size
+        if size == 0:
+            return
+
+        with mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            header_size = RECORD.size
+            crc32 = zlib.crc32
+            offset = 0
+            while offset + header_size <= size:
+                crc, kind, room_length, nickname_length, data_length = RECORD.unpack_from(view, offset)
+                start = offset + header_size
+                end = start + room_length + nickname_length + data_length
+                if end > size or crc32(view[offset + 4:end]) != crc:
+                    break
+
+                nickname_start = start + room_length
+                data_start = nickname_start + nickname_length
+                yield kind, view[start:nickname_start], view[nickname_start:data_start], view[data_start:end]
+                offset = end
+
+
+class LogState:
+    #What recovery rebuilds from a log: the rooms in creation order and each room's recent messages
+    def __init__(self, history_size):
+        self.rooms: Dict[str, deque] = {}  # room name -> its last history_size MSG lines
+        self.history_size = history_size
+        self.records = 0
+
+    def apply(self, kind, room_name, data):
+        self.records += 1
+        if kind == CREATE:
+            self.rooms.setdefault(room_name.decode(), deque(maxlen=self.history_size))
+        elif kind == MSG:
+            lines = self.rooms.get(room_name.decode())
+            if lines is not None:
+                lines.append(data)
+        #JOIN and LEAVE are kept for the record; the members' connections did not survive the restart
+
+
+def recover(path, history_size):
+    #Rebuild the rooms and recent history of a log
+    state = LogState(history_size)
+    for kind, room_name, _, data in read_records(path):
+        state.apply(kind, room_name, data)
+    return state
+
+
+class WriteAheadLog:
+    #Append-only log of room events. append() only queues the encoded record; a writer thread
+    #writes whatever has queued up in one write and then fsyncs (group commit), so a burst of
+    #messages costs one fsync rather than one each. With sync_interval > 0 the log is fsynced at
+    #most that often, trading the last interval of a crash for throughput.
+    def __init__(self, path, sync_interval=0.0):
+        self.path = path
+        self.sync_interval = sync_interval
+        self.fd = None
+        self.running = False
+        self.thread = None
+        self.condition = threading.Condition()
+        self.pending: List[bytes] = []
+        self.pending_bytes = 0
+        self.records = 0  # Records written
+        self.syncs = 0  # fsync calls made
+
+    def start(self):
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self.running = True
+        self.thread = threading.Thread(target=self.write_loop, daemon=True)
+        self.thread.start()
+
+    def append(self, kind, room_name, nickname='', data=b''):
+        record = encode_record(kind, room_name.encode(), nickname.encode(), data)
+        with self.condition:
+            if not self.running:
+                return  # Closed during shutdown
+            while self.pending_bytes > MAX_PENDING_BYTES and self.running:
+                self.condition.wait()  # The disk is behind; wait rather than grow without bound
+            self.pending.append(record)
+            self.pending_bytes += len(record)
+            self.condition.notify_all()
+
+    def write_loop(self):
+        last_sync = time.monotonic()
+        unsynced = False
+        while True:
+            with self.condition:
+                while not self.pending and self.running:
+                    timeout = None
+                    if unsynced:
+                        timeout = max(0.0, last_sync + self.sync_interval - time.monotonic())
+                    if not self.condition.wait(timeout) and unsynced:
+                        break  # Nothing new, but unsynced records are due
+                batch = self.pending
+                self.pending = []
+                self.pending_bytes = 0
+                running = self.running
+                self.condition.notify_all()
+
+            if batch:
+                self.write_all(b''.join(batch))
+                self.records += len(batch)
+                unsynced = True
+
+            now = time.monotonic()
+            if unsynced and (not running or now - last_sync >= self.sync_interval):
+                os.fsync(self.fd)
+                self.syncs += 1
+                last_sync = now
+                unsynced = False
+
+            if not running and not batch:
+                break
+
+    def write_all(self, data):
+        view = memoryview(data)
+        while view:
+            written = os.write(self.fd, view)
+            view = view[written:]
+
+    def compact(self, state):
+        #Replace the log with just the rooms and history recovery kept, so the log (and the next
+        #startup) does not grow with every message ever sent. Written beside it and renamed over
+        #it, so a crash part way leaves the old log in place.
+        temp_path = self.path + '.compact'
+        with open(temp_path, 'wb') as log_file:
+            for room_name, lines in state.rooms.items():
+                name = room_name.encode()
+                log_file.write(encode_record(CREATE, name))
+                for line in lines:
+                    log_file.write(encode_record(MSG, name, b'', line))
+            log_file.flush()
+            os.fsync(log_file.fileno())
+        os.replace(temp_path, self.path)
+
+        directory = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        try:
+            os.fsync(directory)  # Make the rename itself durable
+        finally:
+            os.close(directory)
+
+    def close(self):
+        #Write and fsync everything queued, then close the file
+        with self.condition:
+            if not self.running:
+                return
+            self.running = False
+            self.condition.notify_all()
+        self.thread.join()
+        os.close(self.fd)
+        self.fd = None
@@ -0,0 +1,104 @@
+#Tests for irc_framing: lines and frames split across reads
+#
+#    python -m pytest tests
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from irc_framing import FrameDecoder, FrameEncoder, LineFramer, StreamEncoder, frame, split_payloads  # noqa: E402
+
+
+def feed_bytes(framer, data):
+    #Feed data one byte at a time, the worst a socket can do; returns every line framed
+    lines = []
+    for i in range(len(data)):
+        lines += framer.feed(data[i:i + 1])
+    return lines
+
+
+class LineFramerTest(unittest.TestCase):
+    def test_pipelined_lines(self):
+        framer = LineFramer()
+        self.assertEqual(framer.feed(b"JOIN a\nMSG a hi\r\nMSG a"), ["JOIN a", "MSG a hi"])
+        self.assertEqual(framer.feed(b" there\n"), ["MSG a there"])
+        self.assertEqual(framer.buffer, b'')
+
+    def test_crlf_split_across_reads(self):
+        framer = LineFramer()
+        self.assertEqual(framer.feed(b"HELP\r"), [])
+        self.assertEqual(framer.feed(b"\nLIST\r"), ["HELP"])
+        self.assertEqual(framer.feed(b"\n"), ["LIST"])
+
+    def test_utf8_split_across_reads(self):
+        data = "MSG a café ☃\n".encode()
+        self.assertEqual(feed_bytes(LineFramer(), data), ["MSG a café ☃"])
+
+    def test_overlong_line_in_one_read(self):
+        framer = LineFramer(max_line_length=10)
+        self.assertEqual(framer.feed(b"x" * 20 + b"\nHELP\n"), [None, "HELP"])
+
+    def test_overlong_line_across_reads(self):
+        #Reported once when it goes over the limit, then skipped up to its line ending
+        framer = LineFramer(max_line_length=10)
+        self.assertEqual(framer.feed(b"x" * 8), [])
+        self.assertEqual(framer.feed(b"x" * 8), [None])
+        self.assertTrue(framer.discarding)
+        self.assertEqual(framer.feed(b"x" * 30), [])
+        self.assertEqual(framer.feed(b"xx\nHE"), [])
+        self.assertFalse(framer.discarding)
+        self.assertEqual(framer.feed(b"LP\n"), ["HELP"])
+
+    def test_line_at_the_limit(self):
+        framer = LineFramer(max_line_length=10)
+        self.assertEqual(framer.feed(b"x" * 10 + b"\n"), ["x" * 10])
+        self.assertEqual(framer.feed(b"x" * 11 + b"\n"), [None])
+
+
+class FrameTest(unittest.TestCase):
+    def test_frames_split_across_reads(self):
+        data = frame(b"JOIN a\nMSG a hi") + frame(b"HELP\n")
+        self.assertEqual(feed_bytes(FrameDecoder(), data), ["JOIN a", "MSG a hi", "HELP"])
+
+    def test_compressed_frames_round_trip(self):
+        lines = [f"MSG room message number {i} with some words in it" for i in range(50)]
+        data = '\n'.join(lines).encode() + b'\n'
+        encoded = FrameEncoder(compress=True).encode(data)
+        self.assertLess(len(encoded), len(data))
+        self.assertEqual(FrameDecoder().feed(encoded), lines)
+
+    def test_stream_round_trip(self):
+        encoder = StreamEncoder(compress=True)
+        decoder = FrameDecoder(stream=True)
+        for i in range(5):
+            encoded = encoder.encode(f"MSG room hello {i}\n".encode())
+            self.assertEqual(feed_bytes(decoder, encoded), [f"MSG room hello {i}"])
+
+    def test_split_payloads_at_lines(self):
+        data = (b"x" * 99 + b"\n") * 30
+        payloads = list(split_payloads(data, 1000))
+        self.assertEqual(b''.join(payloads), data)
+        self.assertTrue(all(len(payload) <= 1000 and payload.endswith(b"\n") for payload in payloads))
+        encoded = b''.join(frame(payload) for payload in payloads)
+        self.assertEqual(FrameDecoder(max_frame=1000).feed(encoded), ["x" * 99] * 30)
+
+    def test_split_payloads_without_line_ending(self):
+        self.assertEqual(list(split_payloads(b"x" * 25, 10)), [b"x" * 10, b"x" * 10, b"x" * 5])
+
+    def test_overlong_line_in_frame(self):
+        decoder = FrameDecoder(max_line_length=10)
+        self.assertEqual(decoder.feed(frame(b"x" * 20 + b"\nHELP\n")), [None, "HELP"])
+
+    def test_frame_too_long(self):
+        with self.assertRaises(ValueError):
+            FrameDecoder(max_frame=100).feed(frame(b"x" * 101))
+
+    def test_bad_compressed_payload(self):
+        with self.assertRaises(ValueError):
+            FrameDecoder().feed(frame(b"not deflate at all", True))
+
+
+if __name__ == '__main__':
+    unittest.main()
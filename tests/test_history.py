@@ -0,0 +1,80 @@
+#Tests for irc_history: per-room bounds, and the server-wide budget trimming the quietest room first
+#
+#    python -m pytest tests
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from irc_history import HistoryBudget, RoomHistory  # noqa: E402
+
+
+def line(room, i):
+    return f"[{room}] m{i:04}\n".encode()  # 10 bytes for a one letter room name
+
+
+class RoomHistoryTest(unittest.TestCase):
+    def test_message_and_byte_bounds(self):
+        history = RoomHistory(3, 25, HistoryBudget(10000))
+        for i in range(5):
+            history.append(line('a', i))
+        self.assertEqual(history.last(), [line('a', 3), line('a', 4)])  # 30 bytes would be over 25
+        self.assertEqual(history.size, 20)
+        self.assertEqual(history.budget.used, 20)
+        self.assertEqual(history.last(1), [line('a', 4)])
+        self.assertEqual(history.last(0), [])
+
+    def test_oversized_message_is_not_kept(self):
+        history = RoomHistory(3, 9, HistoryBudget(10000))
+        history.append(line('a', 0))
+        self.assertEqual(len(history), 0)
+
+
+class HistoryBudgetTest(unittest.TestCase):
+    def test_quietest_room_is_trimmed_first(self):
+        budget = HistoryBudget(100)
+        quiet = RoomHistory(100, 1000, budget)
+        older = RoomHistory(100, 1000, budget)
+        busy = RoomHistory(100, 1000, budget)
+        for i in range(3):
+            quiet.append(line('q', i))
+        for i in range(3):
+            older.append(line('o', i))
+        for i in range(4):
+            busy.append(line('b', i))
+        self.assertEqual(budget.used, 100)
+
+        #Over budget: the room that went longest without a message pays, oldest message first
+        busy.append(line('b', 4))
+        self.assertEqual(quiet.last(), [line('q', 1), line('q', 2)])
+        self.assertEqual(len(older), 3)
+        self.assertEqual(len(busy), 5)
+        self.assertEqual(budget.used, 100)
+
+        #Once it is empty, the next quietest room gives way; the appending room keeps everything
+        for i in range(5, 9):
+            busy.append(line('b', i))
+        self.assertEqual(len(quiet), 0)
+        self.assertEqual(older.last(), [line('o', 2)])
+        self.assertEqual(busy.last(), [line('b', i) for i in range(9)])
+        self.assertEqual(budget.used, 100)
+        self.assertEqual(list(budget.rooms), [older, busy])  # The emptied room left the line
+
+        #A room that speaks again goes to the back of the line, and the busy room is now the quietest
+        older.append(line('o', 3))
+        self.assertEqual(list(budget.rooms), [busy, older])
+        self.assertEqual(busy.last()[0], line('b', 1))
+
+    def test_room_alone_trims_itself(self):
+        budget = HistoryBudget(30)
+        history = RoomHistory(100, 1000, budget)
+        for i in range(5):
+            history.append(line('a', i))
+        self.assertEqual(history.last(), [line('a', 2), line('a', 3), line('a', 4)])
+        self.assertEqual(budget.used, 30)
+
+
+if __name__ == '__main__':
+    unittest.main()
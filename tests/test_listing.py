@@ -0,0 +1,124 @@
+#Tests for irc_listing: LIST/WHO queries, the sorted name index and paging with cursors
+#
+#    python -m pytest tests
+
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import irc_listing  # noqa: E402
+from irc_listing import ListingQuery, SortedNames, filter_names, page_sorted, parse_query, select_page  # noqa: E402
+
+NAMES = [f"{word}{i}" for word in ('alpha', 'beta', 'gamma', 'general') for i in range(40)]
+
+
+def all_pages(next_page):
+    #Follow cursors from the first page to the last; next_page(after) returns (page, cursor)
+    pages = []
+    after = None
+    while True:
+        page, after = next_page(after)
+        pages.append(page)
+        if after is None:
+            return pages
+
+
+class ParseQueryTest(unittest.TestCase):
+    def test_arguments(self):
+        query = parse_query(['gen*', 'sort=-size limit=5', 'after=3:general7'], ('name', '-name', 'size', '-size'))
+        self.assertEqual((query.pattern, query.sort, query.limit, query.after), ('gen*', '-size', 5, '3:general7'))
+        self.assertTrue(query.glob)
+        self.assertEqual(query.prefix(), 'gen')
+
+    def test_defaults(self):
+        query = parse_query([], ('name', '-name'))
+        self.assertEqual((query.pattern, query.sort, query.limit, query.after),
+                         (None, 'name', irc_listing.DEFAULT_LIMIT, None))
+
+    def test_errors(self):
+        for args in (['sort=size'], ['limit=0'], ['limit=many'], ['a', 'b']):
+            with self.assertRaises(ValueError):
+                parse_query(args, ('name', '-name'))
+
+
+class SortedNamesTest(unittest.TestCase):
+    def setUp(self):
+        self.chunk = irc_listing.CHUNK
+        irc_listing.CHUNK = 4  # Small chunks, so a few names split them
+
+    def tearDown(self):
+        irc_listing.CHUNK = self.chunk
+
+    def test_add_keeps_order_and_old_snapshot(self):
+        names = SortedNames()
+        shuffled = list(NAMES)
+        random.Random(1).shuffle(shuffled)
+        snapshots = []
+        for name in shuffled:
+            snapshots.append(names)
+            names = names.add(name)
+        self.assertEqual(list(names), sorted(NAMES))
+        self.assertEqual(len(names), len(NAMES))
+        self.assertTrue(all(len(chunk) < 8 for chunk in names.chunks))
+        for count, snapshot in enumerate(snapshots):
+            self.assertEqual(list(snapshot), sorted(shuffled[:count]))
+
+    def test_starting_at(self):
+        names = SortedNames(NAMES)
+        expected = sorted(NAMES)
+        for key in ('', 'beta', 'beta5', 'gamma39', 'zzz', expected[7]):
+            self.assertEqual(list(names.starting_at(key)), [name for name in expected if name >= key])
+            self.assertEqual(list(names.starting_at(key, inclusive=False)), [name for name in expected if name > key])
+
+
+class PageTest(unittest.TestCase):
+    def test_page_sorted_by_name(self):
+        names = SortedNames(NAMES)
+        for pattern in (None, 'g', 'gen*', 'g*a1?', 'nothing'):
+            def next_page(after):
+                page, more = page_sorted(names, ListingQuery(pattern, limit=7, after=after))
+                return page, page[-1] if more else None
+
+            pages = all_pages(next_page)
+            expected = sorted(filter_names(NAMES, ListingQuery(pattern)))
+            self.assertEqual(sum(pages, []), expected)
+            self.assertTrue(all(len(page) == 7 for page in pages[:-1]))
+
+    def test_page_sorted_cursor_before_prefix(self):
+        #A cursor from another listing, before the prefix, starts at the prefix
+        page, more = page_sorted(SortedNames(NAMES), ListingQuery('gamma', limit=3, after='beta9'))
+        self.assertEqual((page, more), (['gamma0', 'gamma1', 'gamma10'], True))
+
+    def test_select_page_by_name(self):
+        for reverse in (False, True):
+            def next_page(after):
+                page, more = select_page(NAMES, after, 9, reverse)
+                return page, page[-1] if more else None
+
+            self.assertEqual(sum(all_pages(next_page), []), sorted(NAMES, reverse=reverse))
+
+    def test_select_page_by_size(self):
+        #Keys are (size, name), as LIST sort=size and sort=-size page them; sizes repeat
+        keys = [(i % 5, name) for i, name in enumerate(NAMES)]
+        for reverse in (False, True):
+            for limit in (1, 6, 1000):
+                def next_page(after):
+                    page, more = select_page(keys, after, limit, reverse)
+                    return page, page[-1] if more else None
+
+                self.assertEqual(sum(all_pages(next_page), []), sorted(keys, reverse=reverse))
+
+    def test_select_page_heap_path(self):
+        #Inputs over SORT_BELOW pages are heap-selected rather than sorted
+        keys = list(range(1000))
+        random.Random(2).shuffle(keys)
+        self.assertEqual(select_page(keys, 500, 3), ([501, 502, 503], True))
+        self.assertEqual(select_page(keys, 500, 3, reverse=True), ([499, 498, 497], True))
+        self.assertEqual(select_page(keys, 998, 3), ([999], False))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+#Tests for the nickname index: nicknames are unique regardless of case, through registration,
+#NICK, PRIVMSG and disconnects
+#
+#    python -m pytest tests
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from irc_server import NICKNAME_IN_USE, IRCServer, nick_key  # noqa: E402
+
+
+class RecordingConnection:
+    #Stand-in client that keeps what it is sent
+    def __init__(self):
+        self.sent = []
+        self.closed = False
+
+    def send(self, data):
+        self.sent.append(data)
+        return len(data)
+
+    def close(self):
+        self.closed = True
+
+    def last(self):
+        return self.sent[-1] if self.sent else None
+
+
+class NicknameTest(unittest.TestCase):
+    def setUp(self):
+        self.server = IRCServer()
+
+    def connect(self, nickname):
+        client = RecordingConnection()
+        registered = self.server.register_client(client, (nickname, 0), nickname)
+        return client if registered else None
+
+    def test_nick_key(self):
+        self.assertEqual(nick_key('Bob'), nick_key('bob'))
+        self.assertEqual(nick_key('STRASSE'), nick_key('straße'))
+        self.assertIs(nick_key('bob'), 'bob')  # Already folded, not copied
+
+    def test_registration_collides_regardless_of_case(self):
+        self.assertIsNotNone(self.connect('Bob'))
+        for nickname in ('bob', 'BOB', 'Bob'):
+            client = RecordingConnection()
+            self.assertFalse(self.server.register_client(client, (nickname, 0), nickname))
+            self.assertEqual(client.sent, [NICKNAME_IN_USE])
+            self.assertTrue(client.closed)
+        self.assertEqual(list(self.server.nicknames), ['bob'])
+        self.assertEqual(self.server.nicknames['bob'].nickname, 'Bob')  # Kept as it was first given
+
+    def test_privmsg_finds_any_case(self):
+        bob = self.connect('Bob')
+        alice = self.connect('alice')
+        self.assertTrue(self.server.process_message(alice, 'PRIVMSG bOB hello there'))
+        self.assertEqual(bob.last(), b"PRIVMSG alice: hello there\n")
+        self.assertEqual(alice.last(), b"PRIVMSG_SENT: [Bob] hello there\n")
+
+        self.server.process_message(alice, 'PRIVMSG carol hello')
+        self.assertEqual(alice.last(), b"ERROR: No such nickname 'carol'.\n")
+
+    def test_rename_frees_old_key(self):
+        bob = self.connect('Bob')
+        self.server.process_message(bob, 'NICK Robert')
+        self.assertEqual(bob.last(), b"SUCCESS: You are now known as Robert.\n")
+        self.assertEqual(set(self.server.nicknames), {'robert'})
+        self.assertIsNotNone(self.connect('bob'))  # The old nickname can be taken again
+        self.assertIsNone(self.connect('ROBERT'))
+
+        alice = self.connect('alice')
+        self.server.process_message(alice, 'PRIVMSG robert hi')
+        self.assertEqual(bob.last(), b"PRIVMSG alice: hi\n")
+
+    def test_rename_to_own_nickname_in_another_case(self):
+        bob = self.connect('bob')
+        session = self.server.nicknames['bob']
+        self.server.process_message(bob, 'NICK Bob')
+        self.assertEqual(bob.last(), b"SUCCESS: You are now known as Bob.\n")
+        self.assertEqual(self.server.nicknames, {'bob': session})
+        self.assertEqual(session.nickname, 'Bob')
+
+    def test_rename_onto_another_client(self):
+        bob = self.connect('Bob')
+        self.connect('alice')
+        self.server.process_message(bob, 'NICK ALICE')
+        self.assertEqual(bob.last(), NICKNAME_IN_USE)
+        self.assertEqual(self.server.nicknames['bob'].nickname, 'Bob')
+        self.assertEqual(self.server.nicknames['alice'].nickname, 'alice')
+
+    def test_disconnect_leaves_no_stale_entry(self):
+        bob = self.connect('Bob')
+        alice = self.connect('alice')
+        self.server.process_message(bob, 'NICK Robert')
+        self.server.disconnect_client(bob)
+        self.assertTrue(bob.closed)
+        self.assertEqual(set(self.server.nicknames), {'alice'})
+
+        self.server.process_message(alice, 'PRIVMSG robert hi')
+        self.assertEqual(alice.last(), b"ERROR: No such nickname 'robert'.\n")
+        robert = self.connect('robert')
+        self.assertIsNotNone(robert)
+        self.server.process_message(alice, 'PRIVMSG Robert hi')
+        self.assertEqual(robert.last(), b"PRIVMSG alice: hi\n")
+
+
+if __name__ == '__main__':
+    unittest.main()
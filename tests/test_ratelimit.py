@@ -0,0 +1,113 @@
+#Tests for irc_ratelimit: token bucket refill and bursts, and flood strikes ending in a disconnect,
+#on a clock the tests move by hand
+#
+#    python -m pytest tests
+
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from irc_ratelimit import RateLimits, TokenBucket  # noqa: E402
+from irc_server import RATE_LIMITED, IRCServer  # noqa: E402
+from test_nicknames import RecordingConnection  # noqa: E402
+
+
+class Clock:
+    #Stands in for time.monotonic in irc_ratelimit
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class ClockTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch('irc_ratelimit.monotonic', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def takes(self, bucket, count):
+        #How many of count takes in a row succeed
+        return sum(bucket.take() for _ in range(count))
+
+
+class TokenBucketTest(ClockTest):
+    def test_burst_then_empty(self):
+        bucket = TokenBucket(rate=2.0, burst=5)
+        self.assertEqual(self.takes(bucket, 10), 5)
+        self.assertFalse(bucket.take())
+
+    def test_refill_at_rate(self):
+        bucket = TokenBucket(rate=2.0, burst=5)
+        self.takes(bucket, 5)
+        self.clock.now += 0.25
+        self.assertFalse(bucket.take())  # Half a token
+        self.clock.now += 0.25
+        self.assertTrue(bucket.take())
+        self.assertFalse(bucket.take())
+        self.clock.now += 1.5
+        self.assertEqual(self.takes(bucket, 10), 3)
+
+    def test_refill_stops_at_burst(self):
+        bucket = TokenBucket(rate=2.0, burst=5)
+        self.takes(bucket, 5)
+        self.clock.now += 3600
+        self.assertEqual(self.takes(bucket, 10), 5)
+
+    def test_failed_take_uses_no_token(self):
+        bucket = TokenBucket(rate=1.0, burst=1)
+        bucket.take()
+        self.clock.now += 0.5
+        for _ in range(5):
+            self.assertFalse(bucket.take())
+        self.clock.now += 0.5
+        self.assertTrue(bucket.take())
+
+
+class FloodTest(ClockTest):
+    def setUp(self):
+        super().setUp()
+        self.server = IRCServer(rate_limits=RateLimits(msg_rate=1.0, msg_burst=2, flood_strikes=2))
+        self.client = RecordingConnection()
+        self.server.register_client(self.client, ('flood', 0), 'flood')
+        self.server.create_room(self.client, 'lobby')
+        self.server.join_room(self.client, 'lobby')
+
+    def msg(self):
+        #Send one MSG; returns whether the client stays connected and what it was sent
+        connected = self.server.process_message(self.client, 'MSG lobby hi')
+        return connected, self.client.sent[-1]
+
+    def test_strikes_end_in_disconnect(self):
+        for _ in range(2):
+            self.assertEqual(self.msg(), (True, b"MESSAGE_SENT: [lobby] hi\n"))
+        for _ in range(2):
+            self.assertEqual(self.msg(), (True, RATE_LIMITED))
+        self.assertEqual(self.msg(), (False, b"ERROR: Disconnected for flooding.\n"))
+        metrics = self.server.metrics
+        self.assertEqual((metrics.rate_limited, metrics.flood_disconnects), ({'msg': 3}, 1))
+
+    def test_strike_forgiven_each_second(self):
+        self.msg()
+        self.msg()
+        self.msg()
+        self.msg()  # Two strikes, none left
+        self.clock.now += 1.0  # One message and one strike back
+        self.assertEqual(self.msg(), (True, b"MESSAGE_SENT: [lobby] hi\n"))
+        self.assertEqual(self.msg(), (True, RATE_LIMITED))
+        self.assertEqual(self.msg(), (False, b"ERROR: Disconnected for flooding.\n"))
+
+    def test_sending_at_the_rate_is_never_limited(self):
+        for _ in range(20):
+            self.assertEqual(self.msg(), (True, b"MESSAGE_SENT: [lobby] hi\n"))
+            self.clock.now += 1.0
+        self.assertEqual(self.server.metrics.rate_limited, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+#Tests for irc_timerwheel: timers expire on their tick, including ones set more than a turn of
+#the wheel ahead, and cancelled or replaced timers do not fire
+#
+#    python -m pytest tests
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from irc_timerwheel import TimerWheel  # noqa: E402
+
+
+def expiries(wheel, ticks):
+    #Advance the wheel ticks times; returns {tick number: sorted keys expired on it}
+    expired = {}
+    for _ in range(ticks):
+        keys = wheel.advance()
+        if keys:
+            expired[wheel.now] = sorted(keys)
+    return expired
+
+
+class TimerWheelTest(unittest.TestCase):
+    def test_expire_on_their_tick(self):
+        wheel = TimerWheel(tick=1.0, slots=8)
+        wheel.schedule('a', 3)
+        wheel.schedule('b', 7)
+        wheel.schedule('c', 3)
+        self.assertEqual(len(wheel), 3)
+        self.assertEqual(expiries(wheel, 20), {3: ['a', 'c'], 7: ['b']})
+        self.assertEqual(len(wheel), 0)
+
+    def test_wrap_past_one_turn(self):
+        #Timers sharing a slot expire on their own turn of the wheel, not the first one
+        wheel = TimerWheel(tick=1.0, slots=8)
+        wheel.schedule('near', 4)
+        wheel.schedule('one turn', 12)
+        wheel.schedule('two turns', 20)
+        wheel.schedule('exactly one turn', 8)
+        self.assertEqual(expiries(wheel, 30), {4: ['near'], 8: ['exactly one turn'], 12: ['one turn'],
+                                               20: ['two turns']})
+
+    def test_schedule_after_the_wheel_has_turned(self):
+        wheel = TimerWheel(tick=1.0, slots=8)
+        expiries(wheel, 13)
+        wheel.schedule('a', 5)
+        wheel.schedule('b', 11)
+        self.assertEqual(expiries(wheel, 20), {18: ['a'], 24: ['b']})
+
+    def test_delay_rounded_up_to_ticks(self):
+        wheel = TimerWheel(tick=0.5, slots=8)
+        wheel.schedule('a', 1.2)  # 2.4 ticks
+        wheel.schedule('b', 0)  # At least one tick
+        wheel.schedule('c', 1.0)
+        self.assertEqual(expiries(wheel, 10), {1: ['b'], 2: ['c'], 3: ['a']})
+
+    def test_cancel(self):
+        wheel = TimerWheel(tick=1.0, slots=8)
+        wheel.schedule('a', 3)
+        wheel.schedule('b', 11)  # Shares a slot with 'a', a turn later
+        wheel.schedule('c', 3)
+        wheel.cancel('a')
+        wheel.cancel('b')
+        wheel.cancel('missing')
+        self.assertEqual(len(wheel), 1)
+        self.assertEqual(expiries(wheel, 20), {3: ['c']})
+
+    def test_cancel_after_part_of_a_turn(self):
+        wheel = TimerWheel(tick=1.0, slots=8)
+        wheel.schedule('a', 12)
+        expiries(wheel, 5)  # Its slot has come round once already
+        wheel.cancel('a')
+        self.assertEqual(expiries(wheel, 20), {})
+
+    def test_reschedule_replaces(self):
+        wheel = TimerWheel(tick=1.0, slots=8)
+        wheel.schedule('a', 3)
+        wheel.schedule('a', 10)
+        self.assertEqual(len(wheel), 1)
+        self.assertEqual(expiries(wheel, 20), {10: ['a']})
+
+    def test_schedule_many(self):
+        wheel = TimerWheel(tick=1.0, slots=8)
+        wheel.schedule('a', 2)
+        wheel.schedule_many(['a', 'b', 'c'], 9)
+        self.assertEqual(expiries(wheel, 20), {9: ['a', 'b', 'c']})
+
+
+if __name__ == '__main__':
+    unittest.main()
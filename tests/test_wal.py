@@ -0,0 +1,97 @@
+#Tests for irc_wal: reading a log cut short or corrupted by a crash, and compaction
+#
+#    python -m pytest tests
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from irc_wal import CREATE, JOIN, MSG, RECORD, WriteAheadLog, encode_record, read_records, recover  # noqa: E402
+
+RECORDS = [
+    (CREATE, b'lobby', b'alice', b''),
+    (JOIN, b'lobby', b'alice', b''),
+    (MSG, b'lobby', b'alice', b'[lobby] alice: hello\n'),
+    (MSG, b'lobby', b'alice', b'[lobby] alice: again\n'),
+]
+
+
+class WriteAheadLogTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'rooms.log')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, data):
+        with open(self.path, 'wb') as log_file:
+            log_file.write(data)
+
+    def test_missing_and_empty_log(self):
+        self.assertEqual(list(read_records(self.path)), [])
+        self.write(b'')
+        self.assertEqual(list(read_records(self.path)), [])
+
+    def test_append_then_read(self):
+        wal = WriteAheadLog(self.path)
+        wal.start()
+        for kind, room_name, nickname, data in RECORDS:
+            wal.append(kind, room_name.decode(), nickname.decode(), data)
+        wal.close()
+        self.assertEqual(list(read_records(self.path)), RECORDS)
+        self.assertEqual(wal.records, len(RECORDS))
+
+    def test_torn_tail_is_ignored(self):
+        #A crash part way through the last write leaves a short record, or a short header
+        data = b''.join(encode_record(*record) for record in RECORDS)
+        last = len(encode_record(*RECORDS[-1]))
+        for cut in (1, RECORD.size - 1, RECORD.size + 1, last - 1):
+            self.write(data[:len(data) - last + cut])
+            self.assertEqual(list(read_records(self.path)), RECORDS[:-1], cut)
+
+    def test_crc_mismatch_stops_reading(self):
+        records = [encode_record(*record) for record in RECORDS]
+        corrupt = bytearray(records[2])
+        corrupt[-3] ^= 0xFF  # A flipped bit in the message
+        self.write(records[0] + records[1] + bytes(corrupt) + records[3])
+        self.assertEqual(list(read_records(self.path)), RECORDS[:2])
+
+    def test_compact_then_recover(self):
+        wal = WriteAheadLog(self.path)
+        wal.start()
+        wal.append(CREATE, 'lobby', 'alice')
+        wal.append(CREATE, 'quiet', 'bob')
+        for i in range(10):
+            wal.append(JOIN, 'lobby', f'user{i}')
+            wal.append(MSG, 'lobby', f'user{i}', f'[lobby] user{i}: message {i}\n'.encode())
+        wal.append(MSG, 'gone', 'bob', b'[gone] bob: never created\n')
+        wal.close()
+
+        state = recover(self.path, history_size=3)
+        self.assertEqual(state.records, 23)
+        self.assertEqual(list(state.rooms), ['lobby', 'quiet'])
+        kept = [f'[lobby] user{i}: message {i}\n'.encode() for i in (7, 8, 9)]
+        self.assertEqual(list(state.rooms['lobby']), kept)
+        size = os.path.getsize(self.path)
+
+        wal.compact(state)
+        self.assertLess(os.path.getsize(self.path), size)
+        self.assertFalse(os.path.exists(self.path + '.compact'))
+        compacted = recover(self.path, history_size=3)
+        self.assertEqual(compacted.records, 5)  # Two CREATEs and the three messages kept
+        self.assertEqual({name: list(lines) for name, lines in compacted.rooms.items()},
+                         {'lobby': kept, 'quiet': []})
+
+        #The compacted log is appended to as before
+        wal.start()
+        wal.append(MSG, 'quiet', 'bob', b'[quiet] bob: after\n')
+        wal.close()
+        self.assertEqual(list(recover(self.path, history_size=3).rooms['quiet']), [b'[quiet] bob: after\n'])
+
+
+if __name__ == '__main__':
+    unittest.main()